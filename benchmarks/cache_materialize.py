@@ -0,0 +1,56 @@
+"""
+Compare the latency of a cache hit for each cache materialization strategy. A
+directory of ``--files`` files of ``--size`` bytes each is cached once, and then
+fetched ``--repeat`` times into fresh directories with each strategy.
+
+Usage: python -m benchmarks.cache_materialize [--files N] [--size BYTES] [--dir DIR]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import pirlib.cache
+from pirlib.cache import cache_directory, fetch_directory
+from pirlib.iotypes import DirectoryPath
+
+STRATEGIES = ["copy", "hardlink", "reflink", "symlink"]
+
+
+def make_directory(path: str, files: int, size: int) -> DirectoryPath:
+    os.makedirs(path)
+    for idx in range(files):
+        with open(os.path.join(path, f"part-{idx:05d}"), "wb") as f:
+            f.write(os.urandom(size))
+    return DirectoryPath(path)
+
+
+def run(root: str, strategy: str, repeat: int) -> float:
+    elapsed = []
+    for idx in range(repeat):
+        dst = DirectoryPath(os.path.join(root, f"{strategy}-{idx}"))
+        start = time.perf_counter()
+        assert fetch_directory(dst, "bench", strategy=strategy)
+        elapsed.append(time.perf_counter() - start)
+    return min(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=64)
+    parser.add_argument("--size", type=int, default=16 * 2**20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--dir", help="Directory to run in, e.g. on the filesystem to test.")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(dir=args.dir) as root:
+        pirlib.cache.CACHE_DIR = os.path.join(root, "cache")
+        src = make_directory(os.path.join(root, "src"), args.files, args.size)
+        cache_directory(src, "bench", strategy="copy")
+        total_mb = args.files * args.size / 2**20
+        print(f"{args.files} files, {total_mb:.0f} MiB in total")
+        for strategy in STRATEGIES:
+            print(f"{strategy}: {run(root, strategy, args.repeat) * 1000:.1f} ms per hit")
+
+
+if __name__ == "__main__":
+    main()
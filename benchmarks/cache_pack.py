@@ -0,0 +1,62 @@
+"""
+Compare the time to store and fetch a cached directory of many small files when it
+is stored as it is and when it is packed into a tar, with and without zstd. Use
+``--dir`` to run on the filesystem of interest, e.g. an NFS mount, since packing
+mostly saves per-file metadata operations on network filesystems.
+
+Usage: python -m benchmarks.cache_pack [--files N] [--size BYTES] [--dir DIR]
+"""
+import argparse
+import importlib.util
+import os
+import tempfile
+import time
+
+import pirlib.cache
+from pirlib.cache import cache_directory, fetch_directory
+from pirlib.iotypes import DirectoryPath
+
+
+def make_directory(path: str, files: int, size: int) -> DirectoryPath:
+    for idx in range(files):
+        subdir = os.path.join(path, f"{idx // 1000:03d}")
+        os.makedirs(subdir, exist_ok=True)
+        with open(os.path.join(subdir, f"pack-{idx:06d}"), "wb") as f:
+            # Half random and half repeated bytes, so that compression has some effect.
+            f.write(os.urandom(size // 2) + bytes(size - size // 2))
+    return DirectoryPath(path)
+
+
+def run(root: str, src: DirectoryPath, pack: str):
+    start = time.perf_counter()
+    assert cache_directory(src, pack, strategy="copy", pack=pack)
+    stored = time.perf_counter()
+    assert fetch_directory(DirectoryPath(os.path.join(root, f"dst-{pack}")), pack)
+    fetched = time.perf_counter()
+    size = pirlib.cache.directory_size(os.path.join(pirlib.cache.CACHE_DIR, f"DIR_{pack}"))
+    return stored - start, fetched - stored, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=20_000)
+    parser.add_argument("--size", type=int, default=4096)
+    parser.add_argument("--dir", help="Directory to run in, e.g. on the filesystem to test.")
+    args = parser.parse_args()
+    packs = ["none", "tar"]
+    if importlib.util.find_spec("zstandard") is not None:
+        packs.append("tar.zst")
+    with tempfile.TemporaryDirectory(dir=args.dir) as root:
+        pirlib.cache.CACHE_DIR = os.path.join(root, "cache")
+        src = make_directory(os.path.join(root, "src"), args.files, args.size)
+        print(f"{args.files} files of {args.size} bytes")
+        for pack in packs:
+            store, fetch, size = run(root, src, pack)
+            print(
+                f"pack={pack}: store {store:.2f} s, fetch {fetch:.2f} s, "
+                f"{size / 2**20:.0f} MiB in the cache"
+            )
+
+
+if __name__ == "__main__":
+    main()
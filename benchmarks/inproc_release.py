@@ -0,0 +1,65 @@
+"""
+Compare the peak RSS of an in-process run of a long chain of DataFrame tasks with
+``release_intermediates`` enabled and disabled. Each mode runs in a fresh
+subprocess so that their peak RSS measurements are independent.
+
+Usage: python -m benchmarks.inproc_release [--steps N] [--rows N]
+"""
+import argparse
+import resource
+import subprocess
+import sys
+
+import numpy
+import pandas
+
+from pirlib.backends.inproc import InprocBackend
+from pirlib.pipeline import pipeline
+from pirlib.task import task
+
+
+@task
+def step(df: pandas.DataFrame) -> pandas.DataFrame:
+    # Allocate a new frame of the same size, like a typical transformation would.
+    return df + 1
+
+
+def make_pipeline(steps: int):
+    @pipeline
+    def chain(df: pandas.DataFrame) -> pandas.DataFrame:
+        for idx in range(steps):
+            df = step.instance(f"step_{idx}")(df)
+        return df
+
+    return chain
+
+
+def run(steps: int, rows: int, release: bool) -> int:
+    df = pandas.DataFrame(numpy.zeros((rows, 8)))
+    chain = make_pipeline(steps)
+    backend = InprocBackend(max_workers=1, release_intermediates=release)
+    backend.execute(chain.package(), "chain", inputs={"df": df})
+    # ru_maxrss is reported in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--release", choices=["on", "off"])
+    args = parser.parse_args()
+    if args.release is not None:
+        print(run(args.steps, args.rows, args.release == "on"))
+        return
+    frame_mb = args.rows * 8 * 8 / 2**20
+    print(f"{args.steps} steps, {frame_mb:.0f} MiB per DataFrame")
+    for release in ("off", "on"):
+        command = [sys.executable, "-m", __spec__.name, "--release", release]
+        command += ["--steps", str(args.steps), "--rows", str(args.rows)]
+        result = subprocess.run(command, stdout=subprocess.PIPE, text=True, check=True)
+        print(f"release_intermediates={release}: peak RSS {int(result.stdout) / 1024:.0f} MiB")
+
+
+if __name__ == "__main__":
+    main()
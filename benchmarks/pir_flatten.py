@@ -0,0 +1,81 @@
+"""
+Measure the time to flatten a synthetic package of nested graphs: a top-level graph
+chaining ``--outer`` subgraphs, each chaining ``--inner`` subgraphs of a graph with
+a chain of ``--nodes`` nodes. Flattening the same package again hits the memo of
+flattened graphs, and only copies the result.
+
+Usage: python -m benchmarks.pir_flatten [--outer N] [--inner N] [--nodes N]
+"""
+import argparse
+import time
+
+from pirlib.pir import (
+    DataSource,
+    Entrypoint,
+    Graph,
+    GraphInput,
+    GraphOutput,
+    Input,
+    Node,
+    Output,
+    Package,
+    Subgraph,
+)
+
+
+def chain_graph(graph_id: str, items: list) -> Graph:
+    # Wire each item's input to the previous item's output, and the first item to the
+    # graph input.
+    graph = Graph(id=graph_id, inputs=[GraphInput(id="inp", iotype="DIRECTORY")])
+    source = DataSource(graph_input_id="inp")
+    for item in items:
+        item.inputs = [Input(id="inp", iotype="DIRECTORY", source=source)]
+        item.outputs = [Output(id="return", iotype="DIRECTORY")]
+        if isinstance(item, Node):
+            graph.nodes.append(item)
+            source = DataSource(node_id=item.id, output_id="return")
+        else:
+            graph.subgraphs.append(item)
+            source = DataSource(subgraph_id=item.id, output_id="return")
+    graph.outputs = [GraphOutput(id="return", iotype="DIRECTORY", source=source)]
+    return graph
+
+
+def make_package(outer: int, inner: int, nodes: int) -> Package:
+    entrypoints = {"main": Entrypoint(version="v1", handler="bench:step", runtime="python")}
+    leaf = chain_graph(
+        "leaf",
+        [Node(id=f"n{idx}", entrypoints=entrypoints, config={"idx": idx}) for idx in range(nodes)],
+    )
+    middle = chain_graph(
+        "middle", [Subgraph(id=f"s{idx}", graph_id="leaf") for idx in range(inner)]
+    )
+    top = chain_graph("top", [Subgraph(id=f"s{idx}", graph_id="middle") for idx in range(outer)])
+    return Package(graphs=[top, middle, leaf])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--outer", type=int, default=100)
+    parser.add_argument("--inner", type=int, default=10)
+    parser.add_argument("--nodes", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    package = make_package(args.outer, args.inner, args.nodes)
+    print(f"{args.outer * args.inner * args.nodes} nodes")
+    for validate in [False, True]:
+        # Touch the package so that the first call misses the memo.
+        package.graphs[0].meta.annotations = {"validate": validate}
+        start = time.perf_counter()
+        graph = package.flatten_graph("top", validate=validate)
+        first = time.perf_counter() - start
+        assert len(graph.nodes) == args.outer * args.inner * args.nodes
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            package.flatten_graph("top", validate=validate)
+        memoized = (time.perf_counter() - start) / args.repeat
+        print(f"validate={validate}: first {first:.3f} s, memoized {memoized:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compare the time to dump and load a big flattened package as YAML, the way
+``pircli`` did with ``yaml.dump`` and ``yaml.safe_load`` followed by
+``dacite.from_dict``, and in the binary package format. Then compare the time to load
+the whole package and a single graph from a package of ``--graphs`` such graphs.
+
+Usage: python -m benchmarks.pir_format [--outer N] [--inner N] [--nodes N] [--graphs N]
+"""
+import argparse
+import dataclasses
+import io
+import tempfile
+import time
+
+import dacite
+import yaml
+
+from benchmarks.pir_flatten import make_package
+from pirlib.pir import Package
+from pirlib.pir_format import decode_package, encode_package, load_package
+
+
+def timed(func, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--outer", type=int, default=100)
+    parser.add_argument("--inner", type=int, default=10)
+    parser.add_argument("--nodes", type=int, default=10)
+    parser.add_argument("--graphs", type=int, default=60)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    graph = make_package(args.outer, args.inner, args.nodes).flatten_graph("top")
+    package = Package(graphs=[graph])
+    print(f"{len(graph.nodes)} nodes")
+
+    def dump_yaml():
+        f = io.StringIO()
+        yaml.dump(dataclasses.asdict(package), f, sort_keys=False)
+        return f.getvalue()
+
+    text, dump_time = timed(dump_yaml, args.repeat)
+    loaded, load_time = timed(
+        lambda: dacite.from_dict(data_class=Package, data=yaml.safe_load(text)), args.repeat
+    )
+    assert loaded == package
+    print(f"yaml:   dump {dump_time:.3f} s, load {load_time:.3f} s, {len(text) >> 10} KiB")
+    data, dump_time = timed(lambda: encode_package(package), args.repeat)
+    loaded, load_time = timed(lambda: decode_package(data), args.repeat)
+    assert loaded == package
+    print(f"binary: dump {dump_time:.3f} s, load {load_time:.3f} s, {len(data) >> 10} KiB")
+
+    graphs = []
+    for idx in range(args.graphs):
+        graphs.append(dataclasses.replace(graph, id=f"g{idx}"))
+    data = encode_package(Package(graphs=graphs))
+    with tempfile.TemporaryFile() as f:
+        f.write(data)
+
+        def load(graph_id=None):
+            f.seek(0)
+            return load_package(f, graph_id=graph_id)
+
+        _, load_time = timed(load, 1)
+        loaded, graph_time = timed(lambda: load(f"g{args.graphs // 2}"), args.repeat)
+    assert loaded.graphs == [graphs[args.graphs // 2]]
+    print(
+        f"{args.graphs} graphs: load {load_time:.3f} s, "
+        f"load one graph {graph_time:.3f} s, {len(data) >> 10} KiB"
+    )
+
+
+if __name__ == "__main__":
+    main()
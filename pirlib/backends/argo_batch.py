@@ -1,16 +1,24 @@
 import argparse
 import base64
+import copy
 import os
 import pickle
 import re
 import sys
+import warnings
 from typing import Any, Dict, Optional, Tuple
 
 import yaml
 
 import pirlib.pir
 from pirlib.backends import Backend
-from pirlib.cache import CACHE_DIR
+from pirlib.cache import (
+    CACHE_DIR,
+    fetch_outputs,
+    generate_cache_key,
+    generate_inputs_cache_key,
+    record_lookup,
+)
 from pirlib.handlers.v1 import HandlerV1Context, HandlerV1Event
 
 
@@ -22,6 +30,18 @@ def decode(x):
     return pickle.loads(base64.b64decode(x.encode()))
 
 
+# File in which the cache check of a node records whether its outputs were cached.
+CACHE_RESULT_PATH = "/tmp/pirlib-cache-result"
+
+# File in which the cache check of a node records the cache key of the node, which is
+# passed on to the node so that it doesn't hash its inputs again.
+CACHE_KEY_PATH = "/tmp/pirlib-cache-key"
+
+# Image of the cache check steps. The checks don't import the tasks, so a small image
+# with only pirlib installed (and pandas for DATAFRAME inputs and outputs) avoids
+# pulling the image of the node. Defaults to the image of the node.
+CACHE_CHECK_IMAGE = os.getenv("PIRLIB_CACHE_CHECK_IMAGE")
+
 argo_name = lambda x: re.sub("[^a-zA-Z0-9]", "-", x.strip())
 
 
@@ -182,6 +202,56 @@ def create_template_from_node(
     return template
 
 
+def create_cache_check_template(node_template: Dict[str, Any], task_digest: str) -> Dict[str, Any]:
+    """Generates an Argo template which checks whether all outputs of a cached node are
+    in the cache, and fetches them into the node outputs if so. The node itself should
+    then only run if the ``cache`` output parameter of the check is ``miss``, and can
+    take the ``key`` output parameter instead of computing its cache key again.
+
+    The check computes the cache key from the inputs and ``task_digest`` without
+    importing the task, and runs on ``CACHE_CHECK_IMAGE`` if set.
+
+    :param node_template: Template of the cached node from :func:`create_template_from_node`.
+    :type node_template: Dict[str, Any]
+    :param task_digest: Hash of the code and the config of the node, see
+    :func:`pirlib.cache.task_digest`.
+    :type task_digest: str
+    :return: A dictionary containing the fields required to generate
+    an Argo template for the cache check.
+    :rtype: Dict[str, Any]
+    """
+    template = copy.deepcopy(node_template)
+    template["name"] = argo_name(f"{node_template['name']}-cache")
+    container = template["container"]
+    container["image"] = CACHE_CHECK_IMAGE or container["image"]
+    command = container["command"]
+    command[command.index("node")] = "check"
+    command.append(task_digest)
+    template["outputs"] = {
+        "parameters": [
+            {"name": "cache", "valueFrom": {"path": CACHE_RESULT_PATH}},
+            {"name": "key", "valueFrom": {"path": CACHE_KEY_PATH}},
+        ]
+    }
+    return template
+
+
+def _task_digest(node: pirlib.pir.Node) -> Optional[str]:
+    # The part of the cache key which depends on the code of the task is computed
+    # when generating the workflow, so that the cache check doesn't import the task.
+    try:
+        handler = _resolve_handler(node)
+    except Exception as exc:
+        warnings.warn(
+            f"the cache of node '{node.id}' is only checked when the node runs, since its "
+            f"task could not be imported: {exc!r}"
+        )
+        return None
+    if not hasattr(handler, "cache_digest"):
+        return None
+    return handler.cache_digest(node.config)
+
+
 def create_template_from_graph(
     graph_outputs_encoded: str, graph: pirlib.pir.Graph
 ) -> Dict[str, Any]:
@@ -304,6 +374,25 @@ class ArgoBatchBackend(Backend):
             # Creating a template for the current node.
             template = create_template_from_node(graph_inputs_encoded, node)
             # NOTE: Need to replace true and false with yes and no in the final string.
+            task_digest = _task_digest(node) if node.config.get("cache") else None
+            if task_digest is not None:
+                # Check the cache first, and only run the node on a miss, with the cache
+                # key computed by the check.
+                check_template = create_cache_check_template(template, task_digest)
+                templates.append(check_template)
+                check_name = check_template["name"]
+                template["dependencies"] = template["dependencies"] + [check_name]
+                template["when"] = f"{{{{tasks.{check_name}.outputs.parameters.cache}}}} == miss"
+                template["inputs"] = {"parameters": [{"name": "cache-key"}]}
+                template["container"]["command"].append("{{inputs.parameters.cache-key}}")
+                template["arguments"] = {
+                    "parameters": [
+                        {
+                            "name": "cache-key",
+                            "value": f"{{{{tasks.{check_name}.outputs.parameters.key}}}}",
+                        }
+                    ]
+                }
             templates.append(template)
 
         # Generate template for the graph.
@@ -328,6 +417,10 @@ class ArgoBatchBackend(Backend):
                 "template": f"{name}-template",
                 "dependencies": [argo_name(f"{tname}") for tname in template.pop("dependencies")],
             }
+            if "when" in template:
+                task["when"] = template.pop("when")
+            if "arguments" in template:
+                task["arguments"] = template.pop("arguments")
             dag["dag"]["tasks"].append(task)
             template["name"] += "-template"
         templates.append(dag)
@@ -347,16 +440,9 @@ class ArgoBatchBackend(Backend):
                 f.write(workflow_yaml)
 
 
-def run_node(node, graph_inputs):
-    import importlib
-    import pathlib
-
-    import pandas
-
+def _node_event(node):
     from pirlib.iotypes import DirectoryPath, FilePath
 
-    module_name, handler_name = node.entrypoints["main"].handler.split(":")
-    handler = getattr(importlib.import_module(module_name), handler_name)
     inputs = {}
     for inp in node.inputs:
         if inp.source.node_id is not None:
@@ -368,6 +454,10 @@ def run_node(node, graph_inputs):
         elif inp.iotype == "FILE":
             inputs[inp.id] = FilePath(path)
         elif inp.iotype == "DATAFRAME":
+            # Only imported for DataFrames, so that the image of the cache checks of
+            # other nodes doesn't need pandas.
+            import pandas
+
             inputs[inp.id] = pandas.read_csv(path)
         else:
             raise TypeError(f"unsupported iotype {inp.iotype}")
@@ -382,9 +472,12 @@ def run_node(node, graph_inputs):
             outputs[out.id].parents[0].mkdir(parents=True, exist_ok=True)
         else:
             outputs[out.id] = None
-    events = HandlerV1Event(inputs, outputs)
-    context = HandlerV1Context(node)
-    handler.run_handler(events, context)
+    return HandlerV1Event(inputs, outputs)
+
+
+def _write_dataframes(node, outputs):
+    import pathlib
+
     for out in node.outputs:
         path = f"/mnt/node_outputs/{node.id}/{out.id}"
         if out.iotype == "DATAFRAME":
@@ -392,6 +485,52 @@ def run_node(node, graph_inputs):
             outputs[out.id].to_csv(path)
 
 
+def _resolve_handler(node):
+    import importlib
+
+    module_name, handler_name = node.entrypoints["main"].handler.split(":")
+    return getattr(importlib.import_module(module_name), handler_name)
+
+
+def run_node(node, graph_inputs, cache_key=None):
+    handler = _resolve_handler(node)
+    events = _node_event(node)
+    # The key is empty if the cache check couldn't compute it, then the task does.
+    context = HandlerV1Context(node, cache_key=cache_key or None)
+    handler.run_handler(events, context)
+    _write_dataframes(node, events.outputs)
+
+
+def check_node(node, graph_inputs, task_digest):
+    """Fetches the outputs of a cached node into its output locations, and records
+    whether they were all cached in the file read by the ``cache`` output parameter,
+    and the cache key of the node in the file read by the ``key`` output parameter.
+    The task of the node isn't imported. A check which fails is recorded as a miss,
+    along with an empty key if it couldn't be computed, so that the node still runs.
+    """
+    cache_key, values = "", None
+    try:
+        events = _node_event(node)
+        key_file = node.config.get("cache_key_file")
+        if key_file is not None:
+            cache_key = generate_cache_key(events.inputs[key_file])
+        else:
+            cache_key = generate_inputs_cache_key(events.inputs, task_digest)
+        outputs = {out.id: (out.iotype, events.outputs[out.id]) for out in node.outputs}
+        values = fetch_outputs(outputs, cache_key)
+        if values is not None:
+            # Misses are counted when the node itself runs.
+            record_lookup(hit=True)
+            _write_dataframes(node, values)
+    except Exception as exc:
+        warnings.warn(f"failed to check the cache of node '{node.id}': {exc!r}")
+        values = None
+    with open(CACHE_RESULT_PATH, "w") as f:
+        f.write("miss" if values is None else "hit")
+    with open(CACHE_KEY_PATH, "w") as f:
+        f.write(cache_key)
+
+
 def run_graph(graph_outputs):
     import shutil
 
@@ -412,7 +551,12 @@ if __name__ == "__main__":
     if sys.argv[1] == "node":
         node = decode(sys.argv[2])
         graph_inputs = decode(sys.argv[3])
-        run_node(node, graph_inputs)
+        run_node(node, graph_inputs, *sys.argv[4:5])
+
+    elif sys.argv[1] == "check":
+        node = decode(sys.argv[2])
+        graph_inputs = decode(sys.argv[3])
+        check_node(node, graph_inputs, sys.argv[4])
 
     else:
         assert sys.argv[1] == "graph"
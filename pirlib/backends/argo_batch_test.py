@@ -0,0 +1,81 @@
+import argparse
+import pathlib
+
+import pytest
+import yaml
+import pirlib.backends.argo_batch
+from pirlib.backends.argo_batch import ArgoBatchBackend
+from pirlib.handlers.v1 import HandlerV1Event
+from pirlib.iotypes import DirectoryPath
+from pirlib.pipeline import pipeline
+from pirlib.task import task
+
+
+@task(cache=True)
+def cached_step(inp: DirectoryPath) -> DirectoryPath:
+    return task.context().output
+
+
+@task
+def plain_step(inp: DirectoryPath) -> DirectoryPath:
+    return task.context().output
+
+
+@pipeline
+def argo_pipeline(inp: DirectoryPath) -> DirectoryPath:
+    return plain_step(cached_step(inp))
+
+
+def test_cache_check_step(tmp_path, monkeypatch):
+    for var, value in [("NFS_SERVER", "nfs"), ("OUTPUT", "/out"), ("CACHE", "/cache")]:
+        monkeypatch.setenv(var, value)
+    monkeypatch.setenv("INPUT_inp", "/inp")
+    monkeypatch.setattr(pirlib.backends.argo_batch, "CACHE_CHECK_IMAGE", "pirlib:small")
+    args = argparse.Namespace(output=pathlib.Path(tmp_path / "workflow.yml"))
+    package = argo_pipeline.package()
+    ArgoBatchBackend().generate(package, args=args)
+    workflow = yaml.safe_load((tmp_path / "workflow.yml").read_text())
+    templates = {t["name"]: t for t in workflow["spec"]["templates"]}
+    check = templates["cached-step-cache-template"]
+    node = package.graphs[0].find_node("cached_step")
+    # The check runs on the small image, with the digest of the task computed ahead.
+    assert check["container"]["image"] == "pirlib:small"
+    assert check["container"]["command"][3] == "check"
+    assert check["container"]["command"][-1] == cached_step.cache_digest(node.config)
+    assert [p["name"] for p in check["outputs"]["parameters"]] == ["cache", "key"]
+    cached = templates["cached-step-template"]
+    assert "outputs" not in cached
+    assert cached["container"]["command"][-1] == "{{inputs.parameters.cache-key}}"
+    (dag,) = [t for t in workflow["spec"]["templates"] if "dag" in t]
+    tasks = {t["name"]: t for t in dag["dag"]["tasks"]}
+    assert tasks["cached-step"]["dependencies"] == ["cached-step-cache"]
+    assert tasks["cached-step"]["when"] == (
+        "{{tasks.cached-step-cache.outputs.parameters.cache}} == miss"
+    )
+    assert tasks["cached-step"]["arguments"]["parameters"] == [
+        {"name": "cache-key", "value": "{{tasks.cached-step-cache.outputs.parameters.key}}"}
+    ]
+    assert tasks["plain-step"]["dependencies"] == ["cached-step"]
+    assert "when" not in tasks["plain-step"] and "plain-step-cache" not in tasks
+
+
+def test_failed_cache_check_is_a_miss(tmp_path, monkeypatch):
+    def fail(*args):
+        raise OSError("cache unavailable")
+
+    result, key = tmp_path / "cache", tmp_path / "key"
+    monkeypatch.setattr(pirlib.backends.argo_batch, "CACHE_RESULT_PATH", str(result))
+    monkeypatch.setattr(pirlib.backends.argo_batch, "CACHE_KEY_PATH", str(key))
+    event = HandlerV1Event({"inp": DirectoryPath(tmp_path)}, {"return": DirectoryPath(tmp_path)})
+    monkeypatch.setattr(pirlib.backends.argo_batch, "_node_event", lambda node: event)
+    monkeypatch.setattr(pirlib.backends.argo_batch, "generate_inputs_cache_key", lambda *a: "k")
+    monkeypatch.setattr(pirlib.backends.argo_batch, "fetch_outputs", fail)
+    node = argo_pipeline.package().graphs[0].find_node("cached_step")
+    with pytest.warns(UserWarning, match="failed to check the cache"):
+        pirlib.backends.argo_batch.check_node(node, [], "digest")
+    assert result.read_text() == "miss" and key.read_text() == "k"
+    # Without a key, the node computes it itself.
+    monkeypatch.setattr(pirlib.backends.argo_batch, "generate_inputs_cache_key", fail)
+    with pytest.warns(UserWarning, match="failed to check the cache"):
+        pirlib.backends.argo_batch.check_node(node, [], "digest")
+    assert result.read_text() == "miss" and key.read_text() == ""
@@ -1,18 +1,76 @@
 import argparse
+import asyncio
+import collections
+import concurrent.futures
+import dataclasses
 import importlib
+import os
 import pandas
-import tempfile
-from typing import Any, Dict, Optional
+import shutil
+from typing import Any, Dict, List, Optional, Tuple
 
 import pirlib.pir
-import pirlib.iotypes
 from pirlib.backends import Backend
-from pirlib.handlers.v1 import HandlerV1Context, HandlerV1Event
+from pirlib.cache import cache_writer
+from pirlib.handlers.v1 import HandlerV1, HandlerV1Context, HandlerV1Event
 from pirlib.iotypes import DirectoryPath, FilePath
-from pirlib.utils import find_by_id
+from pirlib.journal import RunJournal
+from pirlib.workspace import Workspace
+
+
+_POOLS = {
+    "thread": concurrent.futures.ThreadPoolExecutor,
+    "process": concurrent.futures.ProcessPoolExecutor,
+}
 
 
 class InprocBackend(Backend):
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        pool: str = "thread",
+        release_intermediates: bool = True,
+        workspace_dir: Optional[str] = None,
+    ):
+        """
+        :param max_workers: Maximum number of nodes executed concurrently. Nodes are
+                dispatched to the pool as soon as all of their inputs are ready.
+                ``None`` uses the default size of the pool executor.
+        :param pool: ``"thread"`` to run nodes on a thread pool, or ``"process"`` to
+                run them on a process pool, which is better suited to CPU-bound tasks.
+                In process mode only the node and its inputs are sent to the worker,
+                and DIRECTORY and FILE outputs are passed by path.
+        :param release_intermediates: Drop each node output, and delete the temporary
+                directory or file allocated for it, as soon as its last consumer has
+                finished. Graph outputs are never released.
+        :param workspace_dir: Directory in which each run creates its scratch
+                workspace for node outputs, see :class:`~pirlib.workspace.Workspace`.
+        """
+        if max_workers is not None and max_workers < 1:
+            raise ValueError(f"max_workers must be at least 1, got {max_workers}")
+        if pool not in _POOLS:
+            raise ValueError(f"unknown pool '{pool}', expected one of {list(_POOLS)}")
+        self._max_workers = max_workers
+        self._pool = pool
+        self._release_intermediates = release_intermediates
+        self._workspace_dir = workspace_dir
+
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    @property
+    def pool(self):
+        return self._pool
+
+    @property
+    def release_intermediates(self):
+        return self._release_intermediates
+
+    @property
+    def workspace_dir(self):
+        return self._workspace_dir
+
     def execute(
         self,
         package: pirlib.pir.Package,
@@ -21,12 +79,137 @@ class InprocBackend(Backend):
         args: Optional[argparse.Namespace] = None,
         *,  # Keyword-only arguments below.
         inputs: Optional[Dict[str, Any]] = None,
+        targets: Optional[List[str]] = None,
+        run_id: Optional[str] = None,
+        resume: Optional[str] = None,
     ) -> None:
+        """
+        Execute a graph of the package in the current process.
+
+        :param package: Package containing the graph.
+        :param graph_name: ID of the graph to execute.
+        :param config: Unused.
+        :param args: Parsed ``pircli execute`` arguments providing inputs, outputs and
+                ``--only-output`` targets.
+        :param inputs: Values of the graph inputs.
+        :param targets: IDs of the graph outputs to compute. Only the nodes these
+                outputs depend on are executed, and only their graph inputs are
+                required. Defaults to all graph outputs.
+        :param run_id: Record the run in a journal under this ID so that it can be
+                resumed if it fails. The run's workspace is kept on failure.
+        :param resume: ID of a failed run to resume. Nodes which that run completed
+                are skipped and their outputs are reloaded from its journal.
+        :return: Values of the (targeted) graph outputs.
+        """
+        graph = self._prepare_graph(package, graph_name, args, targets)
+        inputs = self._load_inputs(graph, inputs, args)
+        run_id, resume = self._run_ids(args, run_id, resume)
+        with Workspace(self.workspace_dir, run_id=run_id) as workspace:
+            state = self._start_run(graph, inputs, workspace, resume)
+            try:
+                node_outputs = self._execute_graph(state)
+            finally:
+                # Outputs still being cached in the background must outlive the run.
+                cache_writer().flush()
+            return self._collect_outputs(graph, inputs, node_outputs, workspace, args)
+
+    def warm(
+        self,
+        package: pirlib.pir.Package,
+        graph_name: str,
+        args: Optional[argparse.Namespace] = None,
+        *,  # Keyword-only arguments below.
+        inputs: Optional[Dict[str, Any]] = None,
+        targets: Optional[List[str]] = None,
+    ) -> Dict[str, bool]:
+        """
+        Prefetch the cached outputs of a graph into the local cache directory without
+        executing any node, e.g. before running the graph on a host with a cold cache.
+        Cache keys depend on the contents of the node inputs, so the nodes are looked
+        up in dependency order and the outputs fetched for a node provide the inputs
+        of its consumers. Nodes downstream of a miss, or of a node which isn't cached,
+        can't be looked up.
+
+        :param package: Package containing the graph.
+        :param graph_name: ID of the graph to warm up.
+        :param args: Parsed arguments providing inputs and ``--only-output`` targets.
+        :param inputs: Values of the graph inputs.
+        :param targets: IDs of the graph outputs whose nodes are looked up.
+        :return: Whether the outputs of each node which could be looked up were
+                cached, by node ID.
+        """
+        graph = self._prepare_graph(package, graph_name, args, targets)
+        inputs = self._load_inputs(graph, inputs, args)
+        found = {}
+        with Workspace(self.workspace_dir) as workspace:
+            state = _RunState(graph, inputs, workspace, self.release_intermediates)
+            while state.ready:
+                node = state.ready.popleft()
+                event = HandlerV1Event(state.node_inputs(node), state.allocate_outputs(node))
+                handler = _resolve_handler(node)
+                found[node.id] = handler.fetch_cached(event, HandlerV1Context(node))
+                if found[node.id]:
+                    state.complete(node, event.outputs)
+        return found
+
+    def _run_ids(
+        self,
+        args: Optional[argparse.Namespace],
+        run_id: Optional[str],
+        resume: Optional[str],
+    ) -> Tuple[Optional[str], Optional[str]]:
+        if args is not None:
+            run_id = run_id or getattr(args, "run_id", None)
+            resume = resume or getattr(args, "resume", None)
+        if run_id is not None and resume is not None and run_id != resume:
+            raise ValueError(f"cannot resume run '{resume}' under a different run id '{run_id}'")
+        return resume or run_id, resume
+
+    def _start_run(
+        self,
+        graph: pirlib.pir.Graph,
+        inputs: Dict[str, Any],
+        workspace: Workspace,
+        resume: Optional[str],
+    ) -> "_RunState":
+        journal = None
+        if workspace.run_id is not None:
+            journal = RunJournal(workspace.path)
+            if resume is not None and not journal.exists():
+                workspace.cleanup()
+                raise ValueError(f"no journal found for run '{resume}'")
+            if resume is None and journal.exists():
+                raise ValueError(f"run '{workspace.run_id}' already exists, resume it instead")
+            journal.start(graph.id)
+        return _RunState(graph, inputs, workspace, self.release_intermediates, journal)
+
+    def _prepare_graph(
+        self,
+        package: pirlib.pir.Package,
+        graph_name: str,
+        args: Optional[argparse.Namespace],
+        targets: Optional[List[str]],
+    ) -> pirlib.pir.Graph:
         graph = package.flatten_graph(graph_name, validate=True)
+        if targets is None and args is not None:
+            targets = getattr(args, "only_output", None)
+        if targets is not None:
+            graph = _prune_graph(graph, targets)
+        return graph
+
+    def _load_inputs(
+        self,
+        graph: pirlib.pir.Graph,
+        inputs: Optional[Dict[str, Any]],
+        args: Optional[argparse.Namespace],
+    ) -> Dict[str, Any]:
         inputs = {} if inputs is None else inputs
         if args is not None:
-            for spec in args.input:
-                inp = find_by_id(graph.inputs, spec.name)
+            for spec in args.input or []:
+                inp = graph.find_input(spec.name)
+                if inp is None:
+                    # Not needed for computing the targeted outputs.
+                    continue
                 if inp.iotype == "DIRECTORY":
                     inputs[spec.name] = DirectoryPath(spec.url.path)
                 elif inp.iotype == "FILE":
@@ -38,59 +221,422 @@ class InprocBackend(Backend):
         for inp in graph.inputs:
             if inp.id not in inputs:
                 raise ValueError(f"missing input '{inp.id}'")
-        # Execute nodes one at a time.
-        node_outputs = {}
-        while True:
-            remaining_nodes = [node for node in graph.nodes if node.id not in node_outputs]
-            if not remaining_nodes:
-                break
-            # Find a node that has all inputs ready.
-            for node in remaining_nodes:
-                node_inputs = {}
-                for inp in node.inputs:
-                    if inp.source.graph_input_id is not None:
-                        # Node input provided by graph input
-                        node_inputs[inp.id] = inputs[inp.source.graph_input_id]
-                    if inp.source.node_id is not None:
-                        # Node input provided by other node's (provider) output
-                        if inp.source.node_id not in node_outputs:
-                            # Provider hasn't been executed yet
-                            break
-                        if inp.source.output_id not in node_outputs[inp.source.node_id]:
-                            # Provider's output is not ready
-                            break
-                        node_inputs[inp.id] = node_outputs[inp.source.node_id][inp.source.output_id]
-                else:
-                    break
-            else:
-                raise RuntimeError("could not finish execution")
-            # Execute node and collect its outputs.
-            node_outputs[node.id] = self._execute_node(node, node_inputs)
+        return inputs
+
+    def _collect_outputs(
+        self,
+        graph: pirlib.pir.Graph,
+        inputs: Dict[str, Any],
+        node_outputs: Dict[str, Dict[str, Any]],
+        workspace: Workspace,
+        args: Optional[argparse.Namespace],
+    ) -> Dict[str, Any]:
         outputs = {}
         for out in graph.outputs:
             if out.source.node_id is not None:
                 outputs[out.id] = node_outputs[out.source.node_id][out.source.output_id]
             if out.source.graph_input_id is not None:
                 outputs[out.id] = inputs[out.source.graph_input_id]
+        specs = {}
         if args is not None:
-            for spec in args.output:
-                out = find_by_id(graph.outputs, spec.name)
-                if out.iotype == "DATAFRAME":
-                    outputs[spec.name].to_csv(spec.url.path)
+            # Skip output specs for graph outputs which were not targeted.
+            specs = {spec.name: spec for spec in args.output or [] if spec.name in outputs}
+        # Move graph outputs out of the workspace before it's cleaned up. Outputs inside
+        # another output which is moved as a whole are copied first.
+        paths = {
+            out_id: value
+            for out_id, value in outputs.items()
+            if isinstance(value, (DirectoryPath, FilePath)) and workspace.contains(value)
+        }
+        nested = {
+            out_id
+            for out_id, value in paths.items()
+            if any(_is_within(value, p) and value != p for p in paths.values())
+        }
+        published = {}
+        for out_id in sorted(paths, key=lambda out_id: out_id not in nested):
+            value = paths[out_id]
+            dest = specs[out_id].url.path if out_id in specs else None
+            if value in published and dest is None:
+                # The same node output is provided as multiple graph outputs.
+                outputs[out_id] = published[value]
+                continue
+            move = out_id not in nested and value not in published
+            outputs[out_id] = workspace.publish(value, out_id, dest, move=move)
+            published.setdefault(value, outputs[out_id])
+        for spec in specs.values():
+            out = graph.find_output(spec.name)
+            if out.iotype == "DATAFRAME":
+                outputs[spec.name].to_csv(spec.url.path)
+            elif spec.name not in paths:
+                # Outputs passed through from graph inputs are copied.
+                if out.iotype == "DIRECTORY":
+                    shutil.copytree(outputs[spec.name], spec.url.path, dirs_exist_ok=True)
+                else:
+                    shutil.copy2(outputs[spec.name], spec.url.path)
         return outputs
 
-    def _execute_node(self, node: pirlib.pir.Node, inputs: Dict[str, Any]):
-        module_name, handler_name = node.entrypoints["main"].handler.split(":")
-        handler = getattr(importlib.import_module(module_name), handler_name)
+    def _execute_graph(self, state: "_RunState") -> Dict[str, Dict[str, Any]]:
+        # Execute nodes concurrently as soon as all of their providers have finished.
+        with _POOLS[self.pool](max_workers=self.max_workers) as pool:
+            running = {}
+            while state.ready or running:
+                while state.ready:
+                    node = state.ready.popleft()
+                    node_inputs = state.node_inputs(node)
+                    outputs = state.allocate_outputs(node)
+                    running[pool.submit(_execute_node, node, node_inputs, outputs)] = node
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    node = running.pop(future)
+                    try:
+                        outputs = future.result()
+                    except Exception:
+                        # Don't start any more nodes, but let the running ones finish.
+                        for f in running:
+                            f.cancel()
+                        raise
+                    state.complete(node, outputs)
+        return state.finish()
+
+
+class _RunState(object):
+    """
+    Bookkeeping for a single execution of a flattened graph: tracks which nodes are
+    ready to run, the outputs produced so far, and how many consumers of each node
+    output are still pending so that intermediate outputs can be released early.
+    """
+
+    def __init__(
+        self,
+        graph: pirlib.pir.Graph,
+        inputs: Dict[str, Any],
+        workspace: Workspace,
+        release: bool,
+        journal: Optional[RunJournal] = None,
+    ):
+        self.graph = graph
+        self.inputs = inputs
+        self.workspace = workspace
+        self.release = release
+        self.journal = journal
+        self.node_outputs = {}
+        self._nodes = {node.id: node for node in graph.nodes}
+        self._pinned = {
+            (out.source.node_id, out.source.output_id)
+            for out in graph.outputs
+            if out.source.node_id is not None
+        }
+        restored = {} if journal is None else self._restorable(journal.completed())
+        # Count the distinct providers of each node, and the consumers of each provider.
+        self._in_degree = {}
+        self._consumers = collections.defaultdict(list)
+        self._refcount = collections.Counter()
+        for node in graph.nodes:
+            if node.id in restored:
+                continue
+            providers = {inp.source.node_id for inp in node.inputs} - {None}
+            self._in_degree[node.id] = len(providers - restored.keys())
+            for provider_id in providers:
+                self._consumers[provider_id].append(node.id)
+            for inp in node.inputs:
+                if inp.source.node_id is not None:
+                    self._refcount[inp.source.node_id, inp.source.output_id] += 1
+        self._scratch = {}
+        # Outputs whose value is not the scratch path allocated for them.
+        self._foreign = set()
+        self.ready = collections.deque(
+            node for node in graph.nodes if self._in_degree.get(node.id) == 0
+        )
+        for node_id, outputs in restored.items():
+            self._add_outputs(self._nodes[node_id], outputs)
+        if release:
+            for node_id in restored:
+                for out in self._nodes[node_id].outputs:
+                    if not self._refcount[node_id, out.id]:
+                        self._release((node_id, out.id))
+
+    def _restorable(self, completed: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        # A node recorded as completed can only be skipped if all of its outputs which
+        # are still needed by a node that runs, or by the graph outputs, were reloaded.
+        restored = {node_id: completed[node_id] for node_id in self._nodes if node_id in completed}
+        changed = True
+        while changed:
+            changed = False
+            sources = [out.source for out in self.graph.outputs]
+            for node in self.graph.nodes:
+                if node.id not in restored:
+                    sources.extend(inp.source for inp in node.inputs)
+            for source in sources:
+                if source.node_id in restored:
+                    if source.output_id not in restored[source.node_id]:
+                        del restored[source.node_id]
+                        changed = True
+        return restored
+
+    def node_inputs(self, node: pirlib.pir.Node) -> Dict[str, Any]:
+        node_inputs = {}
+        for inp in node.inputs:
+            if inp.source.graph_input_id is not None:
+                # Node input provided by graph input
+                node_inputs[inp.id] = self.inputs[inp.source.graph_input_id]
+            if inp.source.node_id is not None:
+                # Node input provided by other node's (provider) output
+                provider_outputs = self.node_outputs[inp.source.node_id]
+                if inp.source.output_id not in provider_outputs:
+                    raise RuntimeError(
+                        f"node '{node.id}' input '{inp.id}' refers to missing output "
+                        f"'{inp.source.output_id}' of node '{inp.source.node_id}'"
+                    )
+                node_inputs[inp.id] = provider_outputs[inp.source.output_id]
+        return node_inputs
+
+    def allocate_outputs(self, node: pirlib.pir.Node) -> Dict[str, Any]:
         outputs = {}
         for out in node.outputs:
-            if out.iotype == "DIRECTORY":
-                outputs[out.id] = DirectoryPath(tempfile.mkdtemp())
-            elif out.iotype == "FILE":
-                outputs[out.id] = FilePath(tempfile.mkstemp()[1])
-            else:
-                outputs[out.id] = None
+            outputs[out.id] = self.workspace.allocate(node.id, out.id, out.iotype)
+            if outputs[out.id] is not None:
+                self._scratch[node.id, out.id] = outputs[out.id]
+        return outputs
+
+    def _add_outputs(self, node: pirlib.pir.Node, outputs: Dict[str, Any]) -> None:
+        self.node_outputs[node.id] = outputs
+        for output_id, value in outputs.items():
+            if isinstance(value, (DirectoryPath, FilePath)):
+                if value != self._scratch.get((node.id, output_id)):
+                    self._foreign.add((node.id, output_id))
+
+    def complete(self, node: pirlib.pir.Node, outputs: Dict[str, Any]) -> None:
+        if self.journal is not None:
+            self.journal.record(node, outputs)
+        self._add_outputs(node, outputs)
+        for consumer_id in self._consumers[node.id]:
+            self._in_degree[consumer_id] -= 1
+            if self._in_degree[consumer_id] == 0:
+                self.ready.append(self._nodes[consumer_id])
+        if not self.release:
+            return
+        # Release outputs nobody consumes, then the inputs this node was the last
+        # consumer of.
+        keys = [(node.id, out.id) for out in node.outputs if not self._refcount[node.id, out.id]]
+        for inp in node.inputs:
+            if inp.source.node_id is not None:
+                key = (inp.source.node_id, inp.source.output_id)
+                self._refcount[key] -= 1
+                if not self._refcount[key]:
+                    keys.append(key)
+        for key in keys:
+            self._release(key)
+
+    def finish(self) -> Dict[str, Dict[str, Any]]:
+        if len(self.node_outputs) != len(self._nodes):
+            raise RuntimeError("could not finish execution")
+        return self.node_outputs
+
+    def _release(self, key: Tuple[str, str]) -> None:
+        if key in self._pinned:
+            return
+        node_id, output_id = key
+        self.node_outputs[node_id].pop(output_id, None)
+        self._foreign.discard(key)
+        scratch = self._scratch.pop(key, None)
+        if scratch is None:
+            return
+        # A task may return (a path inside) another task's output, so keep the scratch
+        # path around if any output that is still held refers into it.
+        for node_id, output_id in self._foreign:
+            value = self.node_outputs[node_id].get(output_id)
+            if value is not None and _is_within(value, scratch):
+                return
+        # Outputs which are being cached in the background are removed along with the
+        # workspace instead.
+        if cache_writer().is_pending(scratch):
+            return
+        self.workspace.release(scratch)
+
+
+def _prune_graph(graph: pirlib.pir.Graph, targets: List[str]) -> pirlib.pir.Graph:
+    # Walk the data sources backwards from the targeted outputs to find the nodes and
+    # graph inputs they depend on.
+    nodes = {node.id: node for node in graph.nodes}
+    outputs, stack = [], []
+    for target in targets:
+        out = graph.find_output(target)
+        if out is None:
+            raise ValueError(f"graph '{graph.id}' has no output '{target}'")
+        outputs.append(out)
+        stack.append(out.source)
+    needed_nodes, needed_inputs = set(), set()
+    while stack:
+        source = stack.pop()
+        if source.graph_input_id is not None:
+            needed_inputs.add(source.graph_input_id)
+        elif source.node_id not in needed_nodes:
+            needed_nodes.add(source.node_id)
+            stack.extend(inp.source for inp in nodes[source.node_id].inputs)
+    return dataclasses.replace(
+        graph,
+        nodes=[node for node in graph.nodes if node.id in needed_nodes],
+        inputs=[inp for inp in graph.inputs if inp.id in needed_inputs],
+        outputs=outputs,
+    )
+
+
+def _is_within(path: os.PathLike, root: os.PathLike) -> bool:
+    path, root = os.path.abspath(path), os.path.abspath(root)
+    return path == root or path.startswith(os.path.join(root, ""))
+
+
+def _resolve_handler(node: pirlib.pir.Node) -> HandlerV1:
+    module_name, handler_name = node.entrypoints["main"].handler.split(":")
+    return getattr(importlib.import_module(module_name), handler_name)
+
+
+def _execute_node(
+    node: pirlib.pir.Node, inputs: Dict[str, Any], outputs: Dict[str, Any]
+) -> Dict[str, Any]:
+    # Module-level so that it can be sent to process pool workers, which resolve the
+    # handler themselves and only send the outputs back.
+    handler = _resolve_handler(node)
+    event = HandlerV1Event(inputs, outputs)
+    context = HandlerV1Context(node)
+    handler.run_handler(event, context)
+    return event.outputs
+
+
+class AsyncInprocBackend(InprocBackend):
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        pool: str = "thread",
+        release_intermediates: bool = True,
+        workspace_dir: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+    ):
+        """
+        :param max_workers: Size of the pool used to run synchronous handlers.
+        :param pool: Kind of pool used to run synchronous handlers, see
+                :class:`InprocBackend`.
+        :param release_intermediates: See :class:`InprocBackend`.
+        :param workspace_dir: See :class:`InprocBackend`.
+        :param max_concurrency: Maximum number of nodes in flight at once, including
+                both awaited asynchronous handlers and synchronous handlers waiting on
+                the pool. ``None`` means unlimited.
+        """
+        super().__init__(
+            max_workers=max_workers,
+            pool=pool,
+            release_intermediates=release_intermediates,
+            workspace_dir=workspace_dir,
+        )
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError(f"max_concurrency must be at least 1, got {max_concurrency}")
+        self._max_concurrency = max_concurrency
+
+    @property
+    def max_concurrency(self):
+        return self._max_concurrency
+
+    def execute(
+        self,
+        package: pirlib.pir.Package,
+        graph_name: str,
+        config: Optional[dict] = None,
+        args: Optional[argparse.Namespace] = None,
+        *,  # Keyword-only arguments below.
+        inputs: Optional[Dict[str, Any]] = None,
+        targets: Optional[List[str]] = None,
+        run_id: Optional[str] = None,
+        resume: Optional[str] = None,
+    ) -> None:
+        return asyncio.run(
+            self.execute_async(
+                package,
+                graph_name,
+                config,
+                args,
+                inputs=inputs,
+                targets=targets,
+                run_id=run_id,
+                resume=resume,
+            )
+        )
+
+    async def execute_async(
+        self,
+        package: pirlib.pir.Package,
+        graph_name: str,
+        config: Optional[dict] = None,
+        args: Optional[argparse.Namespace] = None,
+        *,  # Keyword-only arguments below.
+        inputs: Optional[Dict[str, Any]] = None,
+        targets: Optional[List[str]] = None,
+        run_id: Optional[str] = None,
+        resume: Optional[str] = None,
+    ) -> None:
+        graph = self._prepare_graph(package, graph_name, args, targets)
+        inputs = self._load_inputs(graph, inputs, args)
+        run_id, resume = self._run_ids(args, run_id, resume)
+        with Workspace(self.workspace_dir, run_id=run_id) as workspace:
+            state = self._start_run(graph, inputs, workspace, resume)
+            try:
+                node_outputs = await self._execute_graph_async(state)
+            finally:
+                # Outputs still being cached in the background must outlive the run.
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, cache_writer().flush)
+            return self._collect_outputs(graph, inputs, node_outputs, workspace, args)
+
+    async def _execute_graph_async(self, state: "_RunState") -> Dict[str, Dict[str, Any]]:
+        limit = asyncio.Semaphore(self.max_concurrency) if self.max_concurrency else None
+        with _POOLS[self.pool](max_workers=self.max_workers) as pool:
+            running = {}
+            try:
+                while state.ready or running:
+                    while state.ready:
+                        node = state.ready.popleft()
+                        node_inputs = state.node_inputs(node)
+                        outputs = state.allocate_outputs(node)
+                        coro = self._execute_node_async(pool, limit, node, node_inputs, outputs)
+                        running[asyncio.ensure_future(coro)] = node
+                    done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        node = running.pop(task)
+                        state.complete(node, task.result())
+            finally:
+                # Let in-flight nodes finish before tearing down the pool.
+                if running:
+                    await asyncio.wait(running)
+        return state.finish()
+
+    async def _execute_node_async(
+        self,
+        pool: concurrent.futures.Executor,
+        limit: Optional[asyncio.Semaphore],
+        node: pirlib.pir.Node,
+        inputs: Dict[str, Any],
+        outputs: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        if limit is None:
+            return await self._run_node_async(pool, node, inputs, outputs)
+        async with limit:
+            return await self._run_node_async(pool, node, inputs, outputs)
+
+    async def _run_node_async(
+        self,
+        pool: concurrent.futures.Executor,
+        node: pirlib.pir.Node,
+        inputs: Dict[str, Any],
+        outputs: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        handler = _resolve_handler(node)
+        if not handler.is_async():
+            # Synchronous handlers still run on the pool so they don't block the loop.
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(pool, _execute_node, node, inputs, outputs)
         event = HandlerV1Event(inputs, outputs)
         context = HandlerV1Context(node)
-        handler.run_handler(event, context)
-        return outputs
+        await handler.run_handler_async(event, context)
+        return event.outputs
@@ -0,0 +1,358 @@
+import argparse
+import asyncio
+import collections
+import os
+import threading
+from typing import Tuple
+
+import pandas
+import pytest
+from pirlib.backends.inproc import AsyncInprocBackend, InprocBackend
+from pirlib.iotypes import DirectoryPath, FilePath
+from pirlib.pipeline import pipeline
+from pirlib.task import task
+
+# Both branches must be running at the same time to get past the barrier.
+_barrier = threading.Barrier(2, timeout=10)
+
+
+@task
+def branch_a(inp: FilePath) -> FilePath:
+    _barrier.wait()
+    return inp
+
+
+@task
+def branch_b(inp: FilePath) -> FilePath:
+    _barrier.wait()
+    return inp
+
+
+@task
+def join(a: FilePath, b: FilePath) -> FilePath:
+    return a
+
+
+@task
+def passthrough(inp: FilePath) -> FilePath:
+    return inp
+
+
+@task
+def failing(inp: FilePath) -> FilePath:
+    raise RuntimeError("failing task")
+
+
+@task
+def write_pid(inp: FilePath) -> DirectoryPath:
+    outdir = task.context().output
+    with open(outdir / "pid.txt", "w") as f:
+        f.write(str(os.getpid()))
+    return outdir
+
+
+@task
+def read_pid(piddir: DirectoryPath) -> pandas.DataFrame:
+    with open(piddir / "pid.txt") as f:
+        return pandas.DataFrame([{"writer": int(f.read()), "reader": os.getpid()}])
+
+
+@pipeline
+def pid_pipeline(inp: FilePath) -> pandas.DataFrame:
+    return read_pid(write_pid(inp))
+
+
+_made_dirs = []
+
+
+@task
+def make_dir(inp: FilePath) -> DirectoryPath:
+    outdir = task.context().output
+    with open(outdir / "file.txt", "w") as f:
+        f.write("make_dir")
+    _made_dirs.append(outdir)
+    return outdir
+
+
+@task
+def copy_dir(inp: DirectoryPath) -> DirectoryPath:
+    outdir = task.context().output
+    with open(inp / "file.txt") as f, open(outdir / "file.txt", "w") as g:
+        g.write(f.read())
+    return outdir
+
+
+@task
+def pick_file(inp: DirectoryPath) -> FilePath:
+    return FilePath(inp / "file.txt")
+
+
+_first_dir_exists = []
+
+
+@task
+def check_first_dir(inp: DirectoryPath) -> DirectoryPath:
+    _first_dir_exists.append(_made_dirs[0].exists())
+    return inp
+
+
+@pipeline
+def copy_pipeline(inp: FilePath) -> DirectoryPath:
+    return copy_dir(make_dir(inp))
+
+
+@pipeline
+def check_pipeline(inp: FilePath) -> DirectoryPath:
+    return check_first_dir(copy_dir(make_dir(inp)))
+
+
+@pipeline
+def pick_pipeline(inp: FilePath) -> FilePath:
+    return pick_file(make_dir(inp))
+
+
+@pipeline
+def two_branch_pipeline(good: FilePath, bad: FilePath) -> Tuple[FilePath, FilePath]:
+    return passthrough(good), failing(bad)
+
+
+_calls = collections.Counter()
+_fail_once = set()
+
+
+@task
+def load_frame(inp: FilePath) -> pandas.DataFrame:
+    _calls["load_frame"] += 1
+    return pandas.DataFrame([{"value": 1}])
+
+
+@task
+def flaky(df: pandas.DataFrame) -> DirectoryPath:
+    _calls["flaky"] += 1
+    if "flaky" in _fail_once:
+        _fail_once.discard("flaky")
+        raise RuntimeError("flaky task")
+    outdir = task.context().output
+    with open(outdir / "file.txt", "w") as f:
+        f.write(str(df["value"][0]))
+    return outdir
+
+
+@pipeline
+def flaky_pipeline(inp: FilePath) -> DirectoryPath:
+    return copy_dir(flaky(load_frame(inp)))
+
+
+@pipeline
+def wide_pipeline(inp: FilePath) -> FilePath:
+    return join(branch_a(inp), branch_b(inp))
+
+
+@pipeline
+def chain_pipeline(inp: FilePath) -> FilePath:
+    return passthrough.instance("c")(passthrough.instance("b")(passthrough.instance("a")(inp)))
+
+
+@pipeline
+def failing_pipeline(inp: FilePath) -> FilePath:
+    return passthrough(failing(inp))
+
+
+test_file_path = FilePath("test/file.txt")
+
+
+def test_independent_branches_run_concurrently():
+    _barrier.reset()
+    backend = InprocBackend(max_workers=2)
+    outputs = backend.execute(
+        wide_pipeline.package(), "wide_pipeline", inputs={"inp": test_file_path}
+    )
+    assert outputs["return"] == test_file_path
+
+
+def test_single_worker_chain():
+    backend = InprocBackend(max_workers=1)
+    outputs = backend.execute(
+        chain_pipeline.package(), "chain_pipeline", inputs={"inp": test_file_path}
+    )
+    assert outputs["return"] == test_file_path
+
+
+def test_node_failure_propagates():
+    backend = InprocBackend(max_workers=2)
+    with pytest.raises(RuntimeError, match="failing task"):
+        backend.execute(
+            failing_pipeline.package(), "failing_pipeline", inputs={"inp": test_file_path}
+        )
+
+
+def test_process_pool():
+    backend = InprocBackend(max_workers=2, pool="process")
+    outputs = backend.execute(
+        pid_pipeline.package(), "pid_pipeline", inputs={"inp": test_file_path}
+    )
+    record = outputs["return"].iloc[0]
+    assert record["writer"] != os.getpid()
+    assert record["reader"] != os.getpid()
+
+
+def test_release_intermediates():
+    _made_dirs.clear()
+    outputs = InprocBackend().execute(
+        copy_pipeline.package(), "copy_pipeline", inputs={"inp": test_file_path}
+    )
+    assert not _made_dirs[0].exists()
+    assert (outputs["return"] / "file.txt").read_text() == "make_dir"
+
+
+@pytest.mark.parametrize("release", [True, False])
+def test_keep_intermediates(release):
+    _made_dirs.clear()
+    _first_dir_exists.clear()
+    InprocBackend(max_workers=1, release_intermediates=release).execute(
+        check_pipeline.package(), "check_pipeline", inputs={"inp": test_file_path}
+    )
+    assert _first_dir_exists == [not release]
+
+
+def test_workspace(tmp_path):
+    _made_dirs.clear()
+    outputs = InprocBackend(workspace_dir=str(tmp_path), release_intermediates=False).execute(
+        copy_pipeline.package(), "copy_pipeline", inputs={"inp": test_file_path}
+    )
+    (run_dir,) = tmp_path.iterdir()
+    assert not _made_dirs[0].exists()
+    assert not (run_dir / "nodes").exists()
+    assert outputs["return"] == run_dir / "outputs" / "return"
+    assert (outputs["return"] / "file.txt").read_text() == "make_dir"
+
+
+def test_release_keeps_referenced_paths():
+    outputs = InprocBackend().execute(
+        pick_pipeline.package(), "pick_pipeline", inputs={"inp": test_file_path}
+    )
+    assert outputs["return"].read_text() == "make_dir"
+
+
+def test_targets_prune_unneeded_nodes():
+    outputs = InprocBackend().execute(
+        two_branch_pipeline.package(),
+        "two_branch_pipeline",
+        inputs={"good": test_file_path},
+        targets=["return.0"],
+    )
+    assert outputs == {"return.0": test_file_path}
+
+
+def test_targets_from_args():
+    args = argparse.Namespace(input=None, output=None, only_output=["return.0"])
+    outputs = InprocBackend().execute(
+        two_branch_pipeline.package(),
+        "two_branch_pipeline",
+        args=args,
+        inputs={"good": test_file_path},
+    )
+    assert outputs == {"return.0": test_file_path}
+
+
+def test_unknown_target():
+    with pytest.raises(ValueError, match="no output 'missing'"):
+        InprocBackend().execute(
+            two_branch_pipeline.package(),
+            "two_branch_pipeline",
+            inputs={"good": test_file_path},
+            targets=["missing"],
+        )
+
+
+def test_resume(tmp_path):
+    _calls.clear()
+    _fail_once.add("flaky")
+    backend = InprocBackend(workspace_dir=str(tmp_path))
+    package = flaky_pipeline.package()
+    inputs = {"inp": test_file_path}
+    with pytest.raises(RuntimeError, match="flaky task"):
+        backend.execute(package, "flaky_pipeline", inputs=inputs, run_id="run-1")
+    assert (tmp_path / "pirlib-run-run-1" / "journal.jsonl").exists()
+    with pytest.raises(ValueError, match="already exists"):
+        backend.execute(package, "flaky_pipeline", inputs=inputs, run_id="run-1")
+    outputs = backend.execute(package, "flaky_pipeline", inputs=inputs, resume="run-1")
+    assert (outputs["return"] / "file.txt").read_text() == "1"
+    assert _calls == {"load_frame": 1, "flaky": 2}
+
+
+def test_resume_unknown_run(tmp_path):
+    backend = InprocBackend(workspace_dir=str(tmp_path))
+    with pytest.raises(ValueError, match="no journal found"):
+        backend.execute(
+            flaky_pipeline.package(),
+            "flaky_pipeline",
+            inputs={"inp": test_file_path},
+            resume="missing",
+        )
+
+
+def test_invalid_backend_args():
+    with pytest.raises(ValueError):
+        InprocBackend(max_workers=0)
+    with pytest.raises(ValueError):
+        InprocBackend(pool="fiber")
+    with pytest.raises(ValueError):
+        AsyncInprocBackend(max_concurrency=0)
+
+
+_started = set()
+
+
+async def _wait_for_peers(name: str, count: int):
+    _started.add(name)
+    while len(_started) < count:
+        await asyncio.sleep(0.01)
+
+
+@task
+async def download_a(inp: FilePath) -> FilePath:
+    await asyncio.wait_for(_wait_for_peers("a", 2), timeout=10)
+    return inp
+
+
+@task
+async def download_b(inp: FilePath) -> FilePath:
+    await asyncio.wait_for(_wait_for_peers("b", 2), timeout=10)
+    return inp
+
+
+@pipeline
+def download_pipeline(inp: FilePath) -> FilePath:
+    return join(download_a(inp), download_b(inp))
+
+
+@pipeline
+def mixed_pipeline(inp: FilePath) -> FilePath:
+    return passthrough(download_a(inp))
+
+
+def test_async_nodes_run_concurrently():
+    _started.clear()
+    backend = AsyncInprocBackend(max_concurrency=2)
+    outputs = backend.execute(
+        download_pipeline.package(), "download_pipeline", inputs={"inp": test_file_path}
+    )
+    assert outputs["return"] == test_file_path
+
+
+def test_async_mixed_with_sync_nodes():
+    _started.clear()
+    _started.add("b")
+    backend = AsyncInprocBackend(max_concurrency=1)
+    package = mixed_pipeline.package()
+    outputs = asyncio.run(
+        backend.execute_async(package, "mixed_pipeline", inputs={"inp": test_file_path})
+    )
+    assert outputs["return"] == test_file_path
+
+
+def test_async_task_called_directly():
+    _started.clear()
+    _started.add("b")
+    assert download_a(test_file_path) == test_file_path
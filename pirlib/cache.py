@@ -1,41 +1,948 @@
+import asyncio
+import atexit
+import collections
+import contextlib
+import copy
+import errno
+import glob
 import hashlib
+import io
+import json
+import multiprocessing
 import os
+import queue
 import shutil
+import socket
+import stat
+import sys
+import tarfile
+import threading
+import time
+import uuid
+import warnings
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 from diskcache import Cache
 
+from pirlib.cache_store import CacheStore, open_store
 from pirlib.iotypes import DirectoryPath, FilePath
 
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+try:
+    import pyarrow.feather
+except ImportError:
+    pyarrow = None
+
 CACHE_DIR = os.getenv("PIRLIB_CACHE_DIR", "/pirlib/cache")
 
+# Maximum total size in bytes of the cached directories, 0 for no limit. The least
+# recently used entries are evicted to make room for new ones.
+MAX_BYTES = int(os.getenv("PIRLIB_CACHE_MAX_BYTES", "0"))
+
+# Seconds after which the lease of a writer which stopped refreshing it is broken.
+LEASE_TIMEOUT = float(os.getenv("PIRLIB_CACHE_LEASE_TIMEOUT", "300"))
+
+_LEASE_POLL_INTERVAL = 0.5
+
+# Whether cached directories are packed, one of "none", "tar" or "tar.zst". See
+# :func:`cache_directory`.
+PACK = os.getenv("PIRLIB_CACHE_PACK", "none")
+
+_PACK_FORMATS = ("tar", "tar.zst")
+
+_PACK_INDEX = "index.json"
+
+# Refuse members which would be extracted outside of the target directory, where the
+# tarfile module supports extraction filters.
+_EXTRACT_KWARGS = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+
+# Whether cache entries are written in the background, see :class:`CacheWriter`.
+WRITE_BEHIND = os.getenv("PIRLIB_CACHE_WRITE_BEHIND", "0") == "1"
+
+# Maximum number of queued background cache writes.
+WRITE_QUEUE_SIZE = int(os.getenv("PIRLIB_CACHE_WRITE_QUEUE_SIZE", "16"))
+
+# URL of the shared store behind the local cache directory, see
+# :func:`pirlib.cache_store.open_store`. Cache misses in the local cache directory are
+# looked up in the store.
+REMOTE = os.getenv("PIRLIB_CACHE_REMOTE")
+
+# "through" to upload new entries to the remote store, or "none" to only read from it.
+REMOTE_WRITE = os.getenv("PIRLIB_CACHE_REMOTE_WRITE", "through")
+
+_REMOTE_META = "meta.json"
+
+_REMOTE_DATA = "data"
+
+# How cached directories are materialized, one of "copy", "hardlink", "reflink" or
+# "symlink". See :func:`materialize_directory`.
+MATERIALIZE = os.getenv("PIRLIB_CACHE_MATERIALIZE", "copy")
+
+_CHUNK_SIZE = 1 << 20
+
+# Directory of the persistent index of file digests, see :func:`hash_index`.
+HASH_INDEX_DIR = os.getenv("PIRLIB_HASH_INDEX_DIR")
+
+# Smaller files are cheaper to hash again than to look up in the hash index.
+_INDEX_MIN_SIZE = 64 << 10
+
+# Files modified less than this many seconds ago aren't added to the hash index.
+_INDEX_MIN_AGE = 2.0
+
+# Linux ioctl which makes a file share the extents of another file (copy-on-write).
+_FICLONE = 0x40049409
+
+# Errors which mean that a link or clone isn't possible and the file must be copied.
+_NO_LINK_ERRNOS = {
+    errno.EXDEV,
+    errno.EPERM,
+    errno.EMLINK,
+    errno.EINVAL,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+}
+
+
+class CacheManager(object):
+    """
+    Keeps one open :obj:`Cache` handle per cache directory for the whole process,
+    instead of opening a new SQLite connection for every cache operation. The
+    handles are dropped in child processes after a fork, since SQLite connections
+    must not be shared between processes, and are reopened on first use.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._caches = {}
+        self._remote = None
+
+    @property
+    def remote(self) -> Optional[CacheStore]:
+        """The shared backing store behind the local cache directory, opened from
+        ``$PIRLIB_CACHE_REMOTE`` unless set with :meth:`set_remote`, or None."""
+        if self._remote is None and REMOTE:
+            self._remote = open_store(REMOTE)
+        return self._remote
+
+    def set_remote(self, store: Optional[CacheStore]) -> None:
+        """Sets the shared backing store behind the local cache directory.
+
+        :param store: The store, or None to only use the local cache directory.
+        :type store: CacheStore, optional
+        """
+        self._remote = store
+
+    def cache(self, directory: Optional[str] = None) -> Cache:
+        """Returns the handle of a cache directory, opening it if needed.
+
+        :param directory: The cache directory. Defaults to ``CACHE_DIR``.
+        :type directory: str, optional
+        :return: The open cache.
+        :rtype: Cache
+        """
+        directory = directory or CACHE_DIR
+        cache_ref = self._caches.get(directory)
+        if cache_ref is None:
+            with self._lock:
+                cache_ref = self._caches.get(directory)
+                if cache_ref is None:
+                    cache_ref = self._caches[directory] = Cache(directory)
+        return cache_ref
+
+    def contains_many(self, cache_keys: Iterable[str]) -> Dict[str, bool]:
+        """Checks which of the given keys are present in a single transaction. Keys
+        missing from the local cache directory are looked up in the remote store.
+
+        :param cache_keys: The cache keys to look up.
+        :type cache_keys: Iterable[str]
+        :return: Whether each key is present in the cache.
+        :rtype: Dict[str, bool]
+        """
+        cache_ref = self.cache()
+        with cache_ref.transact():
+            found = {key: key in cache_ref for key in cache_keys}
+        for key, present in found.items():
+            if not present:
+                found[key] = _remote_contains(key)
+        return found
+
+    def get_many(self, cache_keys: Iterable[str]) -> Dict[str, Any]:
+        """Looks up the entries of the given keys in a single transaction.
+
+        :param cache_keys: The cache keys to look up.
+        :type cache_keys: Iterable[str]
+        :return: The entries of the keys which are present in the cache.
+        :rtype: Dict[str, Any]
+        """
+        cache_ref = self.cache()
+        entries = {}
+        with cache_ref.transact():
+            for key in cache_keys:
+                entry = _entry_info(cache_ref.get(key))
+                if entry is not None:
+                    entries[key] = entry
+        return entries
+
+    def close(self) -> None:
+        """Closes all open handles."""
+        with self._lock:
+            caches, self._caches = self._caches, {}
+        for cache_ref in caches.values():
+            cache_ref.close()
+
+    def _reset(self) -> None:
+        # The parent's connections are left alone, they are still in use there.
+        self._lock = threading.Lock()
+        self._caches = {}
+
+
+_CACHE_MANAGER = CacheManager()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_CACHE_MANAGER._reset)
+
+
+def cache_manager() -> CacheManager:
+    """Returns the process-wide :class:`CacheManager`."""
+    return _CACHE_MANAGER
 
-def cache_directory(dir_path: DirectoryPath, cache_key: str) -> bool:
+
+def cache_directory(
+    dir_path: DirectoryPath,
+    cache_key: str,
+    strategy: Optional[str] = None,
+    pack: Optional[str] = None,
+) -> bool:
     """Caches a given directory with the given key.
 
     :param dir_path: The directory to be cached.
     :type dir_path: Path
     :param cache_key: An key that will be used to retreive the cached directiry.
     :type cache_key: str
-    :return: True if caching was a success, False if the key already exists.
+    :param strategy: How to store the directory, see :func:`materialize_directory`.
+        ``"symlink"`` stores hardlinks instead, since the cache must outlive
+        ``dir_path``. Defaults to ``$PIRLIB_CACHE_MATERIALIZE``.
+    :type strategy: str, optional
+    :param pack: ``"none"`` to store the files as they are, or ``"tar"`` or
+        ``"tar.zst"`` to pack them into a single, optionally zstd-compressed, tar
+        with an index, see :class:`PackedDirectory`. Packing avoids the per-file
+        metadata operations on network filesystems when a directory has many small
+        files. Defaults to ``$PIRLIB_CACHE_PACK``.
+    :type pack: str, optional
+    :return: True if caching was a success, False if the key already exists or the
+        directory is larger than ``MAX_BYTES``.
     :rtype: bool
     """
-    with Cache(CACHE_DIR) as cache_ref:
-        if cache_key in cache_ref:
-            # Key already exists, caching not possible.
-            return False
+    if is_cached(cache_key):
+        # Key already exists, caching not possible.
+        return False
+    # Key doesn't exist, caching is possible.
+    # Copy the contents to a temp directory in the cache, which is renamed
+    # into place once complete so that readers never see a partial tree.
+    temp_dir = _temp_path(cache_key)
+    pack = pack or PACK
+    strategy = strategy or MATERIALIZE
+    if strategy == "symlink":
+        strategy = "hardlink"
+    try:
+        entry = {"kind": "directory", "path": os.path.join(CACHE_DIR, f"DIR_{cache_key}")}
+        if pack == "none":
+            materialize_directory(dir_path, temp_dir, strategy)
+            _make_read_only(temp_dir)
+        else:
+            _pack_directory(dir_path, temp_dir, pack)
+            entry["pack"] = pack
+        entry["size"] = directory_size(temp_dir)
+        return _publish(cache_key, entry, temp_dir)
+    finally:
+        _remove_path(temp_dir)
+
+
+def cache_file(file_path: FilePath, cache_key: str, strategy: Optional[str] = None) -> bool:
+    """Caches a given file with the given key. The file is stored as a blob named
+    after the hash of its contents, which is shared by all keys with the same file.
+
+    :param file_path: The file to be cached.
+    :type file_path: Path
+    :param cache_key: An key that will be used to retreive the cached file.
+    :type cache_key: str
+    :param strategy: How to store the file, see :func:`cache_directory`.
+    :type strategy: str, optional
+    :return: True if caching was a success, False if the key already exists or the
+        file is larger than ``MAX_BYTES``.
+    :rtype: bool
+    """
+    if is_cached(cache_key):
+        return False
+    digest = hash_file(file_path)
+    entry = {
+        "kind": "file",
+        "path": os.path.join(CACHE_DIR, f"BLOB_{digest}"),
+        "size": os.path.getsize(file_path),
+        "digest": digest,
+    }
+    if os.path.exists(entry["path"]):
+        # Blobs are only ever renamed into place, so an existing blob is complete.
+        return _publish(cache_key, entry)
+    strategy = strategy or MATERIALIZE
+    if strategy == "symlink":
+        strategy = "hardlink"
+    temp_path = _temp_path(cache_key)
+    try:
+        _COPY_FUNCTIONS[strategy](file_path, temp_path)
+        _make_read_only(temp_path)
+        return _publish(cache_key, entry, temp_path)
+    finally:
+        _remove_path(temp_path)
+
+
+def cache_dataframe(df: "pandas.DataFrame", cache_key: str) -> bool:
+    """Caches a DataFrame with the given key. The DataFrame is stored in the Arrow
+    IPC format if pyarrow is installed so that it can be memory-mapped when fetched,
+    or pickled otherwise, or if Arrow can't represent its columns.
+
+    :param df: The DataFrame to be cached.
+    :type df: pandas.DataFrame
+    :param cache_key: An key that will be used to retreive the cached DataFrame.
+    :type cache_key: str
+    :return: True if caching was a success, False if the key already exists or the
+        DataFrame is larger than ``MAX_BYTES``.
+    :rtype: bool
+    """
+    return snapshot_dataframe(df, cache_key)()
+
+
+def snapshot_dataframe(df: "pandas.DataFrame", cache_key: str) -> Callable[[], bool]:
+    """Serializes a DataFrame into the cache directory right away, and returns a
+    function which adds it to the cache later, e.g. in the :class:`CacheWriter`.
+    Changes made to the DataFrame in the meantime aren't cached.
+
+    :param df: The DataFrame to be cached.
+    :type df: pandas.DataFrame
+    :param cache_key: An key that will be used to retreive the cached DataFrame.
+    :type cache_key: str
+    :return: Function which caches the serialized DataFrame, and returns the same as
+        :func:`cache_dataframe`.
+    :rtype: Callable[[], bool]
+    """
+    if is_cached(cache_key):
+        return lambda: False
+    temp_path = _temp_path(cache_key)
+    fmt = "pickle"
+    try:
+        if pyarrow is not None:
+            try:
+                # Compression would prevent memory-mapping the file.
+                pyarrow.feather.write_feather(df, temp_path, compression="uncompressed")
+                fmt = "arrow"
+            except (pyarrow.ArrowException, TypeError, ValueError):
+                # E.g. object columns with mixed types, which only pickle supports.
+                _remove_path(temp_path)
+        if fmt == "pickle":
+            df.to_pickle(temp_path)
+    except BaseException:
+        _remove_path(temp_path)
+        raise
+
+    def publish() -> bool:
+        try:
+            entry = {
+                "kind": "dataframe",
+                "format": fmt,
+                "path": os.path.join(CACHE_DIR, f"FRAME_{cache_key}.{fmt}"),
+                "size": os.path.getsize(temp_path),
+            }
+            return _publish(cache_key, entry, temp_path)
+        finally:
+            _remove_path(temp_path)
+
+    return publish
+
+
+def snapshot_path(
+    path: Union[FilePath, DirectoryPath],
+    cache_key: str,
+    store: Optional[Callable[..., bool]] = None,
+) -> Callable[[], bool]:
+    """Stages a file or directory in the cache directory right away, and returns a
+    function which caches it later, e.g. in the :class:`CacheWriter`. Changes made to
+    the path in the meantime, including removing it, aren't cached. The files are
+    hardlinked and made read-only if the cache stores hardlinks of them anyway, see
+    :func:`cache_directory`, or materialized with ``$PIRLIB_CACHE_MATERIALIZE``
+    otherwise.
+
+    :param path: The file or directory to be cached.
+    :type path: Path
+    :param cache_key: An key that will be used to retreive the cached path.
+    :type cache_key: str
+    :param store: Function which caches the staged path, called with the path, the key
+        and ``strategy="hardlink"``. Defaults to :func:`cache_directory` for
+        directories and :func:`cache_file` for files.
+    :type store: Callable[..., bool], optional
+    :return: Function which caches the staged path, and returns the same as ``store``.
+    :rtype: Callable[[], bool]
+    """
+    strategy = "hardlink" if MATERIALIZE in ("hardlink", "symlink") else MATERIALIZE
+    temp_path = _temp_path(cache_key)
+    try:
+        if os.path.isdir(path):
+            materialize_directory(path, temp_path, strategy)
+            staged, store = DirectoryPath(temp_path), store or cache_directory
         else:
-            # Key doesn't exist, caching is possible.
-            # Copy the contents to a directory in the cache.
-            target_dir = os.path.join(CACHE_DIR, f"DIR_{cache_key}")
-            shutil.copytree(dir_path, target_dir)
-            # Add the temp directory to the cache.
-            status = cache_ref.add(cache_key, target_dir)
-
-    # Return the status of cache add operation.
+            _COPY_FUNCTIONS[strategy](path, temp_path)
+            staged, store = FilePath(temp_path), store or cache_file
+        if strategy == "hardlink":
+            _make_read_only(temp_path)
+    except BaseException:
+        _remove_path(temp_path)
+        raise
+
+    def publish() -> bool:
+        try:
+            return store(staged, cache_key, strategy="hardlink")
+        finally:
+            _remove_path(temp_path)
+
+    return publish
+
+
+def _temp_path(cache_key: str) -> str:
+    return os.path.join(CACHE_DIR, f"TMP_{cache_key}-{uuid.uuid4().hex}")
+
+
+def _publish(
+    cache_key: str,
+    entry: Dict[str, Any],
+    temp_path: Optional[str] = None,
+    push: bool = True,
+) -> bool:
+    # Rename a completed temp file or directory to the path of the entry, and add the
+    # entry, in a single transaction. New entries are then pushed to the remote store.
+    if temp_path is not None and "digest" not in entry:
+        # Recorded for verify(), before the entry can be modified in the cache. Hashed
+        # outside the transaction, and in the background with WRITE_BEHIND.
+        if os.path.isdir(temp_path):
+            digest = hash_directory(temp_path)
+        else:
+            digest = hash_file(temp_path)
+        entry = dict(entry, digest=digest)
+    cache_ref = cache_manager().cache()
+    tombstones = []
+    try:
+        with cache_ref.transact():
+            if cache_key in cache_ref or not _make_room(cache_ref, entry, tombstones):
+                return False
+            if temp_path is not None:
+                # Remove the directory left behind if an earlier writer died between
+                # publishing the entry and adding the key. Files are replaced atomically.
+                if os.path.isdir(entry["path"]):
+                    _bury(entry["path"], tombstones)
+                os.rename(temp_path, entry["path"])
+            entry = dict(entry, last_access=time.time())
+            status = cache_ref.add(cache_key, entry)
+            if status:
+                _lru_add(_lru(cache_ref), cache_key, entry)
+    finally:
+        _remove_paths(tombstones)
+    if status and push:
+        _push(cache_key, entry)
     return status
 
 
-def fetch_directory(dir_path: DirectoryPath, cache_key: str) -> bool:
+def _remote_contains(cache_key: str) -> bool:
+    remote = cache_manager().remote
+    if remote is None:
+        return False
+    try:
+        return remote.exists(f"{cache_key}/{_REMOTE_META}")
+    except Exception as exc:
+        warnings.warn(f"failed to look up cache entry '{cache_key}' remotely: {exc!r}")
+        return False
+
+
+def _push(cache_key: str, entry: Dict[str, Any]) -> None:
+    # Upload a local entry to the remote store, as a single data object followed by
+    # the metadata object which marks the entry as complete.
+    remote = cache_manager().remote
+    if remote is None or REMOTE_WRITE == "none":
+        return
+    if REMOTE_WRITE != "through":
+        raise ValueError(
+            f"unknown remote cache write policy '{REMOTE_WRITE}', expected 'through' or 'none'"
+        )
+    temp_dir = _temp_path(cache_key)
+    try:
+        os.makedirs(temp_dir)
+        meta = {"kind": entry["kind"], "size": entry["size"]}
+        if entry["kind"] == "file":
+            data = entry["path"]
+            meta["digest"] = os.path.basename(data)[len("BLOB_") :]
+        elif entry["kind"] == "dataframe":
+            data = entry["path"]
+            meta["format"] = entry["format"]
+        else:
+            # Directories are always transferred as a single tar.
+            pack_dir = entry["path"]
+            if not entry.get("pack"):
+                pack_dir = os.path.join(temp_dir, "pack")
+                _pack_directory(entry["path"], pack_dir, "tar")
+            with open(os.path.join(pack_dir, _PACK_INDEX)) as f:
+                index = json.load(f)
+            meta.update(pack=index["pack"], members=index["members"])
+            data = os.path.join(pack_dir, f"pack.{index['pack']}")
+        meta_path = os.path.join(temp_dir, _REMOTE_META)
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+        remote.upload(data, f"{cache_key}/{_REMOTE_DATA}")
+        remote.upload(meta_path, f"{cache_key}/{_REMOTE_META}")
+    except Exception as exc:
+        # The entry is still in the local cache directory.
+        warnings.warn(f"failed to upload cache entry '{cache_key}': {exc!r}")
+    finally:
+        _remove_path(temp_dir)
+
+
+def _pull(cache_key: str) -> None:
+    # Download an entry from the remote store into the local cache directory.
+    remote = cache_manager().remote
+    if remote is None:
+        return
+    temp_dir = _temp_path(cache_key)
+    try:
+        os.makedirs(temp_dir)
+        meta_path = os.path.join(temp_dir, _REMOTE_META)
+        if not remote.download(f"{cache_key}/{_REMOTE_META}", meta_path):
+            return
+        with open(meta_path) as f:
+            meta = json.load(f)
+        entry = {"kind": meta["kind"], "size": meta["size"]}
+        if meta["kind"] == "file":
+            entry["path"] = os.path.join(CACHE_DIR, f"BLOB_{meta['digest']}")
+            data = os.path.join(temp_dir, _REMOTE_DATA)
+        elif meta["kind"] == "dataframe":
+            entry["format"] = meta["format"]
+            entry["path"] = os.path.join(CACHE_DIR, f"FRAME_{cache_key}.{meta['format']}")
+            data = os.path.join(temp_dir, _REMOTE_DATA)
+        else:
+            entry["pack"] = meta["pack"]
+            entry["path"] = os.path.join(CACHE_DIR, f"DIR_{cache_key}")
+            pack_dir = os.path.join(temp_dir, "pack")
+            os.makedirs(pack_dir)
+            with open(os.path.join(pack_dir, _PACK_INDEX), "w") as f:
+                json.dump({"pack": meta["pack"], "members": meta["members"]}, f)
+            data = os.path.join(pack_dir, f"pack.{meta['pack']}")
+        if not remote.download(f"{cache_key}/{_REMOTE_DATA}", data):
+            return
+        if meta["kind"] == "directory":
+            entry["size"] = directory_size(pack_dir)
+            data = pack_dir
+        elif meta["kind"] == "file":
+            entry["digest"] = meta["digest"]
+        _publish(cache_key, entry, data, push=False)
+    except Exception as exc:
+        warnings.warn(f"failed to download cache entry '{cache_key}': {exc!r}")
+    finally:
+        _remove_path(temp_dir)
+
+
+class CacheLease(object):
+    """
+    Per-key lease which gives a single writer the right to fill a cache entry, so
+    that concurrent workers which miss on the same key compute it only once. The
+    lease is a lock file ``LOCK_<key>`` in the cache directory, created with
+    ``O_EXCL`` so that it also works across hosts sharing the cache over NFS.
+
+    Other workers wait until the lease is released, and should then check the cache
+    again before computing the entry themselves. The holder refreshes the lock file
+    in the background. A lock file which hasn't been refreshed for ``LEASE_TIMEOUT``
+    seconds is assumed to belong to a dead worker and is broken, by renaming it to a
+    unique name so that concurrent waiters can't break it twice. The lock file holds
+    a unique token of its holder, which only refreshes or removes a lock file with
+    its own token.
+
+    Usage::
+
+        with CacheLease(cache_key):
+            if not fetch_directory(dir_path, cache_key):
+                ...  # compute the outputs
+                cache_directory(dir_path, cache_key)
+    """
+
+    def __init__(self, cache_key: str):
+        """
+        :param cache_key: The cache key to be filled.
+        :type cache_key: str
+        """
+        self._path = os.path.join(CACHE_DIR, f"LOCK_{cache_key}")
+        self._token = None
+        self._stop = threading.Event()
+        self._heartbeat = None
+        self._detached = False
+
+    def try_acquire(self) -> bool:
+        """Tries to take the lease without waiting.
+
+        :return: True if the lease was taken.
+        :rtype: bool
+        """
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        token = f"{socket.gethostname()} {os.getpid()} {uuid.uuid4().hex}\n"
+        try:
+            fd = os.open(self._path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if self._break_stale():
+                return self.try_acquire()
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(token)
+        self._token = token
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._refresh, daemon=True)
+        self._heartbeat.start()
+        return True
+
+    def acquire(self) -> None:
+        """Waits until the lease is taken."""
+        while not self.try_acquire():
+            time.sleep(_LEASE_POLL_INTERVAL)
+
+    async def acquire_async(self) -> None:
+        """Waits until the lease is taken, without blocking the event loop. The lock
+        file is checked in the default executor."""
+        loop = asyncio.get_running_loop()
+        while not await loop.run_in_executor(None, self.try_acquire):
+            await asyncio.sleep(_LEASE_POLL_INTERVAL)
+
+    def release(self) -> None:
+        """Releases the lease. The lock file is left alone if the lease was broken
+        and taken by another worker in the meantime."""
+        self._stop.set()
+        self._heartbeat.join()
+        if _read_lock(self._path) == self._token:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._path)
+
+    def detach(self) -> None:
+        """Keeps the lease when leaving the ``with`` block, so that it can be
+        released by whoever finishes filling the entry, e.g. the :class:`CacheWriter`.
+        """
+        self._detached = True
+
+    def _refresh(self) -> None:
+        while not self._stop.wait(LEASE_TIMEOUT / 3):
+            if _read_lock(self._path) != self._token:
+                warnings.warn(f"lost the cache lease {self._path}, which was broken")
+                return
+            with contextlib.suppress(FileNotFoundError):
+                os.utime(self._path)
+
+    def _break_stale(self) -> bool:
+        # Break the lock file if it is stale, by renaming it to a unique name first so
+        # that only one worker breaks it. Returns True if it may be acquired again.
+        try:
+            token = _read_lock(self._path)
+            age = time.time() - os.stat(self._path).st_mtime
+        except FileNotFoundError:
+            # Released in the meantime.
+            return True
+        if token is None or age <= LEASE_TIMEOUT:
+            return token is None
+        stale_path = f"{self._path}.stale-{uuid.uuid4().hex}"
+        try:
+            os.rename(self._path, stale_path)
+        except FileNotFoundError:
+            # Broken by another worker.
+            return True
+        if _read_lock(stale_path) == token:
+            os.remove(stale_path)
+            return True
+        # Another worker broke the stale lock and took the lease in the meantime, so
+        # its lock file is put back, unless yet another one was created since.
+        with contextlib.suppress(FileExistsError):
+            os.link(stale_path, self._path)
+        os.remove(stale_path)
+        return False
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not self._detached:
+            self.release()
+
+    async def __aenter__(self):
+        await self.acquire_async()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if not self._detached:
+            await asyncio.get_running_loop().run_in_executor(None, self.release)
+
+
+def _read_lock(path: str) -> Optional[str]:
+    # Returns the token of the holder of a lock file, or None if there is none.
+    try:
+        with open(path) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+class CacheWriter(object):
+    """
+    Writes cache entries in a background thread when ``WRITE_BEHIND`` is set, so that
+    a task returns its outputs without waiting for them to be copied into the cache.
+    At most ``WRITE_QUEUE_SIZE`` writes are queued, after which submitting another
+    write blocks. Backends must :meth:`flush` the writer before deleting the outputs
+    being written, and can check :meth:`is_pending` before releasing an output early.
+    The writer is flushed when the interpreter exits.
+
+    Writes submitted from worker processes of a process pool are performed right
+    away, since the worker processes may exit before a background thread finishes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self._pending = collections.Counter()
+        self._thread = None
+
+    @property
+    def write_behind(self) -> bool:
+        return WRITE_BEHIND and multiprocessing.parent_process() is None
+
+    def submit(self, write: Callable[[], None], paths: Iterable[os.PathLike] = ()) -> None:
+        """Performs a cache write, in the background if ``WRITE_BEHIND`` is set.
+
+        :param write: Function which writes the cache entries.
+        :type write: Callable[[], None]
+        :param paths: The outputs which are read by ``write``.
+        :type paths: Iterable[os.PathLike]
+        """
+        if not self.write_behind:
+            write()
+            return
+        paths = [os.path.abspath(path) for path in paths]
+        with self._lock:
+            self._pending.update(paths)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._queue.put((write, paths))
+
+    def is_pending(self, path: os.PathLike) -> bool:
+        """Whether a queued write still reads from the given path or a path inside it.
+
+        :param path: The path of an output.
+        :type path: os.PathLike
+        :rtype: bool
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            return any(p == path or p.startswith(path + os.sep) for p in self._pending)
+
+    def flush(self) -> None:
+        """Waits until all submitted writes are finished."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def _run(self) -> None:
+        while True:
+            write, paths = self._queue.get()
+            try:
+                write()
+            except Exception as exc:
+                # A failed cache write only means a miss later on.
+                warnings.warn(f"failed to write cache entry: {exc!r}")
+            finally:
+                with self._lock:
+                    for path in paths:
+                        self._pending[path] -= 1
+                        if not self._pending[path]:
+                            del self._pending[path]
+                self._queue.task_done()
+
+    def _reset(self) -> None:
+        # The background thread doesn't exist in a forked child.
+        self.__init__()
+
+
+_CACHE_WRITER = CacheWriter()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_CACHE_WRITER._reset)
+
+# Finish queued writes before the interpreter kills the background thread, e.g. when
+# the process of an Argo or docker node exits right after running its task.
+atexit.register(_CACHE_WRITER.flush)
+
+
+def cache_writer() -> CacheWriter:
+    """Returns the process-wide :class:`CacheWriter`."""
+    return _CACHE_WRITER
+
+
+class MemoCache(object):
+    """
+    Process-local LRU cache of the return values of a task, for tasks which are
+    called directly with the same inputs over and over again, e.g. in a notebook or
+    a hyperparameter search loop. Values are keyed on the hashed inputs and the
+    config of a call. Copies of the values are memoized and returned, so that callers
+    can modify them. DIRECTORY and FILE outputs are memoized by path, and are a miss
+    once their path is removed.
+    """
+
+    def __init__(self, max_entries: Optional[int] = 128, max_bytes: Optional[int] = None):
+        """
+        :param max_entries: Maximum number of values kept, or None for no limit.
+        :type max_entries: int, optional
+        :param max_bytes: Maximum estimated total size of the values kept, or None
+            for no limit. Larger values are not memoized at all.
+        :type max_bytes: int, optional
+        """
+        if max_entries is not None and max_entries < 1:
+            raise ValueError(f"max_entries must be at least 1, got {max_entries}")
+        if max_bytes is not None and max_bytes < 1:
+            raise ValueError(f"max_bytes must be at least 1, got {max_bytes}")
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def max_entries(self) -> Optional[int]:
+        return self._max_entries
+
+    @property
+    def max_bytes(self) -> Optional[int]:
+        return self._max_bytes
+
+    def key(self, inputs: Dict[str, Any], config: Dict[str, Any]) -> str:
+        """Computes the key of a call.
+
+        :param inputs: All inputs of the task by name.
+        :type inputs: Dict[str, Any]
+        :param config: The task configuration.
+        :type config: Dict[str, Any]
+        :return: Hash of the inputs and the configuration.
+        :rtype: str
+        """
+        digest = hashlib.sha256()
+        digest.update(f"{json.dumps(config, sort_keys=True, default=str)}\0".encode())
+        for name in sorted(inputs):
+            digest.update(f"{name}\0{hash_value(inputs[name])}\0".encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Any:
+        """Looks up the value of a key, and marks it as most recently used.
+
+        :param key: Key from :meth:`key`.
+        :type key: str
+        :return: A copy of the memoized value, or None if there is none.
+        :rtype: Any
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not _memo_paths_exist(entry[0]):
+                self._bytes -= self._entries.pop(key)[1]
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._entries.move_to_end(key)
+        return copy.deepcopy(entry[0])
+
+    def put(self, key: str, value: Any) -> None:
+        """Memoizes a value, evicting the least recently used values to make room.
+
+        :param key: Key from :meth:`key`.
+        :type key: str
+        :param value: The return value of the call.
+        :type value: Any
+        """
+        size = _memo_size(value)
+        if self._max_bytes is not None and size > self._max_bytes:
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while (self._max_entries is not None and len(self._entries) > self._max_entries) or (
+                self._max_bytes is not None and self._bytes > self._max_bytes
+            ):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def stats(self) -> Dict[str, int]:
+        """Summarizes the memoized values.
+
+        :return: The number of ``entries``, their estimated total size in ``bytes``,
+            and the number of ``hits`` and ``misses`` of :meth:`get`.
+        :rtype: Dict[str, int]
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+    def clear(self) -> None:
+        """Drops all memoized values and resets the statistics."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = self._hits = self._misses = 0
+
+
+def _memo_size(value: Any) -> int:
+    # Estimate the memory held by a return value.
+    if pandas is not None and isinstance(value, pandas.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (tuple, list)):
+        return sum(_memo_size(item) for item in value)
+    if isinstance(value, dict):
+        return sum(_memo_size(item) for item in value.values())
+    return sys.getsizeof(value)
+
+
+def _memo_paths_exist(value: Any) -> bool:
+    # Check that the paths in a return value weren't removed since it was memoized.
+    if isinstance(value, os.PathLike):
+        return os.path.exists(value)
+    if isinstance(value, (tuple, list)):
+        return all(_memo_paths_exist(item) for item in value)
+    if isinstance(value, dict):
+        return all(_memo_paths_exist(item) for item in value.values())
+    return True
+
+
+def is_cached(cache_key: str) -> bool:
+    """Checks whether an entry exists for the given key, in the local cache
+    directory or in the remote store.
+
+    :param cache_key: The cache key to look up.
+    :type cache_key: str
+    :return: True if the key is present in the cache.
+    :rtype: bool
+    """
+    return cache_key in cache_manager().cache() or _remote_contains(cache_key)
+
+
+def fetch_directory(
+    dir_path: DirectoryPath, cache_key: str, strategy: Optional[str] = None
+) -> bool:
     """Retrieves a cached directory. Contents of the existing directory
     will get overwritten if they share the same file name with that of the
     files in the cache.
@@ -45,35 +952,892 @@ def fetch_directory(dir_path: DirectoryPath, cache_key: str) -> bool:
     :type dir_path: Path
     :param cache_key: The cache key which uniquely identifies the directory.
     :type cache_key: str
+    :param strategy: How to materialize the directory, see
+        :func:`materialize_directory`. Defaults to ``$PIRLIB_CACHE_MATERIALIZE``.
+        Packed directories are always extracted.
+    :type strategy: str, optional
     :return: True if the directory was retrived successfully, False otherwise.
     :rtype: bool
     """
     # Retreive the temp directory location if key exists.
-    with Cache(CACHE_DIR) as cache_ref:
-        if cache_key in cache_ref:
-            cached_dir = cache_ref.get(cache_key)
+    entry = _lookup(cache_key, "directory")
+    if entry is None:
+        return False
+
+    try:
+        if entry.get("pack"):
+            # Stream-extract packed directories.
+            PackedDirectory(entry["path"]).extract(dir_path)
         else:
-            return False
+            # Materialize the contents of the temp directory in the given directory.
+            materialize_directory(entry["path"], dir_path, strategy or MATERIALIZE)
+    except (FileNotFoundError, shutil.Error):
+        # The entry was evicted in the meantime.
+        return False
+
+    # An entry evicted part way through is moved away, and its copy may be partial.
+    return os.path.isdir(entry["path"])
+
+
+def open_directory(cache_key: str) -> Optional["PackedDirectory"]:
+    """Opens a read-only view of a packed cached directory, without extracting it.
+
+    :param cache_key: The cache key which uniquely identifies the directory.
+    :type cache_key: str
+    :return: The packed directory, or None if the key doesn't exist or its directory
+        isn't packed.
+    :rtype: PackedDirectory, optional
+    """
+    entry = _lookup(cache_key, "directory")
+    if entry is None or not entry.get("pack"):
+        return None
+    return PackedDirectory(entry["path"])
+
+
+class PackedDirectory(object):
+    """
+    Read-only view of a directory packed into ``pack.tar`` or ``pack.tar.zst``,
+    along with ``index.json`` which lists the regular files in the tar with the
+    offsets and sizes of their data. Files of an uncompressed tar are read in place
+    through the index. Compressed tars have to be decompressed up to the file being
+    opened, so they are better extracted as a whole.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: The directory holding the pack and its index.
+        :type path: str
+        """
+        with open(os.path.join(path, _PACK_INDEX)) as f:
+            index = json.load(f)
+        self._pack = index["pack"]
+        self._path = os.path.join(path, f"pack.{self._pack}")
+        self._members = index["members"]
 
-    # Copy the contents of the temp directory to the given directory.
-    shutil.copytree(cached_dir, dir_path, dirs_exist_ok=True)
+    def names(self) -> List[str]:
+        """Lists the relative paths of the regular files in the directory.
 
+        :return: The sorted relative paths.
+        :rtype: List[str]
+        """
+        return sorted(self._members)
+
+    def size(self, name: str) -> int:
+        """Returns the size in bytes of a file in the directory.
+
+        :param name: The relative path of the file.
+        :type name: str
+        :return: The size in bytes.
+        :rtype: int
+        """
+        return self._members[name][1]
+
+    def open(self, name: str) -> BinaryIO:
+        """Opens a file in the directory for reading.
+
+        :param name: The relative path of the file.
+        :type name: str
+        :raises KeyError: If the file doesn't exist.
+        :return: A binary file object.
+        :rtype: BinaryIO
+        """
+        offset, size = self._members[name]
+        if self._pack == "tar":
+            return io.BufferedReader(_MemberReader(self._path, offset, size))
+        with self._open_tar() as tar:
+            for member in tar:
+                if member.name == name:
+                    return io.BytesIO(tar.extractfile(member).read())
+        raise KeyError(name)
+
+    def extract(self, dir_path: DirectoryPath) -> None:
+        """Extracts the directory in a single streaming pass. Existing files with the
+        same names are replaced.
+
+        :param dir_path: The target directory, which is created if it doesn't exist.
+        :type dir_path: Path
+        """
+        os.makedirs(dir_path, exist_ok=True)
+        with self._open_tar() as tar:
+            for member in tar:
+                path = os.path.join(dir_path, member.name)
+                if os.path.isabs(member.name) or ".." in member.name.split("/"):
+                    raise ValueError(f"invalid path '{member.name}' in {self._path}")
+                if member.isdir():
+                    os.makedirs(path, exist_ok=True)
+                elif member.isreg():
+                    # Write regular files directly, which is much faster than the
+                    # generic extraction of the tarfile module.
+                    _remove_existing(path)
+                    with open(path, "wb") as f:
+                        shutil.copyfileobj(tar.extractfile(member), f, _CHUNK_SIZE)
+                    os.utime(path, (member.mtime, member.mtime))
+                    # Extracted files are copies, which are writable like those made
+                    # by materialize_directory, even if packed from read-only files.
+                    os.chmod(path, member.mode | stat.S_IWUSR)
+                else:
+                    _remove_existing(path)
+                    tar.extract(member, dir_path, **_EXTRACT_KWARGS)
+
+    @contextlib.contextmanager
+    def _open_tar(self) -> Iterator[tarfile.TarFile]:
+        with open(self._path, "rb") as f:
+            if self._pack == "tar.zst":
+                import zstandard
+
+                with zstandard.ZstdDecompressor().stream_reader(f) as stream:
+                    with tarfile.open(fileobj=stream, mode="r|") as tar:
+                        yield tar
+            else:
+                with tarfile.open(fileobj=f, mode="r|") as tar:
+                    yield tar
+
+
+class _MemberReader(io.RawIOBase):
+    # Reads the data of a single file from an uncompressed tar.
+
+    def __init__(self, path: str, offset: int, size: int):
+        self._file = open(path, "rb")
+        self._offset = offset
+        self._size = size
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        count = min(len(buffer), self._size - self._pos)
+        if count <= 0:
+            return 0
+        self._file.seek(self._offset + self._pos)
+        data = self._file.read(count)
+        buffer[: len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
+
+
+def _pack_directory(dir_path: DirectoryPath, pack_dir: str, pack: str) -> None:
+    # Write the files of a directory into `pack_dir/pack.<pack>` and its index.
+    if pack not in _PACK_FORMATS:
+        raise ValueError(f"unknown cache pack format '{pack}', expected one of {_PACK_FORMATS}")
+    os.makedirs(pack_dir)
+    members = {}
+    with contextlib.ExitStack() as stack:
+        f = stack.enter_context(open(os.path.join(pack_dir, f"pack.{pack}"), "wb"))
+        if pack == "tar.zst":
+            import zstandard
+
+            f = stack.enter_context(zstandard.ZstdCompressor().stream_writer(f))
+        tar = stack.enter_context(tarfile.open(fileobj=f, mode="w|"))
+        for root, dirs, files in os.walk(dir_path):
+            dirs.sort()
+            for name in sorted(dirs) + sorted(files):
+                path = os.path.join(root, name)
+                arcname = os.path.relpath(path, dir_path)
+                st = os.lstat(path)
+                if not stat.S_ISREG(st.st_mode) or st.st_nlink > 1:
+                    # Let the tarfile module handle links and special files.
+                    tarinfo = tar.gettarinfo(path, arcname)
+                else:
+                    # Skip the user and group name lookups of gettarinfo.
+                    tarinfo = tarfile.TarInfo(arcname)
+                    tarinfo.size, tarinfo.mtime = st.st_size, int(st.st_mtime)
+                    tarinfo.mode = stat.S_IMODE(st.st_mode)
+                if tarinfo.isreg():
+                    # Don't keep the read-only mode of cached files, see _make_read_only.
+                    tarinfo.mode |= stat.S_IWUSR
+                else:
+                    tar.addfile(tarinfo)
+                    if tarinfo.islnk() and tarinfo.linkname in members:
+                        # Hardlinks to files packed earlier share their data.
+                        members[arcname] = members[tarinfo.linkname]
+                    continue
+                with open(path, "rb") as member:
+                    tar.addfile(tarinfo, member)
+                # The data ends at the current offset, padded to whole blocks.
+                blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
+                padded = (blocks + (remainder > 0)) * tarfile.BLOCKSIZE
+                members[arcname] = [tar.offset - padded, tarinfo.size]
+    with open(os.path.join(pack_dir, _PACK_INDEX), "w") as f:
+        json.dump({"pack": pack, "members": members}, f)
+
+
+def fetch_file(file_path: FilePath, cache_key: str, strategy: Optional[str] = None) -> bool:
+    """Retrieves a cached file, replacing the file at the given path.
+
+    :param file_path: The path to retrieve the file to.
+    :type file_path: Path
+    :param cache_key: The cache key which uniquely identifies the file.
+    :type cache_key: str
+    :param strategy: How to materialize the file, see :func:`materialize_directory`.
+    :type strategy: str, optional
+    :return: True if the file was retrived successfully, False otherwise.
+    :rtype: bool
+    """
+    entry = _lookup(cache_key, "file")
+    if entry is None:
+        return False
+    try:
+        _COPY_FUNCTIONS[strategy or MATERIALIZE](entry["path"], file_path)
+    except FileNotFoundError:
+        # The entry was evicted in the meantime.
+        return False
+    return True
+
+
+def fetch_dataframe(cache_key: str) -> Optional["pandas.DataFrame"]:
+    """Retrieves a cached DataFrame. DataFrames stored in the Arrow IPC format are
+    memory-mapped rather than read into a buffer first.
+
+    :param cache_key: The cache key which uniquely identifies the DataFrame.
+    :type cache_key: str
+    :return: The DataFrame, or None if the key doesn't exist.
+    :rtype: pandas.DataFrame, optional
+    """
+    entry = _lookup(cache_key, "dataframe")
+    if entry is None:
+        return None
+    try:
+        if entry["format"] == "arrow":
+            return pyarrow.feather.read_table(entry["path"], memory_map=True).to_pandas()
+        return pandas.read_pickle(entry["path"])
+    except FileNotFoundError:
+        # The entry was evicted in the meantime.
+        return None
+
+
+def _lookup(cache_key: str, kind: str) -> Optional[Dict[str, Any]]:
+    # Retrieve the entry of a key, and record the access for the LRU eviction. Entries
+    # missing from the local cache directory are downloaded from the remote store.
+    cache_ref = cache_manager().cache()
+    if cache_key not in cache_ref:
+        _pull(cache_key)
+    with cache_ref.transact():
+        entry = _entry_info(cache_ref.get(cache_key))
+        if entry is None or entry["kind"] != kind:
+            return None
+        last_access = time.time()
+        _lru_touch(_lru(cache_ref), cache_key, entry, last_access)
+        cache_ref.set(cache_key, dict(entry, last_access=last_access))
+    return entry
+
+
+def directory_size(dir_path: DirectoryPath) -> int:
+    """Computes the total size of the files in a directory.
+
+    :param dir_path: The directory to be measured.
+    :type dir_path: Path
+    :return: The total size in bytes.
+    :rtype: int
+    """
+    size = 0
+    for root, _, files in os.walk(dir_path):
+        for name in files:
+            size += os.lstat(os.path.join(root, name)).st_size
+    return size
+
+
+def _entry_info(value: Any) -> Optional[Dict[str, Any]]:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        # Entries added before sizes were tracked only store the path, and are
+        # treated as least recently used.
+        value = {"path": value, "size": directory_size(value), "last_access": 0.0}
+    # Entries without a kind were all added by cache_directory.
+    return dict({"kind": "directory"}, **value)
+
+
+def _make_room(cache_ref: Cache, new_entry: Dict[str, Any], tombstones: List[str]) -> bool:
+    # Evict the least recently used entries until the new entry fits in the cache.
+    if not MAX_BYTES:
+        return True
+    if new_entry["size"] > MAX_BYTES:
+        return False
+    _evict(cache_ref, tombstones, max_bytes=MAX_BYTES, new_entry=new_entry)
+    return True
+
+
+def _evict(
+    cache_ref: Cache,
+    tombstones: List[str],
+    max_bytes: Optional[int] = None,
+    before: Optional[float] = None,
+    new_entry: Optional[Dict[str, Any]] = None,
+) -> List[str]:
+    # Evict the least recently used entries until the rest, along with new_entry, fit
+    # in max_bytes, and every entry last accessed before the given time. The paths of
+    # the evicted entries are only moved to tombstones, which are removed by the
+    # caller once the transaction is over.
+    lru = _lru(cache_ref)
+    total = lru.get("bytes", 0)
+    keep = None
+    if new_entry is not None:
+        total += new_entry["size"]
+        # File blobs can be shared with the new entry.
+        keep = new_entry["path"]
+    evicted = []
+    for record in lru.iterkeys():
+        if not record.startswith("a "):
+            break
+        last_access = float(record.split(" ")[1])
+        over_budget = max_bytes is not None and total > max_bytes
+        if not over_budget and (before is None or last_access >= before):
+            break
+        key = lru[record]
+        entry = _entry_info(cache_ref.get(key))
+        if entry is None or _lru_record(key, entry["last_access"]) != record:
+            # Left behind by a writer which died, see _lru.
+            lru.delete(record)
+            continue
+        _delete_entry(cache_ref, key, entry, tombstones, keep)
+        total -= entry["size"]
+        evicted.append(key)
+    return evicted
+
+
+def _delete_entry(
+    cache_ref: Cache,
+    cache_key: str,
+    entry: Dict[str, Any],
+    tombstones: List[str],
+    keep: Optional[str] = None,
+) -> None:
+    # File blobs can be shared by several keys, and are only removed with the last.
+    cache_ref.delete(cache_key)
+    if _lru_remove(_lru(cache_ref), cache_key, entry) and entry["path"] != keep:
+        _bury(entry["path"], tombstones)
+
+
+def _lru(cache_ref: Cache) -> Cache:
+    # The entries of the cache in least recently used order, along with their total
+    # size and the number of keys sharing each path, in the ``LRU`` directory of the
+    # cache, so that eviction doesn't have to scan every entry. It's only updated in a
+    # transaction of the cache, and built from the entries on first use. prune()
+    # rebuilds it, in case a writer died between the two.
+    lru = cache_manager().cache(os.path.join(CACHE_DIR, "LRU"))
+    if "ready" not in lru:
+        with lru.transact():
+            lru.clear()
+            for key in cache_ref:
+                entry = _entry_info(cache_ref.get(key))
+                if entry is not None:
+                    _lru_add(lru, key, entry)
+            lru["ready"] = True
+    return lru
+
+
+def _lru_record(cache_key: str, last_access: float) -> str:
+    # Keys of the records sort by last access, and before the other keys of the LRU.
+    return f"a {last_access:017.6f} {cache_key}"
+
+
+def _lru_add(lru: Cache, cache_key: str, entry: Dict[str, Any]) -> None:
+    with lru.transact():
+        lru[_lru_record(cache_key, entry["last_access"])] = cache_key
+        lru.incr("bytes", entry["size"])
+        lru.incr(f"refs {entry['path']}")
+
+
+def _lru_touch(lru: Cache, cache_key: str, entry: Dict[str, Any], last_access: float) -> None:
+    with lru.transact():
+        lru.delete(_lru_record(cache_key, entry["last_access"]))
+        lru[_lru_record(cache_key, last_access)] = cache_key
+
+
+def _lru_remove(lru: Cache, cache_key: str, entry: Dict[str, Any]) -> bool:
+    # Returns True if no other key shares the path of the entry.
+    refs = f"refs {entry['path']}"
+    with lru.transact():
+        lru.delete(_lru_record(cache_key, entry["last_access"]))
+        lru.decr("bytes", entry["size"])
+        if lru.decr(refs) > 0:
+            return False
+        lru.delete(refs)
     return True
 
 
-def generate_cache_key(key_file: FilePath) -> str:
-    """Create cache key given an input file.
+def _bury(path: str, tombstones: List[str]) -> None:
+    # Move the path of an entry out of the way, to be removed later by _remove_paths.
+    tombstone = os.path.join(CACHE_DIR, f"DEAD_{uuid.uuid4().hex}")
+    try:
+        os.rename(path, tombstone)
+    except FileNotFoundError:
+        return
+    except OSError:
+        # E.g. entries from before the cache directory was moved.
+        _remove_path(path)
+        return
+    tombstones.append(tombstone)
+
+
+def _remove_paths(paths: Iterable[str]) -> None:
+    for path in paths:
+        _remove_path(path)
+
+
+def _remove_path(path: str) -> None:
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+def record_lookup(hit: bool) -> None:
+    """Counts a cache hit or miss of a task in the ``STATS`` directory of the
+    cache, see :func:`cache_stats`.
+
+    :param hit: Whether the outputs of the task were found in the cache.
+    :type hit: bool
+    """
+    stats = cache_manager().cache(os.path.join(CACHE_DIR, "STATS"))
+    stats.incr("hits" if hit else "misses")
+
+
+def cache_stats() -> Dict[str, int]:
+    """Summarizes the local cache directory.
+
+    :return: The number of ``entries``, their total size in ``bytes``, and the
+        number of task ``hits`` and ``misses`` counted by :func:`record_lookup`.
+    :rtype: Dict[str, int]
+    """
+    entries = list_entries()
+    stats = cache_manager().cache(os.path.join(CACHE_DIR, "STATS"))
+    return {
+        "entries": len(entries),
+        # Blobs shared by several keys are only stored once.
+        "bytes": sum({entry["path"]: entry["size"] for entry in entries.values()}.values()),
+        "hits": stats.get("hits", 0),
+        "misses": stats.get("misses", 0),
+    }
+
+
+def list_entries() -> Dict[str, Dict[str, Any]]:
+    """Lists the entries of the local cache directory.
+
+    :return: The ``kind``, ``path``, ``size``, ``last_access`` time and ``digest`` of
+        the contents of each entry, by key. Entries cached by older versions have no
+        digest.
+    :rtype: Dict[str, Dict[str, Any]]
+    """
+    cache_ref = cache_manager().cache()
+    entries = {}
+    with cache_ref.transact():
+        for key in cache_ref:
+            entry = _entry_info(cache_ref.get(key))
+            if entry is not None:
+                entries[key] = entry
+    return entries
+
+
+def prune(max_age: Optional[float] = None, max_bytes: Optional[int] = None) -> List[str]:
+    """Removes entries from the local cache directory, least recently used first,
+    along with the files of evicted entries left behind by workers which died.
+    Entries in the remote store are left alone.
+
+    :param max_age: Remove the entries which weren't accessed for this many seconds.
+    :type max_age: float, optional
+    :param max_bytes: Remove entries until the rest fit in this many bytes.
+    :type max_bytes: int, optional
+    :return: The keys of the removed entries.
+    :rtype: List[str]
+    """
+    before = None if max_age is None else time.time() - max_age
+    cache_ref = cache_manager().cache()
+    tombstones = glob.glob(os.path.join(CACHE_DIR, "DEAD_*"))
+    try:
+        with cache_ref.transact():
+            cache_manager().cache(os.path.join(CACHE_DIR, "LRU")).delete("ready")
+            return _evict(cache_ref, tombstones, max_bytes=max_bytes, before=before)
+    finally:
+        _remove_paths(tombstones)
+
+
+def verify(delete: bool = False) -> Dict[str, Optional[bool]]:
+    """Checks that the contents of each entry in the local cache directory match the
+    digest recorded when it was cached. File blobs are named after their digest.
+
+    :param delete: Remove the entries which don't match.
+    :type delete: bool
+    :return: True if an entry matches, False if it doesn't or its contents are
+        missing, or None if it was cached without a digest, by key.
+    :rtype: Dict[str, Optional[bool]]
+    """
+    entries = list_entries()
+    results = {}
+    # Hash the entries outside of a transaction, since that may take a while.
+    for key, entry in entries.items():
+        if not os.path.exists(entry["path"]):
+            results[key] = False
+        elif "digest" not in entry:
+            # Entries cached by older versions can't be checked.
+            results[key] = None
+        elif os.path.isdir(entry["path"]):
+            results[key] = hash_directory(entry["path"]) == entry["digest"]
+        else:
+            results[key] = hash_file(entry["path"]) == entry["digest"]
+    if not delete:
+        return results
+    cache_ref = cache_manager().cache()
+    tombstones = []
+    try:
+        with cache_ref.transact():
+            for key, ok in results.items():
+                # Skip entries which were replaced in the meantime.
+                entry = _entry_info(cache_ref.get(key))
+                if ok is False and entry is not None and entry["path"] == entries[key]["path"]:
+                    _delete_entry(cache_ref, key, entry, tombstones)
+    finally:
+        _remove_paths(tombstones)
+    return results
+
+
+def materialize_directory(src_dir: DirectoryPath, dst_dir: DirectoryPath, strategy: str) -> None:
+    """Recreates the files of a directory inside another directory.
+
+    - ``"copy"`` copies every file.
+    - ``"hardlink"`` hardlinks every file, so both directories share the same data.
+    - ``"reflink"`` clones every file with copy-on-write, where the filesystem
+      supports it (e.g. Btrfs, XFS).
+    - ``"symlink"`` creates symbolic links to the files in ``src_dir``.
 
-    :param key_file: Input file to read the key.
+    Hardlinked and symlinked files must not be modified in place, since that would
+    also modify the files in ``src_dir``. Cached files are stored read-only to catch
+    this, and copies of them are made writable again. Files which can't be
+    hardlinked or reflinked, e.g. because the directories are on different
+    filesystems, are copied instead.
+
+    Symbolic links to a cached directory dangle once its entry is evicted, pruned
+    or deleted by :func:`verify`, including while a pipeline using them still runs.
+    The in-process backends replace links into the cache with copies when outputs
+    are published, see :func:`resolve_cache_links`, but links in the outputs of
+    other backends are left as they are. Only use ``"symlink"`` for intermediate
+    outputs, with a cache which isn't pruned during runs.
+
+    :param src_dir: The directory to be materialized.
+    :type src_dir: Path
+    :param dst_dir: The target directory, which is created if it doesn't exist.
+        Existing files with the same names are replaced.
+    :type dst_dir: Path
+    :param strategy: One of ``"copy"``, ``"hardlink"``, ``"reflink"`` or ``"symlink"``.
+    :type strategy: str
+    :raises ValueError: If the strategy is unknown.
+    """
+    try:
+        copy_function = _COPY_FUNCTIONS[strategy]
+    except KeyError:
+        raise ValueError(
+            f"unknown cache materialization strategy '{strategy}', "
+            f"expected one of {list(_COPY_FUNCTIONS)}"
+        )
+    shutil.copytree(src_dir, dst_dir, copy_function=copy_function, dirs_exist_ok=True)
+
+
+def _copy(src: str, dst: str) -> None:
+    # Never write through an existing link into the file it points to.
+    _remove_existing(dst)
+    shutil.copy2(src, dst)
+    _make_writable(dst)
+
+
+def _hardlink(src: str, dst: str) -> None:
+    _remove_existing(dst)
+    try:
+        os.link(src, dst)
+    except OSError as err:
+        if err.errno not in _NO_LINK_ERRNOS:
+            raise
+        shutil.copy2(src, dst)
+
+
+def _reflink(src: str, dst: str) -> None:
+    _remove_existing(dst)
+    try:
+        import fcntl
+
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+    except (ImportError, OSError) as err:
+        if isinstance(err, OSError) and err.errno not in _NO_LINK_ERRNOS:
+            raise
+        shutil.copy2(src, dst)
+    _make_writable(dst)
+
+
+def _symlink(src: str, dst: str) -> None:
+    _remove_existing(dst)
+    os.symlink(os.path.abspath(src), dst)
+
+
+def _remove_existing(path: str) -> None:
+    if os.path.lexists(path):
+        os.remove(path)
+
+
+def _make_read_only(path: str) -> None:
+    # Clear the write bits of the files, which are shared with hardlinked outputs.
+    paths = [path] if not os.path.isdir(path) else []
+    for root, _, files in os.walk(path):
+        paths.extend(os.path.join(root, name) for name in files)
+    for file_path in paths:
+        if not os.path.islink(file_path):
+            mode = stat.S_IMODE(os.lstat(file_path).st_mode)
+            os.chmod(file_path, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+def _make_writable(path: str) -> None:
+    os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) | stat.S_IWUSR)
+
+
+def resolve_cache_links(path: os.PathLike) -> None:
+    """Replaces symbolic links into the cache directory with copies of the files
+    they point to, so that an output materialized with the ``"symlink"`` strategy
+    stays valid after its cache entry is evicted, see :func:`materialize_directory`.
+
+    :param path: A file, or a directory which is searched recursively.
+    :type path: Path
+    """
+    cache_dir = os.path.join(os.path.realpath(CACHE_DIR), "")
+    links = [str(path)] if os.path.islink(path) else []
+    for root, _, files in os.walk(path):
+        links.extend(os.path.join(root, name) for name in files)
+    for link in links:
+        target = os.path.realpath(link)
+        if os.path.islink(link) and target.startswith(cache_dir) and os.path.isfile(target):
+            # Copy next to the link and rename over it, so the output is never partial.
+            temp_path = f"{link}.tmp-{uuid.uuid4().hex}"
+            _copy(target, temp_path)
+            os.replace(temp_path, link)
+
+
+_COPY_FUNCTIONS = {
+    "copy": _copy,
+    "hardlink": _hardlink,
+    "reflink": _reflink,
+    "symlink": _symlink,
+}
+
+
+def generate_cache_key(key_file: Union[FilePath, DirectoryPath]) -> str:
+    """Create cache key given an input file or directory.
+
+    :param key_file: Input file or directory to read the key.
     :type key_file: Path
     :return: hashed value of the key read.
     :rtype: str
     """
+    # Hash the contents of the key file in chunks, reusing the digests of unchanged
+    # files from the hash index.
+    with hash_index() as index:
+        if os.path.isdir(key_file):
+            key_data = hash_directory(key_file, index=index)
+        else:
+            key_data = hash_file(key_file, index=index)
 
-    # Read contents of key file as a string.
-    with open(str(key_file), "r") as f:
-        key_data = f.read()
-
-    # Compute a hash value from the key file contents.
-    cache_key = hashlib.sha256(f"{str(key_file)}_{key_data}".encode()).hexdigest()
+    # Compute a hash value from the key file path and contents.
+    cache_key = hashlib.sha256(f"{str(key_file)}\0{key_data}".encode()).hexdigest()
     return cache_key
+
+
+@contextlib.contextmanager
+def hash_index() -> Iterator[Cache]:
+    """Opens the persistent index which maps ``(path, size, mtime, inode)`` of a
+    file to the digest of its contents, so that unchanged files don't need to be
+    hashed again. The index is stored in ``$PIRLIB_HASH_INDEX_DIR``, or in the
+    ``HASHES`` directory of the cache.
+
+    :return: A context manager yielding the index.
+    :rtype: Iterator[Cache]
+    """
+    yield cache_manager().cache(HASH_INDEX_DIR or os.path.join(CACHE_DIR, "HASHES"))
+
+
+def hash_file(file_path: FilePath, index: Optional[Cache] = None) -> str:
+    """Hash the contents of a file without reading it into memory at once.
+
+    :param file_path: The file to be hashed.
+    :type file_path: Path
+    :param index: Hash index from :func:`hash_index` to look up and store the
+        digest of the file.
+    :type index: Cache, optional
+    :return: Hex digest of the file contents.
+    :rtype: str
+    """
+    if index is None:
+        return _hash_contents(file_path)
+    st = os.stat(file_path)
+    # Files modified within the mtime resolution of the filesystem could change again
+    # without changing their stat, so they aren't indexed.
+    if st.st_size < _INDEX_MIN_SIZE or time.time() - st.st_mtime < _INDEX_MIN_AGE:
+        return _hash_contents(file_path)
+    key = (os.path.abspath(file_path), st.st_size, st.st_mtime_ns, st.st_ino)
+    digest = index.get(key)
+    if digest is None:
+        digest = _hash_contents(file_path)
+        index.set(key, digest)
+    return digest
+
+
+def _hash_contents(file_path: FilePath) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_directory(dir_path: DirectoryPath, index: Optional[Cache] = None) -> str:
+    """Hash a directory as a Merkle tree. The digest of a directory covers the
+    sorted names, types and digests of its entries.
+
+    :param dir_path: The directory to be hashed.
+    :type dir_path: Path
+    :param index: Hash index from :func:`hash_index` for the files.
+    :type index: Cache, optional
+    :return: Hex digest of the directory contents.
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    with os.scandir(dir_path) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+    for entry in entries:
+        if entry.is_dir():
+            kind, child = "d", hash_directory(entry.path, index=index)
+        else:
+            kind, child = "f", hash_file(entry.path, index=index)
+        digest.update(f"{kind}\0{entry.name}\0{child}\0".encode())
+    return digest.hexdigest()
+
+
+def hash_dataframe(df: "pandas.DataFrame") -> str:
+    """Hash a DataFrame using pandas' vectorized row-wise hash.
+
+    :param df: The DataFrame to be hashed.
+    :type df: pandas.DataFrame
+    :return: Hex digest of the DataFrame's columns, dtypes, index and values.
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    digest.update(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode())
+    digest.update(pandas.util.hash_pandas_object(df, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+def hash_value(value: Any, index: Optional[Cache] = None) -> str:
+    """Hash a task input according to its iotype.
+
+    :param value: A :obj:`DirectoryPath`, :obj:`FilePath` or ``pandas.DataFrame``.
+    :type value: Any
+    :param index: Hash index from :func:`hash_index` for the files.
+    :type index: Cache, optional
+    :raises TypeError: If the type of the value can't be hashed.
+    :return: Hex digest of the value.
+    :rtype: str
+    """
+    if isinstance(value, DirectoryPath):
+        return hash_directory(value, index=index)
+    if isinstance(value, FilePath):
+        return hash_file(value, index=index)
+    if pandas is not None and isinstance(value, pandas.DataFrame):
+        return hash_dataframe(value)
+    raise TypeError(f"cannot compute cache key for value of type {type(value)}")
+
+
+def generate_task_cache_key(inputs: Dict[str, Any], config: Dict[str, Any], code: str) -> str:
+    """Create a content-addressed cache key for a task invocation.
+
+    :param inputs: All inputs of the task by name.
+    :type inputs: Dict[str, Any]
+    :param config: The task configuration.
+    :type config: Dict[str, Any]
+    :param code: Source code of the task.
+    :type code: str
+    :return: Hash of the inputs, the configuration and the code.
+    :rtype: str
+    """
+    return generate_inputs_cache_key(inputs, task_digest(config, code))
+
+
+def task_digest(config: Dict[str, Any], code: str) -> str:
+    """Hash the configuration and the code of a task, which is the part of its cache
+    keys which doesn't depend on the inputs. It can be computed ahead of time, e.g.
+    by a backend which looks up the cache without importing the task.
+
+    :param config: The task configuration.
+    :type config: Dict[str, Any]
+    :param code: Source code of the task.
+    :type code: str
+    :return: Hex digest of the configuration and the code.
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{code}\0".encode())
+    digest.update(f"{json.dumps(config, sort_keys=True, default=str)}\0".encode())
+    return digest.hexdigest()
+
+
+def generate_inputs_cache_key(inputs: Dict[str, Any], task_digest: str) -> str:
+    """Create a content-addressed cache key for a task invocation, given the digest
+    of the task from :func:`task_digest`.
+
+    :param inputs: All inputs of the task by name.
+    :type inputs: Dict[str, Any]
+    :param task_digest: Hash of the configuration and the code of the task.
+    :type task_digest: str
+    :return: Hash of the inputs and the task.
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{task_digest}\0".encode())
+    with hash_index() as index:
+        for name in sorted(inputs):
+            digest.update(f"{name}\0{hash_value(inputs[name], index=index)}\0".encode())
+    return digest.hexdigest()
+
+
+def output_cache_key(cache_key: str, output_name: str) -> str:
+    """Derive the cache key of one output of a task from the cache key of the call.
+
+    :param cache_key: Cache key of the task invocation.
+    :type cache_key: str
+    :param output_name: Name of the output, e.g. ``return`` or ``return.0``.
+    :type output_name: str
+    :rtype: str
+    """
+    # Single-output tasks keep using the bare cache key.
+    return cache_key if output_name == "return" else f"{cache_key}-{output_name}"
+
+
+def fetch_outputs(outputs: Dict[str, Tuple[str, Any]], cache_key: str) -> Optional[Dict[str, Any]]:
+    """Retrieves all cached outputs of a task invocation, if they are all cached.
+
+    :param outputs: The iotype and the location of each output by name. Locations of
+        DATAFRAME outputs are ignored.
+    :type outputs: Dict[str, Tuple[str, Any]]
+    :param cache_key: Cache key of the task invocation.
+    :type cache_key: str
+    :return: The value of each output by name, or None if any of them isn't cached.
+    :rtype: Dict[str, Any], optional
+    """
+    keys = {name: output_cache_key(cache_key, name) for name in outputs}
+    if not all(cache_manager().contains_many(keys.values()).values()):
+        return None
+    values = {}
+    for name, (iotype, location) in outputs.items():
+        if iotype == "DIRECTORY":
+            value = location if fetch_directory(location, keys[name]) else None
+        elif iotype == "FILE":
+            value = location if fetch_file(location, keys[name]) else None
+        else:
+            value = fetch_dataframe(keys[name])
+        if value is None:
+            # Evicted since the lookup.
+            return None
+        values[name] = value
+    return values
@@ -0,0 +1,188 @@
+import os
+import shutil
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+_CHUNK_SIZE = 1 << 20
+
+
+class CacheStore(object):
+    """
+    Shared backing store of the cache, which holds immutable objects by name. Objects
+    are only ever written once, and a store must never expose a partially written
+    object under its name.
+
+    Subclasses implement :meth:`exists`, :meth:`download` and :meth:`upload`, and can
+    be registered for a URL scheme with :func:`register_store`.
+    """
+
+    def exists(self, name: str) -> bool:
+        """Whether an object exists in the store.
+
+        :param name: Name of the object.
+        :type name: str
+        :rtype: bool
+        """
+        raise NotImplementedError
+
+    def download(self, name: str, dest: str) -> bool:
+        """Downloads an object to a local file.
+
+        :param name: Name of the object.
+        :type name: str
+        :param dest: Path of the local file to write.
+        :type dest: str
+        :return: True if the object was downloaded, False if it doesn't exist.
+        :rtype: bool
+        """
+        raise NotImplementedError
+
+    def upload(self, src: str, name: str) -> None:
+        """Uploads a local file as an object.
+
+        :param src: Path of the local file to upload.
+        :type src: str
+        :param name: Name of the object.
+        :type name: str
+        """
+        raise NotImplementedError
+
+
+class FilesystemStore(CacheStore):
+    """
+    Store which keeps objects as files under a directory, e.g. on a shared NFS volume.
+    Objects are copied into a temporary file first and renamed into place.
+    """
+
+    def __init__(self, root: str):
+        """
+        :param root: Directory holding the objects.
+        :type root: str
+        """
+        self._root = root
+
+    @property
+    def root(self) -> str:
+        return self._root
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(self._path(name))
+
+    def download(self, name: str, dest: str) -> bool:
+        try:
+            shutil.copyfile(self._path(name), dest)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def upload(self, src: str, name: str) -> None:
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+        try:
+            shutil.copyfile(src, temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self._root, *name.split("/"))
+
+
+class HTTPStore(CacheStore):
+    """
+    Store which keeps objects behind an HTTP endpoint, using ``HEAD`` and ``GET`` to
+    read them and ``PUT`` to write them. This works with object stores such as S3,
+    GCS or MinIO through a bucket URL which accepts unauthenticated or pre-signed
+    requests, or with any web server which supports ``PUT``.
+    """
+
+    def __init__(self, url: str, timeout: float = 60):
+        """
+        :param url: Base URL of the objects.
+        :type url: str
+        :param timeout: Timeout in seconds of each request.
+        :type timeout: float
+        """
+        self._url = url.rstrip("/")
+        self._timeout = timeout
+
+    @property
+    def url(self) -> str:
+        return self._url
+
+    def exists(self, name: str) -> bool:
+        request = urllib.request.Request(self._object_url(name), method="HEAD")
+        try:
+            urllib.request.urlopen(request, timeout=self._timeout).close()
+        except urllib.error.HTTPError as err:
+            if err.code == 404:
+                return False
+            raise
+        return True
+
+    def download(self, name: str, dest: str) -> bool:
+        try:
+            response = urllib.request.urlopen(self._object_url(name), timeout=self._timeout)
+        except urllib.error.HTTPError as err:
+            if err.code == 404:
+                return False
+            raise
+        with response, open(dest, "wb") as f:
+            shutil.copyfileobj(response, f, _CHUNK_SIZE)
+        return True
+
+    def upload(self, src: str, name: str) -> None:
+        with open(src, "rb") as f:
+            request = urllib.request.Request(
+                self._object_url(name),
+                data=f,
+                method="PUT",
+                headers={"Content-Length": str(os.fstat(f.fileno()).st_size)},
+            )
+            urllib.request.urlopen(request, timeout=self._timeout).close()
+
+    def _object_url(self, name: str) -> str:
+        return f"{self._url}/{urllib.parse.quote(name)}"
+
+
+_STORE_TYPES = {
+    "file": lambda url: FilesystemStore(urllib.parse.urlparse(url).path),
+    "http": HTTPStore,
+    "https": HTTPStore,
+}
+
+
+def register_store(scheme: str, factory) -> None:
+    """Registers a store type for a URL scheme.
+
+    :param scheme: The URL scheme, e.g. ``"s3"``.
+    :type scheme: str
+    :param factory: Callable which creates the store given its URL.
+    :type factory: Callable[[str], CacheStore]
+    """
+    _STORE_TYPES[scheme] = factory
+
+
+def open_store(url: str) -> CacheStore:
+    """Creates the store for a URL. Plain paths are opened as a
+    :class:`FilesystemStore`.
+
+    :param url: URL of the store, e.g. ``file:///mnt/nfs/cache`` or
+        ``http://minio:9000/pirlib-cache``.
+    :type url: str
+    :raises ValueError: If there is no store type for the URL scheme.
+    :return: The store.
+    :rtype: CacheStore
+    """
+    scheme = urllib.parse.urlparse(url).scheme
+    if not scheme:
+        return FilesystemStore(url)
+    if scheme not in _STORE_TYPES:
+        raise ValueError(
+            f"unknown cache store scheme '{scheme}', expected one of {list(_STORE_TYPES)}"
+        )
+    return _STORE_TYPES[scheme](url)
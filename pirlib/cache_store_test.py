@@ -0,0 +1,131 @@
+import http.server
+import os
+import shutil
+import threading
+
+import pandas
+import pytest
+import pirlib.cache
+from pirlib.cache import (
+    cache_dataframe,
+    cache_directory,
+    cache_file,
+    cache_manager,
+    fetch_dataframe,
+    fetch_directory,
+    fetch_file,
+    is_cached,
+)
+from pirlib.cache_store import FilesystemStore, HTTPStore, open_store
+from pirlib.iotypes import DirectoryPath, FilePath
+
+
+class _ObjectHandler(http.server.BaseHTTPRequestHandler):
+    # Minimal object store serving the files under `server.root`.
+
+    def _path(self):
+        return os.path.join(self.server.root, self.path.lstrip("/"))
+
+    def do_HEAD(self):
+        self.send_response(200 if os.path.isfile(self._path()) else 404)
+        self.end_headers()
+
+    def do_GET(self):
+        if not os.path.isfile(self._path()):
+            self.send_error(404)
+            return
+        with open(self._path(), "rb") as f:
+            data = f.read()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_PUT(self):
+        os.makedirs(os.path.dirname(self._path()), exist_ok=True)
+        with open(self._path(), "wb") as f:
+            f.write(self.rfile.read(int(self.headers["Content-Length"])))
+        self.send_response(201)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_store(tmp_path):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _ObjectHandler)
+    server.root = str(tmp_path / "objects")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield HTTPStore(f"http://127.0.0.1:{server.server_port}/cache")
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fs_store(tmp_path):
+    return FilesystemStore(str(tmp_path / "objects"))
+
+
+@pytest.fixture(params=["fs_store", "http_store"])
+def remote(request, monkeypatch):
+    store = request.getfixturevalue(request.param)
+    cache_manager().set_remote(store)
+    yield store
+    cache_manager().set_remote(None)
+
+
+def _use_local_dir(monkeypatch, path):
+    monkeypatch.setattr(pirlib.cache, "CACHE_DIR", str(path))
+
+
+def test_tiered_cache(tmp_path, monkeypatch, remote):
+    src = tmp_path / "src"
+    (src / "sub").mkdir(parents=True)
+    (src / "sub" / "a.txt").write_text("a")
+    (tmp_path / "file.bin").write_bytes(b"\x00file")
+    df = pandas.DataFrame({"x": [1, 2]})
+
+    # Fill the cache on one host, which pushes the entries to the remote store.
+    _use_local_dir(monkeypatch, tmp_path / "host_a")
+    assert cache_directory(DirectoryPath(src), "dir")
+    assert cache_file(FilePath(tmp_path / "file.bin"), "file")
+    assert cache_dataframe(df, "frame")
+
+    # Another host misses locally and reads through to the remote store.
+    _use_local_dir(monkeypatch, tmp_path / "host_b")
+    assert is_cached("dir") and not is_cached("missing")
+    assert fetch_directory(DirectoryPath(tmp_path / "dst"), "dir")
+    assert (tmp_path / "dst" / "sub" / "a.txt").read_text() == "a"
+    # The cached files are read-only, but the fetched copies aren't.
+    assert os.stat(tmp_path / "dst" / "sub" / "a.txt").st_mode & 0o200
+    assert fetch_file(FilePath(tmp_path / "dst.bin"), "file")
+    assert (tmp_path / "dst.bin").read_bytes() == b"\x00file"
+    pandas.testing.assert_frame_equal(fetch_dataframe("frame"), df)
+
+    # Later hits are served from the local cache directory.
+    cache_manager().set_remote(None)
+    shutil.rmtree(tmp_path / "dst")
+    assert fetch_directory(DirectoryPath(tmp_path / "dst"), "dir")
+    assert (tmp_path / "dst" / "sub" / "a.txt").read_text() == "a"
+    assert os.stat(tmp_path / "dst" / "sub" / "a.txt").st_mode & 0o200
+    pandas.testing.assert_frame_equal(fetch_dataframe("frame"), df)
+
+
+def test_read_only_remote(tmp_path, monkeypatch, remote):
+    monkeypatch.setattr(pirlib.cache, "REMOTE_WRITE", "none")
+    _use_local_dir(monkeypatch, tmp_path / "host_a")
+    (tmp_path / "file.bin").write_bytes(b"file")
+    assert cache_file(FilePath(tmp_path / "file.bin"), "file")
+    assert not remote.exists("file/meta.json")
+    _use_local_dir(monkeypatch, tmp_path / "host_b")
+    assert not is_cached("file")
+
+
+def test_open_store(tmp_path):
+    assert isinstance(open_store(str(tmp_path)), FilesystemStore)
+    assert open_store(f"file://{tmp_path}").root == str(tmp_path)
+    assert open_store("http://minio:9000/bucket/").url == "http://minio:9000/bucket"
+    with pytest.raises(ValueError, match="unknown cache store scheme"):
+        open_store("ftp://host/cache")
@@ -0,0 +1,808 @@
+import asyncio
+import collections
+import contextlib
+import errno
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from typing import TypedDict
+
+import pandas
+import pytest
+import pirlib.cache
+import pirlib.task
+from pirlib.backends.inproc import InprocBackend
+from pirlib.cache_store import FilesystemStore
+from pirlib.cache import (
+    CacheLease,
+    MemoCache,
+    cache_directory,
+    cache_dataframe,
+    cache_file,
+    cache_manager,
+    fetch_dataframe,
+    fetch_directory,
+    fetch_file,
+    generate_cache_key,
+    generate_inputs_cache_key,
+    generate_task_cache_key,
+    hash_dataframe,
+    hash_file,
+    hash_index,
+    is_cached,
+    list_entries,
+    materialize_directory,
+    open_directory,
+    prune,
+    verify,
+)
+from pirlib.handlers.v1 import HandlerV1Context, HandlerV1Event
+from pirlib.iotypes import DirectoryPath, FilePath
+from pirlib.pipeline import pipeline
+from pirlib.task import task
+
+_calls = collections.Counter()
+
+
+@task(cache=True)
+def count_files(inp: DirectoryPath) -> DirectoryPath:
+    _calls["count_files"] += 1
+    outdir = task.context().output
+    with open(outdir / "count.txt", "w") as f:
+        f.write(str(len(list(inp.iterdir()))))
+    return outdir
+
+
+class Summary(TypedDict):
+    frame: pandas.DataFrame
+    report: FilePath
+
+
+@task(cache=True)
+def summarize(inp: FilePath) -> Summary:
+    _calls["summarize"] += 1
+    report = task.context().output["report"]
+    report.write_bytes(inp.read_bytes()[::-1])
+    frame = pandas.DataFrame({"size": [inp.stat().st_size]}, index=["a"])
+    return {"frame": frame, "report": report}
+
+
+@pipeline
+def count_pipeline(inp: DirectoryPath) -> DirectoryPath:
+    return count_files(inp)
+
+
+@pipeline
+def count_twice_pipeline(inp: DirectoryPath) -> DirectoryPath:
+    return count_files.instance("second")(count_files(inp))
+
+
+@pipeline
+def summary_pipeline(inp: FilePath) -> Summary:
+    return summarize(inp)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(pirlib.cache, "CACHE_DIR", str(tmp_path / "cache"))
+    return tmp_path / "cache"
+
+
+def _count(inp):
+    outputs = InprocBackend().execute(
+        count_pipeline.package(), "count_pipeline", inputs={"inp": DirectoryPath(inp)}
+    )
+    return (outputs["return"] / "count.txt").read_text()
+
+
+def test_cache_keyed_on_input_contents(cache_dir, tmp_path):
+    _calls.clear()
+    inp = tmp_path / "inp"
+    inp.mkdir()
+    (inp / "a.txt").write_text("a")
+    assert _count(inp) == "1"
+    assert _count(inp) == "1"
+    assert _calls["count_files"] == 1
+    (inp / "a.txt").write_text("b")
+    assert _count(inp) == "1"
+    assert _calls["count_files"] == 2
+    (inp / "b.txt").write_text("b")
+    assert _count(inp) == "2"
+    assert _calls["count_files"] == 3
+
+
+@pytest.mark.parametrize("arrow", [True, False])
+def test_cache_file_and_dataframe_outputs(cache_dir, tmp_path, monkeypatch, arrow):
+    if arrow:
+        pytest.importorskip("pyarrow")
+    else:
+        monkeypatch.setattr(pirlib.cache, "pyarrow", None)
+    _calls.clear()
+    inp = tmp_path / "inp.bin"
+    inp.write_bytes(b"\x00\x01\x02")
+    for _ in range(2):
+        outputs = InprocBackend().execute(
+            summary_pipeline.package(), "summary_pipeline", inputs={"inp": FilePath(inp)}
+        )
+        assert outputs["return.report"].read_bytes() == b"\x02\x01\x00"
+        expected = pandas.DataFrame({"size": [3]}, index=["a"])
+        pandas.testing.assert_frame_equal(outputs["return.frame"], expected)
+    assert _calls["summarize"] == 1
+    suffix = "arrow" if arrow else "pickle"
+    assert len(list(cache_dir.glob(f"FRAME_*.{suffix}"))) == 1
+    assert len(list(cache_dir.glob("BLOB_*"))) == 1
+
+
+def test_dataframe_unsupported_by_arrow(cache_dir):
+    df = pandas.DataFrame({"a": [1, "x"]})
+    assert cache_dataframe(df, "key")
+    assert len(list(cache_dir.glob("FRAME_*.pickle"))) == 1
+    pandas.testing.assert_frame_equal(fetch_dataframe("key"), df)
+
+
+@task(cache=True)
+def unstorable(inp: DirectoryPath) -> DirectoryPath:
+    _calls["unstorable"] += 1
+    return count_files.func(inp)
+
+
+@pipeline
+def unstorable_pipeline(inp: DirectoryPath) -> DirectoryPath:
+    return unstorable(inp)
+
+
+def test_failed_store_skipped(cache_dir, tmp_path, monkeypatch):
+    def fail(dir_path, cache_key):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setitem(pirlib.task._CACHE_FUNCTIONS, "DIRECTORY", fail)
+    _calls.clear()
+    inp = _make_dir(tmp_path / "inp", 10)
+    for _ in range(2):
+        with pytest.warns(UserWarning, match="failed to cache output 'return'"):
+            outputs = InprocBackend().execute(
+                unstorable_pipeline.package(),
+                "unstorable_pipeline",
+                inputs={"inp": DirectoryPath(inp)},
+            )
+        assert (outputs["return"] / "count.txt").read_text() == "1"
+    assert _calls["unstorable"] == 2
+
+
+def test_file_blobs_are_shared(cache_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(pirlib.cache, "MAX_BYTES", 25)
+    path = tmp_path / "data"
+    path.write_bytes(b"x" * 10)
+    assert cache_file(FilePath(path), "a")
+    assert cache_file(FilePath(path), "b")
+    (blob,) = cache_dir.glob("BLOB_*")
+    assert cache_directory(_make_dir(tmp_path / "c", 10), "c")
+    assert not is_cached("a") and blob.exists()
+    assert fetch_file(FilePath(tmp_path / "out"), "b")
+    assert (tmp_path / "out").read_bytes() == b"x" * 10
+    assert not fetch_directory(DirectoryPath(tmp_path / "out_dir"), "b")
+
+
+def test_cache_key_depends_on_config_and_code():
+    df = pandas.DataFrame({"a": [1, 2], "b": ["x", "y"]})
+    key = generate_task_cache_key({"df": df}, {"lr": 0.1}, "code")
+    assert generate_task_cache_key({"df": df.copy()}, {"lr": 0.1}, "code") == key
+    assert generate_task_cache_key({"df": df}, {"lr": 0.2}, "code") != key
+    assert generate_task_cache_key({"df": df}, {"lr": 0.1}, "other code") != key
+
+
+def test_cache_key_from_task_digest(cache_dir, tmp_path, monkeypatch):
+    inp = _make_dir(tmp_path / "inp", 10)
+    _count(inp)
+    # Backends can compute the cache key of a node without importing its task.
+    node = count_pipeline.package().graphs[0].nodes[0]
+    cache_key = generate_inputs_cache_key({"inp": inp}, count_files.cache_digest(node.config))
+    assert is_cached(cache_key)
+    # A cache key passed to the task by the backend is used without hashing the inputs.
+    monkeypatch.setattr(pirlib.cache, "hash_value", None)
+    out = tmp_path / "out"
+    out.mkdir()
+    event = HandlerV1Event({"inp": inp}, {"return": DirectoryPath(out)})
+    count_files.run_handler(event, HandlerV1Context(node, cache_key=cache_key))
+    assert (out / "count.txt").read_text() == "1"
+
+
+def test_hash_dataframe():
+    df = pandas.DataFrame({"a": [1, 2], "b": ["x", "y"]})
+    assert hash_dataframe(df) == hash_dataframe(df.copy())
+    assert hash_dataframe(df) != hash_dataframe(df.astype({"a": "float64"}))
+    assert hash_dataframe(df) != hash_dataframe(df.iloc[::-1])
+
+
+@pytest.mark.parametrize("strategy", ["copy", "hardlink", "reflink", "symlink"])
+def test_materialize_strategies(cache_dir, tmp_path, strategy):
+    src = tmp_path / "src"
+    (src / "sub").mkdir(parents=True)
+    (src / "sub" / "a.txt").write_text("a")
+    dst = tmp_path / "dst"
+    dst.mkdir()
+    (dst / "b.txt").write_text("b")
+    assert cache_directory(DirectoryPath(src), "key", strategy=strategy)
+    shutil.rmtree(src)
+    assert fetch_directory(DirectoryPath(dst), "key", strategy=strategy)
+    assert (dst / "sub" / "a.txt").read_text() == "a"
+    assert (dst / "b.txt").read_text() == "b"
+    assert (dst / "sub" / "a.txt").is_symlink() == (strategy == "symlink")
+    # Fetching again replaces the existing files instead of writing through them.
+    assert fetch_directory(DirectoryPath(dst), "key", strategy="copy")
+    assert (dst / "sub" / "a.txt").read_text() == "a"
+
+
+def test_unknown_materialize_strategy(tmp_path):
+    with pytest.raises(ValueError, match="unknown cache materialization strategy"):
+        materialize_directory(DirectoryPath(tmp_path), DirectoryPath(tmp_path / "dst"), "move")
+
+
+def test_hardlink_falls_back_to_copy(tmp_path, monkeypatch):
+    def cross_device_link(src, dst):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "a.txt").write_text("a")
+    monkeypatch.setattr(os, "link", cross_device_link)
+    materialize_directory(tmp_path / "src", tmp_path / "dst", "hardlink")
+    assert (tmp_path / "dst" / "a.txt").read_text() == "a"
+
+
+def _make_dir(path, size):
+    path.mkdir()
+    (path / "data").write_bytes(b"x" * size)
+    return DirectoryPath(path)
+
+
+def test_lru_eviction(cache_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(pirlib.cache, "MAX_BYTES", 25)
+    assert cache_directory(_make_dir(tmp_path / "a", 10), "a")
+    assert cache_directory(_make_dir(tmp_path / "b", 10), "b")
+    assert fetch_directory(DirectoryPath(tmp_path / "out"), "a")
+    assert cache_directory(_make_dir(tmp_path / "c", 10), "c")
+    assert [is_cached(key) for key in "abc"] == [True, False, True]
+    assert not (cache_dir / "DIR_b").exists()
+    assert pirlib.cache.directory_size(cache_dir / "DIR_a") == 10
+
+
+def test_eviction_uses_lru_index(cache_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(pirlib.cache, "MAX_BYTES", 25)
+    (tmp_path / "f.txt").write_text("f" * 10)
+    assert cache_file(FilePath(tmp_path / "f.txt"), "f")
+    assert cache_file(FilePath(tmp_path / "f.txt"), "g")
+
+    # Once the index is built, evictions don't scan every entry.
+    def scan(self):
+        raise AssertionError("scanned the cache entries")
+
+    monkeypatch.setattr(pirlib.cache.Cache, "__iter__", scan)
+    assert cache_directory(_make_dir(tmp_path / "a", 10), "a")
+    # The blob is only removed along with the last key sharing it.
+    assert not is_cached("f") and is_cached("g") and is_cached("a")
+    assert len(list(cache_dir.glob("BLOB_*"))) == 1
+    assert cache_directory(_make_dir(tmp_path / "b", 10), "b")
+    assert not is_cached("g") and not list(cache_dir.glob("BLOB_*"))
+    assert not list(cache_dir.glob("DEAD_*"))
+
+
+def test_fetch_evicted_directory(cache_dir, tmp_path, monkeypatch):
+    materialize = pirlib.cache.materialize_directory
+
+    def evicted_after(src_dir, dst_dir, strategy):
+        materialize(src_dir, dst_dir, strategy)
+        os.rename(src_dir, cache_dir / "DEAD_after")
+
+    def evicted_before(src_dir, dst_dir, strategy):
+        shutil.rmtree(src_dir)
+        materialize(src_dir, dst_dir, strategy)
+
+    funcs = (evicted_after, evicted_before)
+    for func in funcs:
+        assert cache_directory(_make_dir(tmp_path / func.__name__, 10), func.__name__)
+    for func in funcs:
+        monkeypatch.setattr(pirlib.cache, "materialize_directory", func)
+        # A source which vanishes while it is fetched is a miss.
+        assert not fetch_directory(DirectoryPath(tmp_path / "out"), func.__name__)
+
+
+def test_entry_larger_than_cache(cache_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(pirlib.cache, "MAX_BYTES", 25)
+    assert cache_directory(_make_dir(tmp_path / "a", 10), "a")
+    assert not cache_directory(_make_dir(tmp_path / "b", 30), "b")
+    assert is_cached("a") and not is_cached("b")
+    assert not (cache_dir / "DIR_b").exists()
+
+
+def test_lease_single_flight(cache_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(pirlib.cache, "_LEASE_POLL_INTERVAL", 0.01)
+    src = _make_dir(tmp_path / "src", 10)
+    computed = []
+
+    def fill(idx):
+        with CacheLease("key"):
+            if not fetch_directory(DirectoryPath(tmp_path / f"out{idx}"), "key"):
+                computed.append(idx)
+                time.sleep(0.1)
+                cache_directory(src, "key")
+
+    threads = [threading.Thread(target=fill, args=(idx,)) for idx in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(computed) == 1
+    assert sorted(os.listdir(cache_dir / "DIR_key")) == ["data"]
+    assert not any(name.startswith(("TMP_", "LOCK_")) for name in os.listdir(cache_dir))
+
+
+def test_stale_lease_is_broken(cache_dir, monkeypatch):
+    monkeypatch.setattr(pirlib.cache, "LEASE_TIMEOUT", 60)
+    cache_dir.mkdir()
+    (cache_dir / "LOCK_key").touch()
+    lease = CacheLease("key")
+    assert not lease.try_acquire()
+    os.utime(cache_dir / "LOCK_key", (time.time() - 120, time.time() - 120))
+    assert lease.try_acquire()
+    lease.release()
+    assert not (cache_dir / "LOCK_key").exists()
+
+
+def test_broken_lease_is_not_released(cache_dir, monkeypatch):
+    monkeypatch.setattr(pirlib.cache, "LEASE_TIMEOUT", 60)
+    first, second = CacheLease("key"), CacheLease("key")
+    assert first.try_acquire()
+    os.utime(cache_dir / "LOCK_key", (time.time() - 120, time.time() - 120))
+    assert second.try_acquire()
+    token = (cache_dir / "LOCK_key").read_text()
+    # The holder of the broken lease leaves the new holder's lock file alone.
+    first.release()
+    assert (cache_dir / "LOCK_key").read_text() == token
+    second.release()
+    assert not (cache_dir / "LOCK_key").exists()
+
+
+def test_stale_lease_is_broken_once(cache_dir, monkeypatch):
+    monkeypatch.setattr(pirlib.cache, "LEASE_TIMEOUT", 60)
+    cache_dir.mkdir()
+    lock = cache_dir / "LOCK_key"
+    lock.write_text("dead")
+    os.utime(lock, (time.time() - 120, time.time() - 120))
+    rename = os.rename
+
+    def racing_rename(src, dst):
+        # Another waiter breaks the stale lock and takes the lease first.
+        os.remove(lock)
+        lock.write_text("fresh")
+        rename(src, dst)
+
+    monkeypatch.setattr(os, "rename", racing_rename)
+    assert not CacheLease("key").try_acquire()
+    assert lock.read_text() == "fresh"
+    assert os.listdir(cache_dir) == ["LOCK_key"]
+
+
+def test_publish_replaces_orphaned_directory(cache_dir, tmp_path):
+    (cache_dir / "DIR_key").mkdir(parents=True)
+    (cache_dir / "DIR_key" / "partial").touch()
+    assert cache_directory(_make_dir(tmp_path / "src", 10), "key")
+    assert sorted(os.listdir(cache_dir / "DIR_key")) == ["data"]
+
+
+def test_generate_cache_key_binary_and_directory(cache_dir, tmp_path):
+    key_file = tmp_path / "key.bin"
+    key_file.write_bytes(bytes(range(256)))
+    key = generate_cache_key(FilePath(key_file))
+    assert generate_cache_key(FilePath(key_file)) == key
+    key_file.write_bytes(bytes(range(255)))
+    assert generate_cache_key(FilePath(key_file)) != key
+
+    key_dir = tmp_path / "key_dir"
+    (key_dir / "sub").mkdir(parents=True)
+    (key_dir / "sub" / "a").write_bytes(b"a")
+    key = generate_cache_key(DirectoryPath(key_dir))
+    (key_dir / "sub" / "a").rename(key_dir / "a")
+    assert generate_cache_key(DirectoryPath(key_dir)) != key
+
+
+def test_hash_index_skips_unchanged_files(cache_dir, tmp_path, monkeypatch):
+    hashed = []
+    hash_contents = pirlib.cache._hash_contents
+    monkeypatch.setattr(pirlib.cache, "_INDEX_MIN_SIZE", 0)
+    monkeypatch.setattr(
+        pirlib.cache, "_hash_contents", lambda path: hashed.append(path) or hash_contents(path)
+    )
+    path = tmp_path / "data"
+    path.write_bytes(b"x" * 100)
+    os.utime(path, (time.time() - 60, time.time() - 60))
+    digest = hash_file(FilePath(path))
+    with hash_index() as index:
+        assert hash_file(FilePath(path), index=index) == digest
+        assert hash_file(FilePath(path), index=index) == digest
+    assert len(hashed) == 2
+    path.write_bytes(b"y" * 100)
+    os.utime(path, (time.time() - 30, time.time() - 30))
+    with hash_index() as index:
+        assert hash_file(FilePath(path), index=index) != digest
+    assert len(hashed) == 3
+
+
+def test_cache_manager_batched_lookups(cache_dir, tmp_path):
+    assert cache_directory(_make_dir(tmp_path / "a", 10), "a")
+    manager = cache_manager()
+    assert manager.cache() is manager.cache()
+    assert manager.contains_many(["a", "b"]) == {"a": True, "b": False}
+    entries = manager.get_many(["a", "b"])
+    assert list(entries) == ["a"]
+    assert entries["a"]["size"] == 10
+
+
+def _child_is_cached(queue):
+    queue.put(is_cached("a"))
+
+
+def test_cache_manager_after_fork(cache_dir, tmp_path):
+    assert cache_directory(_make_dir(tmp_path / "a", 10), "a")
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_child_is_cached, args=(queue,))
+    process.start()
+    assert queue.get(timeout=10)
+    process.join()
+    assert is_cached("a")
+
+
+@pytest.mark.parametrize("pack", ["tar", "tar.zst"])
+def test_packed_directory(cache_dir, tmp_path, pack):
+    if pack == "tar.zst":
+        pytest.importorskip("zstandard")
+    src = tmp_path / "src"
+    (src / "sub" / "empty").mkdir(parents=True)
+    for idx in range(20):
+        (src / "sub" / f"part-{idx}").write_bytes(bytes([idx]) * (idx * 100))
+    os.link(src / "sub" / "part-3", src / "linked")
+    assert cache_directory(DirectoryPath(src), "key", pack=pack)
+    assert sorted(os.listdir(cache_dir / "DIR_key")) == ["index.json", f"pack.{pack}"]
+
+    view = open_directory("key")
+    assert view.names() == ["linked"] + [f"sub/part-{idx}" for idx in sorted(range(20), key=str)]
+    with view.open("sub/part-7") as f:
+        assert f.read() == bytes([7]) * 700
+    with view.open("linked") as f:
+        assert f.read() == bytes([3]) * 300
+
+    dst = tmp_path / "dst"
+    dst.mkdir()
+    (dst / "linked").write_bytes(b"stale")
+    assert fetch_directory(DirectoryPath(dst), "key")
+    assert (dst / "sub" / "empty").is_dir()
+    assert (dst / "linked").read_bytes() == bytes([3]) * 300
+    for idx in range(20):
+        assert (dst / "sub" / f"part-{idx}").read_bytes() == bytes([idx]) * (idx * 100)
+
+
+def test_unpacked_directory_has_no_view(cache_dir, tmp_path):
+    assert cache_directory(_make_dir(tmp_path / "src", 10), "key", pack="none")
+    assert open_directory("key") is None
+    with pytest.raises(ValueError, match="unknown cache pack format"):
+        cache_directory(_make_dir(tmp_path / "other", 10), "other", pack="zip")
+    assert not is_cached("other")
+
+
+@task(cache=True)
+async def count_files_async(inp: DirectoryPath) -> DirectoryPath:
+    return count_files.func(inp)
+
+
+@pipeline
+def count_async_pipeline(inp: DirectoryPath) -> DirectoryPath:
+    return count_files_async(inp)
+
+
+def test_async_cache_io_off_event_loop(cache_dir, tmp_path, monkeypatch):
+    called, on_loop = set(), set()
+
+    def record(name, func):
+        def wrapper(*args, **kwargs):
+            called.add(name)
+            with contextlib.suppress(RuntimeError):
+                asyncio.get_running_loop()
+                on_loop.add(name)
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    monkeypatch.setattr(
+        pirlib.task,
+        "generate_inputs_cache_key",
+        record("key", pirlib.task.generate_inputs_cache_key),
+    )
+    monkeypatch.setitem(pirlib.task._CACHE_FUNCTIONS, "DIRECTORY", record("store", cache_directory))
+    monkeypatch.setattr(pirlib.task, "record_lookup", record("lookup", pirlib.task.record_lookup))
+    monkeypatch.setattr(CacheLease, "try_acquire", record("acquire", CacheLease.try_acquire))
+    monkeypatch.setattr(CacheLease, "release", record("release", CacheLease.release))
+    inp = _make_dir(tmp_path / "inp", 10)
+    for _ in range(2):
+        outputs = InprocBackend().execute(
+            count_async_pipeline.package(),
+            "count_async_pipeline",
+            inputs={"inp": DirectoryPath(inp)},
+        )
+        assert (outputs["return"] / "count.txt").read_text() == "1"
+    assert len(list(cache_dir.glob("DIR_*"))) == 1
+    assert called == {"key", "store", "lookup", "acquire", "release"}
+    assert not on_loop
+
+
+_events = []
+
+
+@task
+def read_count(inp: DirectoryPath) -> FilePath:
+    _events.append("read_count")
+    out = task.context().output
+    out.write_text((inp / "count.txt").read_text())
+    return out
+
+
+@pipeline
+def read_count_pipeline(inp: DirectoryPath) -> FilePath:
+    return read_count(count_files(inp))
+
+
+def test_write_behind(cache_dir, tmp_path, monkeypatch):
+    def slow_cache_directory(dir_path, cache_key, **kwargs):
+        time.sleep(0.2)
+        _events.append("cached")
+        return cache_directory(dir_path, cache_key, **kwargs)
+
+    monkeypatch.setattr(pirlib.cache, "WRITE_BEHIND", True)
+    monkeypatch.setitem(pirlib.task._CACHE_FUNCTIONS, "DIRECTORY", slow_cache_directory)
+    _calls.clear()
+    _events.clear()
+    inp = tmp_path / "inp"
+    inp.mkdir()
+    (inp / "a.txt").write_text("a")
+    outputs = InprocBackend().execute(
+        read_count_pipeline.package(), "read_count_pipeline", inputs={"inp": DirectoryPath(inp)}
+    )
+    # The downstream task ran before the output was cached.
+    assert _events == ["read_count", "cached"]
+    assert outputs["return"].read_text() == "1"
+    assert len(list(cache_dir.glob("DIR_*"))) == 1
+    assert not any(name.startswith(("TMP_", "LOCK_")) for name in os.listdir(cache_dir))
+
+
+@task(cache=True)
+def make_frame(inp: FilePath) -> pandas.DataFrame:
+    return pandas.DataFrame({"size": [inp.stat().st_size]})
+
+
+@task
+def mutate_frame(df: pandas.DataFrame) -> pandas.DataFrame:
+    df["size"] = -1
+    return df
+
+
+@pipeline
+def mutate_frame_pipeline(inp: FilePath) -> pandas.DataFrame:
+    return mutate_frame(make_frame(inp))
+
+
+def test_write_behind_snapshots_dataframes(cache_dir, tmp_path, monkeypatch):
+    def slow_is_cached(cache_key):
+        # Give the downstream node time to run before the frame is serialized.
+        time.sleep(0.2)
+        return is_cached(cache_key)
+
+    monkeypatch.setattr(pirlib.cache, "WRITE_BEHIND", True)
+    monkeypatch.setattr(pirlib.cache, "is_cached", slow_is_cached)
+    inp = tmp_path / "inp.txt"
+    inp.write_text("abc")
+    outputs = InprocBackend().execute(
+        mutate_frame_pipeline.package(), "mutate_frame_pipeline", inputs={"inp": FilePath(inp)}
+    )
+    assert outputs["return"]["size"].tolist() == [-1]
+    # The frame was cached as it was returned, before the downstream node modified it.
+    (key,) = list_entries()
+    assert pirlib.cache.fetch_dataframe(key)["size"].tolist() == [3]
+
+
+@task
+def overwrite_count(inp: DirectoryPath) -> DirectoryPath:
+    (inp / "count.txt").unlink()
+    (inp / "count.txt").write_text("-1")
+    return inp
+
+
+@pipeline
+def overwrite_count_pipeline(inp: DirectoryPath) -> DirectoryPath:
+    return overwrite_count(count_files(inp))
+
+
+@pytest.mark.parametrize("strategy", ["copy", "hardlink"])
+def test_write_behind_stages_paths(cache_dir, tmp_path, monkeypatch, strategy):
+    def slow_cache_directory(dir_path, cache_key, **kwargs):
+        # Give the downstream node time to run before the directory is cached.
+        time.sleep(0.2)
+        return cache_directory(dir_path, cache_key, **kwargs)
+
+    monkeypatch.setattr(pirlib.cache, "WRITE_BEHIND", True)
+    monkeypatch.setattr(pirlib.cache, "MATERIALIZE", strategy)
+    monkeypatch.setitem(pirlib.task._CACHE_FUNCTIONS, "DIRECTORY", slow_cache_directory)
+    inp = _make_dir(tmp_path / "inp", 10)
+    outputs = InprocBackend().execute(
+        overwrite_count_pipeline.package(),
+        "overwrite_count_pipeline",
+        inputs={"inp": DirectoryPath(inp)},
+    )
+    assert (outputs["return"] / "count.txt").read_text() == "-1"
+    # The directory was cached as it was returned, before the downstream node replaced
+    # its file.
+    (key,) = list_entries()
+    assert fetch_directory(DirectoryPath(tmp_path / "out"), key)
+    assert (tmp_path / "out" / "count.txt").read_text() == "1"
+    assert not any(name.startswith("TMP_") for name in os.listdir(cache_dir))
+
+
+_EXIT_SCRIPT = """
+import sys, time
+import pirlib.task
+from pirlib.cache import cache_directory
+from pirlib.cache_test import count_files, count_pipeline
+from pirlib.handlers.v1 import HandlerV1Context, HandlerV1Event
+from pirlib.iotypes import DirectoryPath
+
+def slow_cache_directory(dir_path, cache_key, **kwargs):
+    time.sleep(0.5)
+    return cache_directory(dir_path, cache_key, **kwargs)
+
+pirlib.task._CACHE_FUNCTIONS["DIRECTORY"] = slow_cache_directory
+node = count_pipeline.package().graphs[0].nodes[0]
+inputs = {"inp": DirectoryPath(sys.argv[1])}
+event = HandlerV1Event(inputs, {"return": DirectoryPath(sys.argv[2])})
+count_files.run_handler(event, HandlerV1Context(node))
+"""
+
+
+def test_write_behind_flushed_at_exit(cache_dir, tmp_path):
+    # Run a cached task the way the nodes of the Argo and docker backends do, in a
+    # process which exits right after the task returns.
+    inp = _make_dir(tmp_path / "inp", 10)
+    (tmp_path / "out").mkdir()
+    env = dict(
+        os.environ,
+        PIRLIB_CACHE_DIR=str(cache_dir),
+        PIRLIB_CACHE_WRITE_BEHIND="1",
+        PYTHONPATH=os.path.dirname(os.path.dirname(pirlib.cache.__file__)),
+    )
+    args = [sys.executable, "-c", _EXIT_SCRIPT, str(inp), str(tmp_path / "out")]
+    subprocess.run(args, env=env, check=True, capture_output=True)
+    assert len(list(cache_dir.glob("DIR_*"))) == 1
+    assert not any(name.startswith(("TMP_", "LOCK_")) for name in os.listdir(cache_dir))
+
+
+def test_fetch_cached(cache_dir, tmp_path):
+    inp = tmp_path / "inp"
+    inp.mkdir()
+    (inp / "a.txt").write_text("a")
+    node = count_pipeline.package().graphs[0].nodes[0]
+
+    def fetch():
+        out = tmp_path / "out"
+        shutil.rmtree(out, ignore_errors=True)
+        out.mkdir()
+        event = HandlerV1Event({"inp": DirectoryPath(inp)}, {"return": DirectoryPath(out)})
+        return count_files.fetch_cached(event, HandlerV1Context(node)), event
+
+    assert fetch()[0] is False
+    _count(inp)
+    hit, event = fetch()
+    assert hit
+    assert (event.outputs["return"] / "count.txt").read_text() == "1"
+
+
+def test_stats_and_ls(cache_dir, tmp_path):
+    inp = tmp_path / "inp"
+    inp.mkdir()
+    _count(inp)
+    _count(inp)
+    stats = pirlib.cache.cache_stats()
+    assert stats == {"entries": 1, "bytes": 1, "hits": 1, "misses": 1}
+    ((key, entry),) = list_entries().items()
+    assert entry["kind"] == "directory" and entry["size"] == 1
+
+
+def test_prune(cache_dir, tmp_path, monkeypatch):
+    for key in "abc":
+        assert cache_directory(_make_dir(tmp_path / key, 10), key)
+    entries = list_entries()
+    now = entries["c"]["last_access"]
+    assert fetch_directory(DirectoryPath(tmp_path / "out"), "a")
+    assert prune(max_bytes=20) == ["b"]
+    assert not (cache_dir / "DIR_b").exists()
+    monkeypatch.setattr(time, "time", lambda: now + 100)
+    assert prune(max_age=50) == ["c", "a"]
+    assert not list_entries()
+
+
+def test_symlinked_outputs_outlive_entries(cache_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(pirlib.cache, "MATERIALIZE", "symlink")
+    inp = _make_dir(tmp_path / "inp", 10)
+    _count(inp)
+    outputs = InprocBackend().execute(
+        count_pipeline.package(), "count_pipeline", inputs={"inp": DirectoryPath(inp)}
+    )
+    # The published output was fetched as a symlink, and is resolved into a copy.
+    assert not (outputs["return"] / "count.txt").is_symlink()
+    prune(max_bytes=0)
+    assert not list_entries()
+    assert (outputs["return"] / "count.txt").read_text() == "1"
+
+
+def test_cached_files_are_read_only(cache_dir, tmp_path):
+    src = _make_dir(tmp_path / "src", 10)
+    assert cache_directory(src, "key", strategy="hardlink")
+    # Hardlinked outputs share the read-only mode of the cached files.
+    assert not os.stat(src / "data").st_mode & 0o222
+    assert fetch_directory(DirectoryPath(tmp_path / "copy"), "key", strategy="copy")
+    assert os.stat(tmp_path / "copy" / "data").st_mode & 0o200
+
+
+def test_verify(cache_dir, tmp_path):
+    assert cache_directory(_make_dir(tmp_path / "a", 10), "a")
+    assert cache_directory(_make_dir(tmp_path / "b", 10), "b")
+    (tmp_path / "f.txt").write_text("f")
+    assert cache_file(FilePath(tmp_path / "f.txt"), "f")
+    # Digests are recorded when the entries are cached.
+    assert list_entries()["a"]["digest"] == pirlib.cache.hash_directory(cache_dir / "DIR_a")
+    assert verify() == {"a": True, "b": True, "f": True}
+    (cache_dir / "DIR_b" / "data").chmod(0o644)
+    (cache_dir / "DIR_b" / "data").write_bytes(b"y" * 10)
+    assert verify(delete=True) == {"a": True, "b": False, "f": True}
+    assert not is_cached("b") and not (cache_dir / "DIR_b").exists()
+    # Entries cached without a digest can't be checked.
+    cache_ref = cache_manager().cache()
+    entry = cache_ref.get("a")
+    del entry["digest"]
+    cache_ref.set("a", entry)
+    assert verify() == {"a": None, "f": True}
+    assert "digest" not in list_entries()["a"]
+
+
+def test_warm(cache_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_manager(), "_remote", FilesystemStore(str(tmp_path / "remote")))
+    inp = tmp_path / "inp"
+    inp.mkdir()
+    (inp / "a.txt").write_text("a")
+    package = count_twice_pipeline.package()
+    backend = InprocBackend()
+    inputs = {"inp": DirectoryPath(inp)}
+    # Nodes downstream of a miss can't be looked up.
+    assert backend.warm(package, "count_twice_pipeline", inputs=inputs) == {"count_files": False}
+    backend.execute(package, "count_twice_pipeline", inputs=inputs)
+    monkeypatch.setattr(pirlib.cache, "CACHE_DIR", str(tmp_path / "cold"))
+    assert not list_entries()
+    found = backend.warm(package, "count_twice_pipeline", inputs=inputs)
+    assert found == {"count_files": True, "second": True}
+    assert len(list_entries()) == 2
+
+
+def test_memo_cache_eviction():
+    memo = MemoCache(max_entries=2, max_bytes=1000)
+    memo.put("a", b"a" * 100)
+    memo.put("b", b"b" * 100)
+    assert memo.get("a") is not None
+    memo.put("c", b"c" * 100)
+    assert memo.get("b") is None
+    memo.put("d", b"d" * 2000)
+    assert memo.get("d") is None
+    memo.put("e", b"e" * 900)
+    assert memo.get("a") is None and memo.get("e") is not None
+    assert memo.stats()["entries"] == 1
+    with pytest.raises(ValueError):
+        MemoCache(max_entries=0)
@@ -0,0 +1,130 @@
+import argparse
+import datetime
+import pathlib
+import re
+
+import pirlib.cache
+from pirlib.backends.inproc import InprocBackend
+from pirlib.iotypes.iospec import IOSpec
+from pirlib.pir_format import load_package
+
+_SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+_AGE_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def config_cache_parser(parser: argparse.ArgumentParser) -> None:
+    subparsers = parser.add_subparsers()
+
+    stats = subparsers.add_parser("stats", help="summarize the local cache directory")
+    stats.set_defaults(parser=stats, handler=_stats_handler)
+
+    ls = subparsers.add_parser("ls", help="list cache entries, most recently used first")
+    ls.set_defaults(parser=ls, handler=_ls_handler)
+
+    prune = subparsers.add_parser("prune", help="remove least recently used cache entries")
+    prune.add_argument(
+        "--max-age",
+        type=_age,
+        help="remove entries not accessed for this long (e.g. 3600, 12h, 7d)",
+    )
+    prune.add_argument(
+        "--max-bytes",
+        type=_size,
+        help="remove entries until the rest fit in this size (e.g. 500G)",
+    )
+    prune.set_defaults(parser=prune, handler=_prune_handler)
+
+    verify = subparsers.add_parser(
+        "verify", help="check entries against the digests recorded when they were cached"
+    )
+    verify.add_argument("--delete", action="store_true", help="remove corrupt entries")
+    verify.set_defaults(parser=verify, handler=_verify_handler)
+
+    warm = subparsers.add_parser(
+        "warm", help="prefetch the cached outputs of a graph into the local cache"
+    )
+    warm.add_argument("package", type=pathlib.Path)
+    warm.add_argument("graph", type=str)
+    warm.add_argument("-i", "--input", action="append", type=IOSpec)
+    warm.add_argument(
+        "--only-output",
+        action="append",
+        metavar="OUTPUT",
+        help="only warm up the nodes needed to compute this graph output (repeatable)",
+    )
+    warm.set_defaults(parser=warm, handler=_warm_handler)
+
+    parser.set_defaults(parser=parser, handler=lambda parser, args: parser.print_help())
+
+
+def _size(arg: str) -> int:
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?", arg.strip(), re.IGNORECASE)
+    if match is None:
+        raise argparse.ArgumentTypeError(f"malformatted size '{arg}'")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def _age(arg: str) -> float:
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([smhdw]?)", arg.strip())
+    if match is None:
+        raise argparse.ArgumentTypeError(f"malformatted age '{arg}'")
+    return float(match.group(1)) * _AGE_UNITS[match.group(2)]
+
+
+def _format_size(size: int) -> str:
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def _stats_handler(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    stats = pirlib.cache.cache_stats()
+    lookups = stats["hits"] + stats["misses"]
+    print(f"directory: {pirlib.cache.CACHE_DIR}")
+    print(f"entries:   {stats['entries']}")
+    print(f"size:      {_format_size(stats['bytes'])}")
+    print(f"hits:      {stats['hits']}")
+    print(f"misses:    {stats['misses']}")
+    if lookups:
+        print(f"hit rate:  {stats['hits'] / lookups:.1%}")
+
+
+def _ls_handler(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    entries = pirlib.cache.list_entries()
+    for key, entry in sorted(entries.items(), key=lambda item: -item[1]["last_access"]):
+        last_access = datetime.datetime.fromtimestamp(entry["last_access"])
+        print(
+            f"{key}  {entry['kind']:<9}  {_format_size(entry['size']):>10}  "
+            f"{last_access.isoformat(sep=' ', timespec='seconds')}"
+        )
+
+
+def _prune_handler(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    if args.max_age is None and args.max_bytes is None:
+        parser.error("at least one of --max-age and --max-bytes is required")
+    removed = pirlib.cache.prune(max_age=args.max_age, max_bytes=args.max_bytes)
+    print(f"removed {len(removed)} entries")
+
+
+def _verify_handler(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    results = pirlib.cache.verify(delete=args.delete)
+    corrupt = sorted(key for key, ok in results.items() if ok is False)
+    unknown = sum(ok is None for ok in results.values())
+    for key in corrupt:
+        print(f"{'removed' if args.delete else 'corrupt'}: {key}")
+    print(f"verified {len(results) - unknown} entries, {len(corrupt)} corrupt")
+    if unknown:
+        print(f"skipped {unknown} entries cached without a digest")
+    if corrupt and not args.delete:
+        parser.exit(1)
+
+
+def _warm_handler(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    with open(args.package, "rb") as f:
+        package = load_package(f, graph_id=args.graph)
+    found = InprocBackend().warm(package, args.graph, args=args)
+    for node_id, hit in found.items():
+        print(f"{'hit' if hit else 'miss'}: {node_id}")
+    print(f"fetched {sum(found.values())} of {len(found)} nodes looked up")
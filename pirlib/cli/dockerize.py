@@ -1,6 +1,5 @@
 import argparse
 import base64
-import dataclasses
 import logging
 import os
 import pathlib
@@ -10,6 +9,8 @@ import uuid
 
 import yaml
 
+from pirlib.pir_format import FORMATS, dump_package
+
 from .utils import package_pipelines, pipeline_def
 
 
@@ -42,6 +43,12 @@ def config_dockerize_parser(parser: argparse.ArgumentParser) -> None:
         help="path to output file (or - for stdout)",
     )
     parser.add_argument("--flatten", action="store_true", help="flatten pipeline(s)")
+    parser.add_argument(
+        "--format",
+        choices=FORMATS,
+        default="yaml",
+        help="format of the output file, packages are loaded in either format",
+    )
 
     parser.add_argument("--docker_base_image", help="base docker image to be used.")
 
@@ -100,7 +107,7 @@ def _dockerize_handler(parser: argparse.ArgumentParser, args: argparse.Namespace
             if entrypoint.image is None:
                 entrypoint.image = image
     if args.output is not None:
-        yaml.dump(dataclasses.asdict(package), args.output, sort_keys=False)
+        dump_package(package, args.output, args.format)
 
 
 def _generate_dockerfile(context_path: pathlib.Path, docker_base_image: str) -> str:
@@ -1,10 +1,8 @@
 import argparse
-import dacite
 import importlib
 import pathlib
-import yaml
 
-from pirlib.pir import Package
+from pirlib.pir_format import load_package
 from pirlib.iotypes.iospec import IOSpec
 
 
@@ -14,6 +12,15 @@ def config_execute_parser(parser: argparse.ArgumentParser) -> None:
     parser.add_argument("--target", type=str, required=True)
     parser.add_argument("-i", "--input", action="append", type=IOSpec)
     parser.add_argument("-o", "--output", action="append", type=IOSpec)
+    parser.add_argument(
+        "--only-output",
+        action="append",
+        metavar="OUTPUT",
+        help="only execute the nodes needed to compute this graph output (repeatable)",
+    )
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--run-id", help="journal the run under this id so it can be resumed")
+    group.add_argument("--resume", metavar="RUN_ID", help="resume a failed journaled run")
     parser.set_defaults(parser=parser, handler=_execute_handler)
 
 
@@ -29,7 +36,7 @@ def _execute_handler(parser: argparse.ArgumentParser, args: argparse.Namespace)
         backend_class = getattr(module, backend_name)
     except AttributeError as err:
         raise argparse.ArgumentTypeError(f"{err}")
-    with open(args.package) as f:
-        package = dacite.from_dict(data_class=Package, data=yaml.safe_load(f))
+    with open(args.package, "rb") as f:
+        package = load_package(f, graph_id=args.graph)
     backend = backend_class()
     backend.execute(package, args.graph, args=args)
@@ -1,16 +1,19 @@
 import argparse
-import dacite
 import importlib
 import pathlib
-import yaml
 
-from pirlib.pir import Package
+from pirlib.pir_format import load_package
 
 
 def config_generate_parser(parser: argparse.ArgumentParser) -> None:
     parser.add_argument("package", type=pathlib.Path)
     parser.add_argument("--target", type=str, required=True)
     parser.add_argument("-o", "--output", type=pathlib.Path)
+    parser.add_argument(
+        "--graph",
+        type=str,
+        help="only load this graph and the graphs it references, and generate it",
+    )
     parser.set_defaults(parser=parser, handler=_generate_handler)
 
 
@@ -26,7 +29,7 @@ def _generate_handler(parser: argparse.ArgumentParser, args: argparse.Namespace)
         backend_class = getattr(module, backend_name)
     except AttributeError as err:
         raise argparse.ArgumentTypeError(f"{err}")
-    with open(args.package) as f:
-        package = dacite.from_dict(data_class=Package, data=yaml.safe_load(f))
+    with open(args.package, "rb") as f:
+        package = load_package(f, graph_id=args.graph)
     backend = backend_class()
     backend.generate(package, args=args)
@@ -1,6 +1,7 @@
 import argparse
 import sys
 
+from .cache import config_cache_parser
 from .dockerize import config_dockerize_parser
 from .execute import config_execute_parser
 from .generate import config_generate_parser
@@ -43,6 +44,13 @@ def main():
         )
     )
 
+    config_cache_parser(
+        subparsers.add_parser(
+            "cache",
+            help="inspect and manage the local task cache",
+        )
+    )
+
     args = parser.parse_args()
     try:
         args.handler(args.parser, args)
@@ -1,6 +1,6 @@
 import argparse
-import dataclasses
-import yaml
+
+from pirlib.pir_format import FORMATS, dump_package
 
 from .utils import package_pipelines, pipeline_def
 
@@ -21,10 +21,16 @@ def config_package_parser(parser: argparse.ArgumentParser) -> None:
         help="path to output file (or - for stdout)",
     )
     parser.add_argument("--flatten", action="store_true", help="flatten pipeline(s)")
+    parser.add_argument(
+        "--format",
+        choices=FORMATS,
+        default="yaml",
+        help="format of the output file, packages are loaded in either format",
+    )
     parser.set_defaults(parser=parser, handler=_package_handler)
 
 
 def _package_handler(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
     package = package_pipelines(parser, args.pipeline, args.flatten)
     if args.output is not None:
-        yaml.dump(dataclasses.asdict(package), args.output, sort_keys=False)
+        dump_package(package, args.output, args.format)
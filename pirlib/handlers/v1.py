@@ -1,12 +1,17 @@
+import asyncio
+import functools
 from abc import abstractmethod
 from dataclasses import dataclass
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 from pirlib.pir import Node
 
 
 @dataclass
 class HandlerV1Context(object):
     node: Node
+    # Cache key of the node if the backend computed it already, e.g. while checking
+    # the cache before running the node, so that the inputs aren't hashed again.
+    cache_key: Optional[str] = None
 
 
 @dataclass
@@ -31,3 +36,31 @@ class HandlerV1(object):
         context: HandlerV1Context,
     ) -> None:
         raise NotImplementedError
+
+    def is_async(self) -> bool:
+        """
+        Whether this handler should preferably be awaited through
+        :meth:`run_handler_async` by backends that run an event loop.
+        """
+        return False
+
+    async def run_handler_async(
+        self,
+        event: HandlerV1Event,
+        context: HandlerV1Context,
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, functools.partial(self.run_handler, event, context))
+
+    def fetch_cached(
+        self,
+        event: HandlerV1Event,
+        context: HandlerV1Context,
+    ) -> bool:
+        """
+        Fill in the outputs of the event from the cache without running the handler,
+        if they are all cached. Backends can use this to skip scheduling a node.
+
+        :return: True if the outputs were fetched, False if the handler must be run.
+        """
+        return False
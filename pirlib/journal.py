@@ -0,0 +1,107 @@
+import json
+import os
+from typing import Any, Dict
+
+import pirlib.pir
+from pirlib.iotypes import DirectoryPath, FilePath
+
+
+class RunJournal(object):
+    """
+    Append-only record of the nodes completed by a run, stored as JSON lines in
+    ``<run dir>/journal.jsonl``. Each line records a finished node and where each of
+    its outputs is stored, so that an interrupted run can be resumed by reloading the
+    outputs of completed nodes instead of executing them again. DIRECTORY and FILE
+    outputs are recorded by path, and DATAFRAME outputs are saved under
+    ``<run dir>/frames``.
+    """
+
+    def __init__(self, run_dir: str):
+        self._run_dir = run_dir
+        self._path = os.path.join(run_dir, "journal.jsonl")
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def exists(self) -> bool:
+        return os.path.exists(self._path)
+
+    def start(self, graph_id: str) -> None:
+        """
+        Start a new journal, or check that an existing one belongs to the same graph.
+
+        :param graph_id: ID of the graph being executed.
+        :raises ValueError: If the journal was recorded for a different graph.
+        """
+        for entry in self._entries():
+            if entry.get("graph") is not None and entry["graph"] != graph_id:
+                raise ValueError(
+                    f"run journal '{self._path}' belongs to graph '{entry['graph']}', "
+                    f"not '{graph_id}'"
+                )
+        self._append({"graph": graph_id})
+
+    def record(self, node: pirlib.pir.Node, outputs: Dict[str, Any]) -> None:
+        """
+        Record that a node has finished along with the locations of its outputs.
+        """
+        entry = {"node": node.id, "outputs": {}}
+        for out in node.outputs:
+            value = outputs.get(out.id)
+            if out.iotype == "DATAFRAME" and value is not None:
+                frames_dir = os.path.join(self._run_dir, "frames", node.id.replace(os.sep, "_"))
+                os.makedirs(frames_dir, exist_ok=True)
+                path = os.path.join(frames_dir, f"{out.id.replace(os.sep, '_')}.pkl")
+                value.to_pickle(path)
+            elif isinstance(value, (DirectoryPath, FilePath)):
+                path = str(value)
+            else:
+                continue
+            entry["outputs"][out.id] = {"iotype": out.iotype, "path": os.path.abspath(path)}
+        self._append(entry)
+
+    def completed(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Reload the outputs of all nodes recorded as finished. Outputs which no longer
+        exist on disk, e.g. because they were released during the run, are omitted.
+
+        :return: A dictionary mapping node IDs to their reloaded outputs.
+        """
+        completed = {}
+        for entry in self._entries():
+            if "node" not in entry:
+                continue
+            outputs = {}
+            for output_id, info in entry["outputs"].items():
+                path, iotype = info["path"], info["iotype"]
+                if not os.path.exists(path):
+                    continue
+                if iotype == "DIRECTORY":
+                    outputs[output_id] = DirectoryPath(path)
+                elif iotype == "FILE":
+                    outputs[output_id] = FilePath(path)
+                elif iotype == "DATAFRAME":
+                    import pandas
+
+                    outputs[output_id] = pandas.read_pickle(path)
+            completed[entry["node"]] = outputs
+        return completed
+
+    def _entries(self):
+        if not os.path.exists(self._path):
+            return
+        with open(self._path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may be incomplete if the run was killed mid-write.
+                    continue
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        os.makedirs(self._run_dir, exist_ok=True)
+        with open(self._path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
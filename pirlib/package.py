@@ -16,7 +16,6 @@ from pirlib.pir import (
     Output,
     Package,
     Subgraph,
-    find_by_id,
 )
 
 _PACKAGE = contextvars.ContextVar("_PACKAGE")
@@ -150,7 +149,7 @@ def _pipeline_to_graph(pipeline_func: callable, pipeline_name: str, pipeline_con
     finally:
         _GRAPH.reset(token)
     graph.outputs = _inspect_graph_outputs(pipeline_func, return_value)
-    assert find_by_id(package.graphs, graph.id) is None
+    assert package.find_graph(graph.id) is None
     package.graphs.append(graph)
     return graph
 
@@ -233,7 +232,7 @@ def task_call(func):
         if not is_packaging():
             return func(instance, *args, **kwargs)
         graph = _GRAPH.get()
-        if find_by_id(graph.nodes, instance.name) is not None:
+        if graph.find_node(instance.name) is not None:
             raise ValueError(f"pipeline already contains node {instance.name}")
         node_id = instance.name
         node = Node(
@@ -1,3 +1,5 @@
+import dataclasses
+
 import pytest
 from pirlib.pipeline import pipeline
 from pirlib.task import task
@@ -39,6 +41,17 @@ def p3(inp: DirectoryPath) -> FilePath:
     return t2(p1(inp))
 
 
+@pipeline
+def p4(inp: DirectoryPath) -> DirectoryPath:
+    return t1(inp)
+
+
+@pipeline
+def p5(inp: DirectoryPath) -> FilePath:
+    # The output of one subgraph is the input of another.
+    return p3(p4(inp))
+
+
 @pipeline
 def broken_pipeline(inp: DirectoryPath) -> FilePath:
     # Output type doesn't match the annotation.
@@ -101,3 +114,31 @@ def test_wrong_input_type():
 def test_wrong_output_type():
     with pytest.raises(TypeError):
         broken_pipeline(test_dir_path)
+
+
+def test_flatten_graph():
+    pkg = p5.package()
+    graph = pkg.flatten_graph("p5")
+    assert [node.id for node in graph.nodes] == ["p4.t1", "p3.t2", "p3.p1.t1"]
+    nodes = {node.id: node for node in graph.nodes}
+    assert nodes["p4.t1"].inputs[0].source.graph_input_id == "inp"
+    assert nodes["p3.p1.t1"].inputs[0].source.node_id == "p4.t1"
+    assert nodes["p3.t2"].inputs[0].source.node_id == "p3.p1.t1"
+    assert graph.outputs[0].source.node_id == "p3.t2"
+    assert not graph.subgraphs
+
+    # Flattened graphs are memoized, but don't share anything with each other.
+    graph.nodes[0].config["key"] = "value"
+    graph.nodes[0].inputs[0].source.graph_input_id = "other"
+    again = pkg.flatten_graph("p5")
+    assert again.nodes[0].config == {"timer": False}
+    assert again.nodes[0].inputs[0].source.graph_input_id == "inp"
+    # Reassigned attributes and added items are noticed.
+    pkg.graphs[0].nodes[0].config = {"key": "value"}
+    changed = pkg.flatten_graph("p5")
+    assert changed.nodes[0].config == {"key": "value"}
+    pkg.graphs[0].nodes.append(dataclasses.replace(pkg.graphs[0].nodes[0], id="t3"))
+    assert "p4.t3" in [node.id for node in pkg.flatten_graph("p5").nodes]
+
+    with pytest.raises(ValueError, match="not found"):
+        pkg.flatten_graph("missing")
@@ -11,16 +11,31 @@ graphs in the same package. A visual example of a package is shown below.
 """
 from __future__ import annotations
 
+import collections
 import copy
+import dataclasses
 import typeguard
 from dataclasses import dataclass, field
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, FrozenSet, List, Optional, Union
 
 from pirlib.utils import find_by_id
 
+# Number of reassigned attributes of PIR objects, see Package.flatten_graph.
+_VERSION = 0
+
+
+class _Tracked(object):
+    # Counts the attributes which are reassigned, but not those set by __init__.
+
+    def __setattr__(self, name: str, value: Any):
+        global _VERSION
+        if name in self.__dict__:
+            _VERSION += 1
+        object.__setattr__(self, name, value)
+
 
 @dataclass
-class Package:
+class Package(_Tracked):
     """
     This dataclass encodes a package containing multiple graphs. Graphs in the same
     package can embed each other as subgraphs, as long as they are not recursively
@@ -31,6 +46,19 @@ class Package:
 
     graphs: List[Graph] = field(default_factory=list)
 
+    def find_graph(self, graph_id: str) -> Optional[Graph]:
+        """
+        Look up a graph of this package by ID, using an index which is rebuilt when
+        the list of graphs changes.
+
+        :param graph_id: ID of the graph.
+        :return: The first graph with the ID, or ``None`` if there is none.
+        """
+        return _find(self, "graphs", graph_id)
+
+    def __getstate__(self):
+        return _without_indexes(self)
+
     def flatten_graph(self, graph_id: str, validate: bool = True) -> Graph:
         """
         Return a graph from this package after flattening all its subgraphs. The
@@ -38,46 +66,42 @@ class Package:
         subgraph is converted into a node in the parent graph with a new node id
         equal to ``<subgraph id>.<node id>``.
 
+        The flattened graphs are memoized per package, so flattening the same graph of
+        an unchanged package again only copies the result. The memo is invalidated when
+        an attribute of any PIR object is reassigned, or graphs, or nodes, subgraphs,
+        inputs or outputs of a graph are added or removed. Other changes in place, e.g.
+        to the config dict of a node, aren't noticed, so assign a new dict instead.
+
         :param graph_id: ID of the graph in this package to flatten.
         :param validate: Validate the resulting flattened graph. Validation may fail,
                 for example, if the resulting graph has nodes with conflicting IDs.
         :return: The resulting flattened graph.
         """
-        graph = copy.deepcopy(find_by_id(self.graphs, graph_id))
-        if graph is None:
+        stamp = (_VERSION, _shape(self))
+        memo = self.__dict__.setdefault("_flattened", {})
+        flattened = memo.get((graph_id, validate))
+        if flattened is None or flattened[0] != stamp:
+            flattened = memo[(graph_id, validate)] = (
+                stamp,
+                self._flatten_graph(graph_id, validate),
+            )
+        # Callers may modify the nodes, inputs and sources of the flattened graph, which
+        # are copied so that the memo isn't.
+        return _copy_flattened(flattened[1])
+
+    def _flatten_graph(self, graph_id: str, validate: bool) -> Graph:
+        graphs = {graph.id: graph for graph in self.graphs}
+        if graph_id not in graphs:
             raise ValueError(f"graph with id '{graph_id}' not found in package")
-        for subgraph in graph.subgraphs:
-            g = self.flatten_graph(subgraph.graph_id, validate=False)
-            # Add prefix to subgraph nodes ids.
-            for n in g.nodes:
-                n.id = f"{subgraph.id}.{n.id}"
-                for i in n.inputs:
-                    if i.source.node_id is not None:
-                        i.source.node_id = f"{subgraph.id}.{i.source.node_id}"
-            for o in g.outputs:
-                if o.source.node_id is not None:
-                    o.source.node_id = f"{subgraph.id}.{o.source.node_id}"
-
-            # Merge subgraph into main graph.
-            for node in graph.nodes:
-                for inp in node.inputs:
-                    if inp.source.subgraph_id == subgraph.id:
-                        for o in g.outputs:
-                            if o.id == inp.source.output_id:
-                                inp.source = o.source
-            for out in graph.outputs:
-                if out.source.subgraph_id == subgraph.id:
-                    for o in g.outputs:
-                        if o.id == out.source.output_id:
-                            out.source = o.source
-            for n in g.nodes:
-                for i in n.inputs:
-                    if i.source.graph_input_id is not None:
-                        for si in subgraph.inputs:
-                            if i.source.graph_input_id == si.id:
-                                i.source = si.source
-            graph.nodes.extend(g.nodes)
-        graph.subgraphs = []
+        graph = graphs[graph_id]
+        nodes = []
+        outputs = _flatten_into(graphs, graph, "", None, nodes, frozenset())
+        graph = dataclasses.replace(
+            graph,
+            nodes=nodes,
+            subgraphs=[],
+            outputs=[dataclasses.replace(out, source=outputs[out.id]) for out in graph.outputs],
+        )
         if validate:
             graph.validate()
         return graph
@@ -103,13 +127,13 @@ class Package:
                 raise ValidationError("package contains recursive subgraphs")
 
     def _validate_subgraph(self, subgraph):
-        graph = find_by_id(self.graphs, subgraph.graph_id)
+        graph = self.find_graph(subgraph.graph_id)
         if graph is None:
             raise ValidationError(
                 f"subgraph '{subgraph.id}' refers to missing graph '{subgraph.graph}'"
             )
         for inp in subgraph.inputs:
-            g_inp = find_by_id(graph.inputs, inp.id)
+            g_inp = graph.find_input(inp.id)
             if g_inp is None:
                 raise ValidationError(
                     f"subgraph '{subgraph.id}' input '{inp.id}' "
@@ -122,7 +146,7 @@ class Package:
                     f"input iotype '{g_inp.iotype}'"
                 )
         for out in subgraph.outputs:
-            g_out = find_by_id(graph.outputs, out.id)
+            g_out = graph.find_output(out.id)
             if g_out is None:
                 raise ValidationError(
                     f"subgraph '{subgraph.id}' output '{out.id}' "
@@ -140,13 +164,13 @@ class Package:
             return True
         visited = visited + [graph.id]
         for subgraph in graph.subgraphs:
-            if self._is_recursive(find_by_id(self.graphs, subgraph.graph_id), visited):
+            if self._is_recursive(self.find_graph(subgraph.graph_id), visited):
                 return True
         return False
 
 
 @dataclass
-class Metadata:
+class Metadata(_Tracked):
     """
     This dataclass encodes the metadata of an PIR component. It contains its
     annotations and an optional human-readable name of the component.
@@ -163,7 +187,7 @@ class Metadata:
 
 
 @dataclass
-class Graph:
+class Graph(_Tracked):
     """
     This dataclass encodes a directed acyclic graph (DAG) of nodes each with well
     defined inputs and outputs. The graph itself also has inputs and outputs, where its
@@ -188,6 +212,46 @@ class Graph:
     outputs: List[GraphOutput] = field(default_factory=list)
     meta: Metadata = field(default_factory=Metadata)
 
+    def find_node(self, node_id: str) -> Optional[Node]:
+        """
+        Look up a node of this graph by ID. This and the other ``find_*`` methods use
+        an index of the list which is rebuilt when the list is replaced or resized.
+
+        :param node_id: ID of the node.
+        :return: The first node with the ID, or ``None`` if there is none.
+        """
+        return _find(self, "nodes", node_id)
+
+    def find_subgraph(self, subgraph_id: str) -> Optional[Subgraph]:
+        """
+        Look up a subgraph of this graph by ID.
+
+        :param subgraph_id: ID of the subgraph.
+        :return: The first subgraph with the ID, or ``None`` if there is none.
+        """
+        return _find(self, "subgraphs", subgraph_id)
+
+    def find_input(self, input_id: str) -> Optional[GraphInput]:
+        """
+        Look up an input of this graph by ID.
+
+        :param input_id: ID of the graph input.
+        :return: The first graph input with the ID, or ``None`` if there is none.
+        """
+        return _find(self, "inputs", input_id)
+
+    def find_output(self, output_id: str) -> Optional[GraphOutput]:
+        """
+        Look up an output of this graph by ID.
+
+        :param output_id: ID of the graph output.
+        :return: The first graph output with the ID, or ``None`` if there is none.
+        """
+        return _find(self, "outputs", output_id)
+
+    def __getstate__(self):
+        return _without_indexes(self)
+
     def validate(self):
         """
         Validate this graph. A graph is valid if (1) all of its nodes, subgraphs,
@@ -250,12 +314,12 @@ class Graph:
 
     def _validate_source(self, source, iotype):
         if source.graph_input_id is not None:
-            graph_input = find_by_id(self.inputs, source.graph_input_id)
+            graph_input = self.find_input(source.graph_input_id)
             if graph_input is None:
                 raise ValidationError(f"reference to missing graph input '{source.graph_input_id}'")
             source_iotype = graph_input.iotype
         elif source.node_id is not None:
-            node = find_by_id(self.nodes, source.node_id)
+            node = self.find_node(source.node_id)
             if node is None:
                 raise ValidationError(f"reference to missing node '{source.node_id}'")
             output = find_by_id(node.outputs, source.output_id)
@@ -265,7 +329,7 @@ class Graph:
                 )
             source_iotype = output.iotype
         elif source.subgraph_id is not None:
-            subgraph = find_by_id(self.subgraphs, source.subgraph_id)
+            subgraph = self.find_subgraph(source.subgraph_id)
             if subgraph is None:
                 raise ValidationError(f"reference to missing subgraph '{source.subgraph_id}'")
             output = find_by_id(subgraph.outputs, source.output_id)
@@ -279,37 +343,68 @@ class Graph:
             raise ValidationError(f"iotype '{iotype}' differs from source iotype '{source_iotype}'")
 
     def _validate_acyclicity(self):
-        visited_node_id = set()
-        visited_subgraph_id = set()
-        for root in self.nodes + self.subgraphs:
-            stack = [root]
-            while stack:
-                item = stack.pop()
-                if isinstance(item, Node):
-                    if item.id in visited_node_id:
-                        continue
-                    visited_node_id.add(item.id)
-                elif isinstance(item, Subgraph):
-                    if item.id in visited_subgraph_id:
-                        continue
-                    visited_subgraph_id.add(item.id)
-                for inp in item.inputs:
-                    if inp.source.node_id is not None:
-                        node_id = inp.source.node_id
-                        node = find_by_id(self.nodes, node_id)
-                        if node == root:
-                            raise ValidationError(f"cycle detected containing node '{node_id}'")
-                        stack.append(node)
-                    elif inp.source.subgraph_id is not None:
-                        subgraph_id = inp.source.subgraph_id
-                        subgraph = find_by_id(self.subgraphs, subgraph_id)
-                        if subgraph == root:
-                            raise ValidationError(f"cycle detected containing subgraph '{node_id}'")
-                        stack.append(subgraph)
+        self.topological_order()
+
+    def topological_order(self) -> List[Union[Node, Subgraph]]:
+        """
+        Order the nodes and subgraphs of this graph so that each of them comes after
+        the providers of its inputs, in time linear in the size of the graph. Items
+        which don't depend on each other keep their order in :attr:`nodes` followed
+        by :attr:`subgraphs`. Sources which refer to missing nodes or subgraphs are
+        ignored, see :meth:`validate`.
+
+        :raises ValidationError: If the graph contains a cycle, with its path.
+        :return: The nodes and subgraphs of this graph in topological order.
+        """
+        items = self.nodes + self.subgraphs
+        positions = {}
+        for pos, item in enumerate(items):
+            positions.setdefault((isinstance(item, Subgraph), item.id), pos)
+        providers = [[] for _ in items]
+        consumers = [[] for _ in items]
+        for pos, item in enumerate(items):
+            seen = set()
+            for inp in item.inputs:
+                if inp.source.node_id is not None:
+                    provider = positions.get((False, inp.source.node_id))
+                elif inp.source.subgraph_id is not None:
+                    provider = positions.get((True, inp.source.subgraph_id))
+                else:
+                    continue
+                if provider is not None and provider not in seen:
+                    seen.add(provider)
+                    providers[pos].append(provider)
+                    consumers[provider].append(pos)
+        in_degree = [len(item_providers) for item_providers in providers]
+        ready = collections.deque(pos for pos, degree in enumerate(in_degree) if not degree)
+        order = []
+        while ready:
+            pos = ready.popleft()
+            order.append(items[pos])
+            for consumer in consumers[pos]:
+                in_degree[consumer] -= 1
+                if not in_degree[consumer]:
+                    ready.append(consumer)
+        if len(order) < len(items):
+            # Every item left over waits on a provider which is left over as well, so
+            # following the providers from any of them leads into a cycle.
+            path, path_index = [], {}
+            pos = next(pos for pos, degree in enumerate(in_degree) if degree)
+            while pos not in path_index:
+                path_index[pos] = len(path)
+                path.append(pos)
+                pos = next(p for p in providers[pos] if in_degree[p])
+            cycle = path[path_index[pos] :][::-1]
+            # Start from the item listed first, so that the report is stable.
+            start = cycle.index(min(cycle))
+            cycle = cycle[start:] + cycle[:start]
+            text = " -> ".join(_item_label(items[pos]) for pos in cycle + cycle[:1])
+            raise ValidationError(f"cycle detected: {text}")
+        return order
 
 
 @dataclass
-class GraphInput:
+class GraphInput(_Tracked):
     """
     This dataclass encodes an input of a graph. A graph input represents a
     "placeholder" for a user-provided input value, and so does not have a connected
@@ -333,7 +428,7 @@ class GraphInput:
 
 
 @dataclass
-class GraphOutput:
+class GraphOutput(_Tracked):
     """
     This dataclass encodes an output of a graph. Since a graph itself does not perform
     any computation, a graph output simply refers to an output of a node or subgraph, or
@@ -363,7 +458,7 @@ class GraphOutput:
 
 
 @dataclass
-class Subgraph:
+class Subgraph(_Tracked):
     """
     This dataclass encodes a subgraph embedded in a graph. A subgraph can refer to any
     other graph in the same package as the parent graph. Each of the subgraph's inputs
@@ -412,7 +507,7 @@ class Subgraph:
 
 
 @dataclass
-class Node:
+class Node(_Tracked):
     """
     This dataclass encodes a node in a graph. A node represents a procedure that can be
     executed on several inputs to produce several outputs. All node inputs must have
@@ -468,7 +563,7 @@ class Node:
 
 
 @dataclass
-class Input:
+class Input(_Tracked):
     """
     This dataclass encodes a named input of a node or subgraph with a connected source.
     If it is the input of a subgraph, then its name must be equal to a name of some
@@ -500,7 +595,7 @@ class Input:
 
 
 @dataclass
-class Output:
+class Output(_Tracked):
     """
     This dataclass encodes a named output of a node or a subgraph. An output can be an
     input source for other downstream nodes or subgraphs within the same graph, or be
@@ -525,7 +620,7 @@ class Output:
 
 
 @dataclass(init=False)
-class Framework:
+class Framework(_Tracked):
     """
     This dataclass encodes the execution framework and configuration for a node.
     :ivar name: Name of the framework used for executing a node.
@@ -550,7 +645,7 @@ class Framework:
 
 
 @dataclass
-class Entrypoint:
+class Entrypoint(_Tracked):
     """
     This dataclass encodes the entrypoint for executing a node. An entrypoint is
     typically a reference to a function or procedure in code (called "handler").
@@ -578,7 +673,7 @@ class Entrypoint:
 
 
 @dataclass
-class DataSource:
+class DataSource(_Tracked):
     """
     This dataclass encodes a reference to the source of an intermediate value in a PIR
     graph. A source can either be (1) an output of a node in the graph, (2) an output
@@ -634,6 +729,10 @@ def _validate_fields(instance):
             raise ValidationError(err.message) from None
 
 
+def _item_label(item: Union[Node, Subgraph]) -> str:
+    return f"{'subgraph' if isinstance(item, Subgraph) else 'node'} '{item.id}'"
+
+
 def _validate_ids(items: Any, label: str) -> None:
     once = set()
     twice = set()
@@ -645,3 +744,146 @@ def _validate_ids(items: Any, label: str) -> None:
     if twice:
         text = ", ".join(repr(name) for name in twice)
         raise ValidationError(f"duplicate {label} id(s): {text}")
+
+
+class _IdIndex(object):
+    """
+    Maps the IDs of the items of a list to their positions. The index belongs to one
+    list object of a given length, and is rebuilt by :func:`_find` otherwise. Items
+    which were replaced or renamed in place are caught by checking the ID of the
+    item found, and by rebuilding the index once before reporting a miss.
+    """
+
+    def __init__(self, items: List[Any]):
+        self.items = items
+        self.size = len(items)
+        self.positions = {}
+        for pos, item in enumerate(items):
+            # Lookups return the first item with an ID, like find_by_id.
+            self.positions.setdefault(item.id, pos)
+
+
+def _find(container: Any, name: str, item_id: str) -> Any:
+    items = getattr(container, name)
+    indexes = container.__dict__.setdefault("_id_indexes", {})
+    index = indexes.get(name)
+    rebuilt = index is None or index.items is not items or index.size != len(items)
+    if rebuilt:
+        index = indexes[name] = _IdIndex(items)
+    pos = index.positions.get(item_id)
+    if pos is not None and items[pos].id == item_id:
+        return items[pos]
+    if not rebuilt:
+        # The ID may belong to an item which was replaced or renamed in place.
+        index = indexes[name] = _IdIndex(items)
+        pos = index.positions.get(item_id)
+    return None if pos is None else items[pos]
+
+
+def _without_indexes(container: Any) -> Dict[str, Any]:
+    # The indexes are left out of pickles and copies, and rebuilt on first use.
+    state = dict(container.__dict__)
+    state.pop("_id_indexes", None)
+    state.pop("_flattened", None)
+    return state
+
+
+def _copy_flattened(graph: Graph) -> Graph:
+    # Copy what a flattened graph doesn't share with its package: the nodes with their
+    # configs, inputs and sources, and the outputs with their sources. This is much
+    # faster than copy.deepcopy for big graphs.
+    nodes = []
+    for node in graph.nodes:
+        inputs = [_clone(inp, source=_clone(inp.source)) for inp in node.inputs]
+        nodes.append(_clone(node, inputs=inputs, config=_copy_config(node.config)))
+    outputs = [_clone(out, source=_clone(out.source)) for out in graph.outputs]
+    return _clone(graph, nodes=nodes, outputs=outputs)
+
+
+def _clone(obj: Any, **changes: Any) -> Any:
+    # Like dataclasses.replace, without running __init__ and __setattr__.
+    clone = object.__new__(type(obj))
+    clone.__dict__.update(_without_indexes(obj), **changes)
+    return clone
+
+
+def _copy_config(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _copy_config(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy_config(item) for item in value]
+    if isinstance(value, (str, int, float, bool, type(None))):
+        return value
+    return copy.deepcopy(value)
+
+
+def _shape(package: Package) -> tuple:
+    # The lists of the package and its graphs, and their lengths, which change when
+    # items are added or removed.
+    shape = [id(package.graphs), len(package.graphs)]
+    for graph in package.graphs:
+        for items in (graph.nodes, graph.subgraphs, graph.inputs, graph.outputs):
+            shape += (id(items), len(items))
+    return tuple(shape)
+
+
+def _flatten_into(
+    graphs: Dict[str, Graph],
+    graph: Graph,
+    prefix: str,
+    input_sources: Optional[Dict[str, DataSource]],
+    nodes: List[Node],
+    parents: FrozenSet[str],
+) -> Dict[str, DataSource]:
+    # Append a copy of each node of the graph, and recursively of its subgraphs, to
+    # nodes, with its ID prefixed and its sources resolved in the flattened graph.
+    # Graph inputs are resolved with input_sources, unless this is the flattened graph
+    # itself. Returns the resolved source of each graph output.
+    if graph.id in parents:
+        raise ValidationError("package contains recursive subgraphs")
+    parents = parents | {graph.id}
+    subgraphs = {subgraph.id: subgraph for subgraph in graph.subgraphs}
+    subgraph_outputs = {}
+    subgraph_nodes = {}
+
+    def flatten_subgraph(subgraph_id):
+        # Flattened on first use, since subgraph inputs may refer to other subgraphs.
+        if subgraph_id in subgraph_outputs:
+            if subgraph_outputs[subgraph_id] is None:
+                raise ValidationError(f"cycle detected containing subgraph '{subgraph_id}'")
+            return subgraph_outputs[subgraph_id]
+        subgraph = subgraphs[subgraph_id]
+        if subgraph.graph_id not in graphs:
+            raise ValueError(f"graph with id '{subgraph.graph_id}' not found in package")
+        subgraph_outputs[subgraph_id] = None
+        sources = {inp.id: resolve(inp.source) for inp in subgraph.inputs}
+        subgraph_nodes[subgraph_id] = []
+        subgraph_outputs[subgraph_id] = _flatten_into(
+            graphs,
+            graphs[subgraph.graph_id],
+            f"{prefix}{subgraph_id}.",
+            sources,
+            subgraph_nodes[subgraph_id],
+            parents,
+        )
+        return subgraph_outputs[subgraph_id]
+
+    def resolve(source):
+        # Dangling references are kept as they are, for validation to report.
+        if source.graph_input_id is not None:
+            if input_sources is not None and source.graph_input_id in input_sources:
+                source = input_sources[source.graph_input_id]
+        elif source.node_id is not None:
+            source = dataclasses.replace(source, node_id=f"{prefix}{source.node_id}")
+        elif source.subgraph_id in subgraphs:
+            source = flatten_subgraph(source.subgraph_id).get(source.output_id, source)
+        # Each input gets its own source, which may be modified after flattening.
+        return dataclasses.replace(source)
+
+    for node in graph.nodes:
+        inputs = [dataclasses.replace(inp, source=resolve(inp.source)) for inp in node.inputs]
+        nodes.append(dataclasses.replace(node, id=f"{prefix}{node.id}", inputs=inputs))
+    for subgraph in graph.subgraphs:
+        flatten_subgraph(subgraph.id)
+        nodes.extend(subgraph_nodes[subgraph.id])
+    return {out.id: resolve(out.source) for out in graph.outputs}
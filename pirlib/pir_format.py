@@ -0,0 +1,318 @@
+"""
+This module reads and writes PIR packages. Besides YAML, packages can be stored in a
+compact binary format which is much faster to load and dump for big packages: a
+``PIRB`` magic number and a format version byte, followed by an index of the graphs
+and the graphs themselves. Each graph is compressed with zlib separately, and encoded
+as JSON in which every PIR dataclass is an array of its field values in declaration
+order. Default :obj:`~pirlib.pir.Metadata` is encoded as ``null``. The index holds the
+position of each graph and the IDs of the graphs it references through subgraphs, so
+a single graph can be loaded without decoding the rest of the package. The format
+doesn't use pickle, so it is safe to load from untrusted sources, and it is decoded
+directly into the PIR dataclasses rather than through ``dacite``. Configs must be
+JSON-compatible.
+"""
+import dataclasses
+import io
+import json
+import struct
+import zlib
+from typing import IO, Any, Callable, Dict, List, Optional, Tuple
+
+import dacite
+import yaml
+
+from pirlib.pir import (
+    DataSource,
+    Entrypoint,
+    Framework,
+    Graph,
+    GraphInput,
+    GraphOutput,
+    Input,
+    Metadata,
+    Node,
+    Output,
+    Package,
+    Subgraph,
+)
+
+MAGIC = b"PIRB"
+
+# Version of the binary format, incremented on incompatible changes. Packages of other
+# versions are rejected, they have to be written again.
+FORMAT_VERSION = 2
+
+FORMATS = ("yaml", "binary")
+
+# Size of the compressed index, which follows the version byte.
+_INDEX_SIZE = struct.Struct(">I")
+
+_DECODE_ERRORS = (zlib.error, struct.error, ValueError, TypeError, IndexError, KeyError)
+
+
+def encode_package(package: Package) -> bytes:
+    """
+    Encode a package in the binary format.
+
+    :param package: The package to encode.
+    :raises ValueError: If a config can't be encoded as JSON.
+    :return: The encoded package.
+    """
+    try:
+        blobs = [_compress(_graph(graph)) for graph in package.graphs]
+    except (TypeError, ValueError) as err:
+        raise ValueError(f"cannot encode package in the binary format: {err}") from None
+    index, offset = [], 0
+    for graph, blob in zip(package.graphs, blobs):
+        references = list(dict.fromkeys(subgraph.graph_id for subgraph in graph.subgraphs))
+        index.append([graph.id, offset, len(blob), references])
+        offset += len(blob)
+    index = _compress(index)
+    header = MAGIC + bytes([FORMAT_VERSION]) + _INDEX_SIZE.pack(len(index))
+    return b"".join([header, index, *blobs])
+
+
+def decode_package(data: bytes, graph_id: Optional[str] = None) -> Package:
+    """
+    Decode a package in the binary format.
+
+    :param data: The encoded package, see :func:`encode_package`.
+    :param graph_id: Only decode this graph and the graphs it references, see
+            :func:`load_package`.
+    :raises ValueError: If the data is not a binary package of a supported version, or
+            if the graph is not in the package.
+    :return: The decoded package.
+    """
+    if not is_binary_package(data):
+        raise ValueError("not a binary PIR package")
+    f = io.BytesIO(data)
+    f.seek(len(MAGIC) + 1)
+    return _load_binary(f, data[len(MAGIC)], graph_id)
+
+
+def is_binary_package(data: bytes) -> bool:
+    """
+    Whether the given data starts like a package in the binary format.
+    """
+    return data[: len(MAGIC)] == MAGIC and len(data) > len(MAGIC)
+
+
+def load_package(f: IO, graph_id: Optional[str] = None) -> Package:
+    """
+    Load a package from a file in either format, which is detected automatically.
+
+    :param f: A file object opened for reading, in binary or text mode.
+    :param graph_id: Only load this graph and the graphs it references through
+            subgraphs, transitively. The graph comes first in the loaded package. Only
+            the binary format reads just the index and these graphs from the file, so
+            that the time to load a graph doesn't depend on the size of the package.
+            YAML packages are parsed in full before the graphs are selected.
+    :raises ValueError: If the graph is not in the package.
+    :return: The loaded package.
+    """
+    head = f.read(len(MAGIC) + 1)
+    if isinstance(head, bytes):
+        if is_binary_package(head):
+            return _load_binary(f, head[-1], graph_id)
+        head = head.decode()
+    data = yaml.safe_load(head + _text(f.read()))
+    if graph_id is not None:
+        graphs = {}
+        for graph in reversed(data["graphs"]):
+            graphs[graph["id"]] = graph
+        references = {
+            gid: [subgraph["graph_id"] for subgraph in graph.get("subgraphs", [])]
+            for gid, graph in graphs.items()
+        }
+        data = dict(data, graphs=[graphs[gid] for gid in _closure(graph_id, references)])
+    return dacite.from_dict(data_class=Package, data=data)
+
+
+def dump_package(package: Package, f: IO, fmt: str = "yaml") -> None:
+    """
+    Write a package to a file.
+
+    :param package: The package to write.
+    :param f: A file object opened for writing. Binary packages written to a file
+            opened in text mode are written to its underlying binary buffer.
+    :param fmt: ``"yaml"`` or ``"binary"``.
+    """
+    if fmt == "yaml":
+        yaml.dump(dataclasses.asdict(package), f, sort_keys=False)
+    elif fmt == "binary":
+        data = encode_package(package)
+        if hasattr(f, "buffer"):
+            f.flush()
+            f = f.buffer
+        f.write(data)
+        f.flush()
+    else:
+        raise ValueError(f"unknown package format '{fmt}', expected one of {list(FORMATS)}")
+
+
+def _text(data: Any) -> str:
+    return data.decode() if isinstance(data, bytes) else data
+
+
+def _compress(value: Any) -> bytes:
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode(), 1)
+
+
+def _decompress(data: bytes) -> Any:
+    return json.loads(zlib.decompress(data))
+
+
+def _closure(graph_id: str, references: Dict[str, List[str]]) -> List[str]:
+    # IDs of the graph and of the graphs it references transitively, in breadth-first
+    # order. Missing references are left for validation to report.
+    if graph_id not in references:
+        raise ValueError(f"graph with id '{graph_id}' not found in package")
+    order, seen = [graph_id], {graph_id}
+    for gid in order:
+        for ref in references[gid]:
+            if ref in references and ref not in seen:
+                seen.add(ref)
+                order.append(ref)
+    return order
+
+
+def _read_index(f: IO) -> Tuple[List[List[Any]], Callable[[Any], Any]]:
+    # Returns the index entries [graph ID, location, referenced graph IDs], and a
+    # function which reads the encoded graph at a location.
+    if not f.seekable():
+        f = io.BytesIO(f.read())
+    (size,) = _INDEX_SIZE.unpack(f.read(_INDEX_SIZE.size))
+    index = [
+        [gid, (offset, length), refs] for gid, offset, length, refs in _decompress(f.read(size))
+    ]
+    start = f.tell()
+
+    def read(location):
+        f.seek(start + location[0])
+        return _decompress(f.read(location[1]))
+
+    return index, read
+
+
+def _load_binary(f: IO, version: int, graph_id: Optional[str]) -> Package:
+    if version != FORMAT_VERSION:
+        raise ValueError(
+            f"unsupported binary PIR package version {version}, expected {FORMAT_VERSION}"
+        )
+    try:
+        index, read = _read_index(f)
+        locations, references = {}, {}
+        for gid, location, refs in reversed(index):
+            locations[gid], references[gid] = location, refs
+    except _DECODE_ERRORS as err:
+        raise ValueError(f"malformed binary PIR package: {err}") from None
+    if graph_id is None:
+        selected = [location for _, location, _ in index]
+    else:
+        selected = [locations[gid] for gid in _closure(graph_id, references)]
+    try:
+        return Package(graphs=[_to_graph(read(location)) for location in selected])
+    except _DECODE_ERRORS as err:
+        raise ValueError(f"malformed binary PIR package: {err}") from None
+
+
+def _meta(meta: Metadata) -> Optional[List[Any]]:
+    if meta.name is None and meta.annotations is None:
+        return None
+    return [meta.name, meta.annotations]
+
+
+def _source(source: DataSource) -> List[Any]:
+    return [source.node_id, source.subgraph_id, source.output_id, source.graph_input_id]
+
+
+def _input(inp: Input) -> List[Any]:
+    return [inp.id, inp.iotype, _source(inp.source), _meta(inp.meta)]
+
+
+def _output(out: Output) -> List[Any]:
+    return [out.id, out.iotype, _meta(out.meta)]
+
+
+def _node(node: Node) -> List[Any]:
+    framework = node.framework
+    return [
+        node.id,
+        {
+            name: [e.version, e.handler, e.runtime, e.codeurl, e.image]
+            for name, e in node.entrypoints.items()
+        },
+        None if framework is None else [framework.name, framework.version],
+        node.config,
+        [_input(inp) for inp in node.inputs],
+        [_output(out) for out in node.outputs],
+        _meta(node.meta),
+    ]
+
+
+def _subgraph(subgraph: Subgraph) -> List[Any]:
+    return [
+        subgraph.id,
+        subgraph.graph_id,
+        subgraph.config,
+        [_input(inp) for inp in subgraph.inputs],
+        [_output(out) for out in subgraph.outputs],
+        _meta(subgraph.meta),
+    ]
+
+
+def _graph(graph: Graph) -> List[Any]:
+    return [
+        graph.id,
+        [_node(node) for node in graph.nodes],
+        [_subgraph(subgraph) for subgraph in graph.subgraphs],
+        [[inp.id, inp.iotype, _meta(inp.meta)] for inp in graph.inputs],
+        [[out.id, out.iotype, _source(out.source), _meta(out.meta)] for out in graph.outputs],
+        _meta(graph.meta),
+    ]
+
+
+def _to_meta(data: Optional[List[Any]]) -> Metadata:
+    return Metadata() if data is None else Metadata(data[0], data[1])
+
+
+def _to_input(data: List[Any]) -> Input:
+    return Input(data[0], data[1], DataSource(*data[2]), _to_meta(data[3]))
+
+
+def _to_output(data: List[Any]) -> Output:
+    return Output(data[0], data[1], _to_meta(data[2]))
+
+
+def _to_node(data: List[Any]) -> Node:
+    return Node(
+        data[0],
+        {name: Entrypoint(*e) for name, e in data[1].items()},
+        None if data[2] is None else Framework(data[2][0], data[2][1]),
+        data[3],
+        [_to_input(inp) for inp in data[4]],
+        [_to_output(out) for out in data[5]],
+        _to_meta(data[6]),
+    )
+
+
+def _to_subgraph(data: List[Any]) -> Subgraph:
+    return Subgraph(
+        data[0],
+        data[1],
+        data[2],
+        [_to_input(inp) for inp in data[3]],
+        [_to_output(out) for out in data[4]],
+        _to_meta(data[5]),
+    )
+
+
+def _to_graph(data: List[Any]) -> Graph:
+    return Graph(
+        data[0],
+        [_to_node(node) for node in data[1]],
+        [_to_subgraph(subgraph) for subgraph in data[2]],
+        [GraphInput(i[0], i[1], _to_meta(i[2])) for i in data[3]],
+        [GraphOutput(o[0], o[1], DataSource(*o[2]), _to_meta(o[3])) for o in data[4]],
+        _to_meta(data[5]),
+    )
@@ -0,0 +1,105 @@
+import dataclasses
+import io
+import struct
+
+import dacite
+import pytest
+import yaml
+from pirlib.frameworks.adaptdl import AdaptDL
+from pirlib.iotypes import FilePath
+from pirlib.pipeline import pipeline
+from pirlib.pipeline_test import p2, p3
+from pirlib.pir import Package
+from pirlib.pir_format import (
+    FORMAT_VERSION,
+    MAGIC,
+    decode_package,
+    dump_package,
+    encode_package,
+    load_package,
+)
+from pirlib.task import task
+
+
+@task(config={"nested": {"list": [1, 2.5, None, True]}}, framework=AdaptDL(max_replicas=2))
+def configured(inp: FilePath) -> FilePath:
+    return inp
+
+
+@pipeline
+def configured_pipeline(inp: FilePath) -> FilePath:
+    return configured(inp)
+
+
+@pytest.mark.parametrize("pipeline_def", [p2, p3, configured_pipeline])
+def test_binary_roundtrip(pipeline_def):
+    package = pipeline_def.package()
+    package.graphs[0].meta.annotations = {"owner": "pirlib"}
+    # Decodes to the same package as loading its YAML.
+    expected = dacite.from_dict(
+        data_class=Package, data=yaml.safe_load(yaml.dump(dataclasses.asdict(package)))
+    )
+    data = encode_package(package)
+    assert data.startswith(MAGIC)
+    assert decode_package(data) == expected
+
+
+@pytest.mark.parametrize("fmt", ["yaml", "binary"])
+def test_load_detects_format(fmt, tmp_path):
+    package = p3.package()
+    with open(tmp_path / "package", "w") as f:
+        dump_package(package, f, fmt)
+    with open(tmp_path / "package", "rb") as f:
+        assert load_package(f) == package
+    with pytest.raises(ValueError, match="unknown package format"):
+        dump_package(package, io.StringIO(), "xml")
+
+
+def test_decode_errors():
+    data = encode_package(p3.package())
+    for version in (FORMAT_VERSION - 1, FORMAT_VERSION + 1):
+        other = MAGIC + bytes([version]) + data[len(MAGIC) + 1 :]
+        with pytest.raises(ValueError, match="unsupported binary PIR package version"):
+            decode_package(other)
+    with pytest.raises(ValueError, match="malformed"):
+        decode_package(data[:-10])
+    with pytest.raises(ValueError, match="not a binary PIR package"):
+        decode_package(b"graphs: []")
+
+
+def _package() -> Package:
+    # p3 references graphs through subgraphs, and p2 is unrelated to it.
+    graphs = {graph.id: graph for graph in p3.package().graphs + p2.package().graphs}
+    return Package(graphs=list(graphs.values()))
+
+
+@pytest.mark.parametrize("fmt", ["yaml", "binary"])
+def test_load_single_graph(fmt, tmp_path):
+    package = _package()
+    with open(tmp_path / "package", "w") as f:
+        dump_package(package, f, fmt)
+    for graph in package.graphs:
+        with open(tmp_path / "package", "rb") as f:
+            loaded = load_package(f, graph_id=graph.id)
+        # The graph comes first, followed by the graphs it references.
+        assert loaded.graphs[0] == graph
+        assert loaded.flatten_graph(graph.id) == package.flatten_graph(graph.id)
+        referenced = {subgraph.graph_id for g in loaded.graphs for subgraph in g.subgraphs}
+        assert {g.id for g in loaded.graphs} == {graph.id} | referenced
+    with open(tmp_path / "package", "rb") as f:
+        with pytest.raises(ValueError, match="graph with id 'missing' not found"):
+            load_package(f, graph_id="missing")
+
+
+def test_decode_single_graph_skips_others():
+    package = _package()
+    data = bytearray(encode_package(package))
+    # Corrupt the first graph, which follows the header and the index.
+    (size,) = struct.unpack(">I", data[len(MAGIC) + 1 : len(MAGIC) + 5])
+    start = len(MAGIC) + 5 + size
+    data[start : start + 8] = bytes(8)
+    with pytest.raises(ValueError, match="malformed"):
+        decode_package(bytes(data))
+    # Graphs which don't reference the first graph can still be decoded.
+    graph = package.graphs[-1]
+    assert decode_package(bytes(data), graph_id=graph.id).graphs == [graph]
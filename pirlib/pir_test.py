@@ -0,0 +1,91 @@
+import copy
+import pickle
+
+import pytest
+from pirlib.pir import (
+    DataSource,
+    Entrypoint,
+    Graph,
+    GraphInput,
+    GraphOutput,
+    Input,
+    Node,
+    Output,
+    Package,
+    ValidationError,
+)
+
+
+def _graph(graph_id: str) -> Graph:
+    return Graph(
+        id=graph_id,
+        inputs=[GraphInput(id="a", iotype="FILE"), GraphInput(id="b", iotype="FILE")],
+        outputs=[GraphOutput(id="out", iotype="FILE", source=DataSource(graph_input_id="a"))],
+    )
+
+
+def test_find_by_id_index():
+    graph = _graph("g")
+    assert graph.find_input("b") is graph.inputs[1]
+    assert graph.find_output("out") is graph.outputs[0]
+    assert graph.find_node("a") is None and graph.find_subgraph("a") is None
+    # The index follows appends, replaced lists and renamed items.
+    graph.inputs.append(GraphInput(id="c", iotype="FILE"))
+    assert graph.find_input("c") is graph.inputs[2]
+    graph.inputs = [GraphInput(id="d", iotype="FILE")]
+    assert graph.find_input("a") is None and graph.find_input("d") is graph.inputs[0]
+    graph.inputs[0].id = "e"
+    assert graph.find_input("d") is None
+    # Items renamed or replaced in place are found under their new ID right away.
+    graph.outputs[0].id = "renamed"
+    assert graph.find_output("renamed") is graph.outputs[0]
+    graph.inputs[0] = GraphInput(id="f", iotype="FILE")
+    assert graph.find_input("f") is graph.inputs[0]
+    graph.inputs[0] = GraphInput(id="e", iotype="FILE")
+    # Duplicate IDs resolve to the first item.
+    graph.inputs.append(GraphInput(id="e", iotype="DIRECTORY"))
+    assert graph.find_input("e").iotype == "FILE"
+
+
+def test_find_graph_index():
+    package = Package(graphs=[_graph("g"), _graph("h")])
+    assert package.find_graph("h") is package.graphs[1]
+    assert package.find_graph("missing") is None
+    # Indexes are not copied along with the package.
+    for clone in [copy.deepcopy(package), pickle.loads(pickle.dumps(package))]:
+        assert "_id_indexes" not in vars(clone)
+        assert clone.find_graph("h") is clone.graphs[1]
+        assert clone == package
+
+
+def _node(node_id: str, *provider_ids: str) -> Node:
+    entrypoints = {"main": Entrypoint(version="v1", handler="m:h", runtime="python")}
+    inputs = [
+        Input(id=f"in{idx}", iotype="FILE", source=DataSource(node_id=p, output_id="out"))
+        for idx, p in enumerate(provider_ids)
+    ]
+    return Node(
+        id=node_id,
+        entrypoints=entrypoints,
+        inputs=inputs,
+        outputs=[Output(id="out", iotype="FILE")],
+    )
+
+
+def test_topological_order():
+    graph = Graph(id="g", nodes=[_node("c", "b", "a"), _node("a"), _node("b", "a"), _node("d")])
+    assert [node.id for node in graph.topological_order()] == ["a", "d", "b", "c"]
+    graph.validate()
+
+
+def test_cycle_path():
+    graph = Graph(
+        id="g", nodes=[_node("a"), _node("b", "a", "d"), _node("c", "b"), _node("d", "c")]
+    )
+    with pytest.raises(
+        ValidationError, match="cycle detected: node 'b' -> node 'c' -> node 'd' -> node 'b'"
+    ):
+        graph.validate()
+    graph = Graph(id="g", nodes=[_node("a", "a")])
+    with pytest.raises(ValidationError, match="cycle detected: node 'a' -> node 'a'"):
+        graph.topological_order()
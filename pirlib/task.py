@@ -1,16 +1,34 @@
+import asyncio
 import contextvars
 import copy
 import functools
 import inspect
+import warnings
 from dataclasses import dataclass
-from typing import Any, Callable, Dict, Optional
+from typing import Any, Callable, Dict, Optional, Tuple
 
 import typeguard
 
 import pirlib.pir
 from pirlib.backends.inproc import InprocBackend
-from pirlib.cache import cache_directory, fetch_directory, generate_cache_key
+from pirlib.cache import (
+    CacheLease,
+    MemoCache,
+    cache_dataframe,
+    cache_directory,
+    cache_file,
+    cache_writer,
+    fetch_outputs,
+    generate_cache_key,
+    generate_inputs_cache_key,
+    output_cache_key,
+    record_lookup,
+    snapshot_dataframe,
+    snapshot_path,
+    task_digest,
+)
 from pirlib.handlers.v1 import HandlerV1, HandlerV1Context, HandlerV1Event
+from pirlib.iotypes import pytype_to_iotype
 from pirlib.package import package_task, recurse_hint, task_call
 from pirlib.utils import PerformanceTimer
 
@@ -21,6 +39,7 @@ _TASK_CONTEXT = contextvars.ContextVar("_TASK_CONTEXT")
 class TaskContext:
     config: Dict[str, Any]
     output: Any
+    cache_key: Optional[str] = None
 
 
 def task_context() -> TaskContext:
@@ -66,9 +85,33 @@ class TaskInstance(object):
                 param.annotation,
                 input_value,
             )
+        memo = self.defn.memo
+        if memo is not None:
+            config = {k: v for k, v in self.config.items() if k not in _UNCACHED_CONFIG}
+            memo_key = memo.key(inputs, config)
+            return_value = memo.get(memo_key)
+            if return_value is not None:
+                return return_value
         backend = InprocBackend()
         outputs = backend.execute(package, self.name, self.config, inputs=inputs)
-        return recurse_hint(lambda name, hint: outputs[name], "return", sig.return_annotation)
+        return_value = recurse_hint(
+            lambda name, hint: outputs[name], "return", sig.return_annotation
+        )
+        if memo is not None:
+            memo.put(memo_key, return_value)
+        return return_value
+
+
+def _warn_store_failed(task_name: str, output_name: str, exc: Exception) -> None:
+    warnings.warn(f"failed to cache output '{output_name}' of task '{task_name}': {exc!r}")
+
+
+async def _run_blocking(func: Callable, *args) -> Any:
+    # Run a blocking function in the default executor, in a copy of the current context
+    # so that it sees the task context.
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(None, functools.partial(context.run, func, *args))
 
 
 class TaskDefinition(HandlerV1):
@@ -79,11 +122,13 @@ class TaskDefinition(HandlerV1):
         name: Optional[str] = None,
         config: Optional[dict] = None,
         framework: Optional[pirlib.pir.Framework] = None,
+        memo: Optional[MemoCache] = None,
     ):
         self._func = func if func is None else typeguard.typechecked(func)
         self._name = name if name else getattr(func, "__name__", None)
         self._config = copy.deepcopy(config) if config else {}
         self._framework = framework
+        self._memo = memo
 
     @property
     def func(self):
@@ -101,6 +146,11 @@ class TaskDefinition(HandlerV1):
     def framework(self):
         return self._framework
 
+    @property
+    def memo(self) -> Optional[MemoCache]:
+        """Memo of the return values of direct calls to the task, if enabled."""
+        return self._memo
+
     def __call__(self, *args, **kwargs):
         if len(args) == 1 and callable(args[0]) and not kwargs:
             wrapper = TaskDefinition(
@@ -108,6 +158,7 @@ class TaskDefinition(HandlerV1):
                 name=self.name,
                 config=self.config,
                 framework=self.framework,
+                memo=self.memo,
             )
             functools.update_wrapper(wrapper, args[0])
             return wrapper
@@ -131,46 +182,190 @@ class TaskDefinition(HandlerV1):
         """
         print("Add cache to func: {}()".format(func.__name__))
 
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def run_coro_with_cache(*args, **kwargs):
+                # Hashing, fetching, storing and the cache lease are blocking file I/O,
+                # which is run in the default executor so that other nodes on the event
+                # loop go on.
+                outputs = self._cached_outputs()
+                cache_key = await _run_blocking(self._cache_key, args, kwargs)
+                values = await _run_blocking(fetch_outputs, outputs, cache_key)
+                if values is not None:
+                    await _run_blocking(record_lookup, True)
+                    return self._return_value(values)
+                async with CacheLease(cache_key) as lease:
+                    values = await _run_blocking(fetch_outputs, outputs, cache_key)
+                    if values is not None:
+                        await _run_blocking(record_lookup, True)
+                        return self._return_value(values)
+                    await _run_blocking(record_lookup, False)
+                    return_value = await func(*args, **kwargs)
+                    await _run_blocking(
+                        self._cache_outputs, outputs, cache_key, return_value, lease
+                    )
+                return return_value
+
+            print("Cache has been added to {}()".format(func.__name__))
+            return run_coro_with_cache
+
         @functools.wraps(func)
         def run_func_with_cache(*args, **kwargs):
-            try:
-                key_file_param = self._config.get("cache_key_file")
-
-                if key_file_param is None:
-                    raise ValueError("Cache is enabled but `cache_key_file` is not set.")
-
-                key_file = kwargs[key_file_param]
-            except KeyError:
-                raise ValueError("Specified parameter for `cache_key_file` doesn't exist.")
-
-            # Generate cache key from the key file.
-            cache_key = generate_cache_key(key_file)
+            outputs = self._cached_outputs()
+            cache_key = self._cache_key(args, kwargs)
 
             # Try to fetch the outputs in case the key is already present
-            ok = fetch_directory(dir_path=task_context().output, cache_key=cache_key)
+            values = fetch_outputs(outputs, cache_key)
+            if values is not None:
+                record_lookup(hit=True)
+                return self._return_value(values)
+
+            # Only the holder of the lease computes the outputs, other workers
+            # missing on the same key wait for it and fetch what it cached.
+            with CacheLease(cache_key) as lease:
+                values = fetch_outputs(outputs, cache_key)
+                if values is not None:
+                    record_lookup(hit=True)
+                    return self._return_value(values)
+                record_lookup(hit=False)
 
-            if not ok:
                 # In case the key is not already present in cache
                 # invoke the function to generate the outputs.
                 return_value = func(*args, **kwargs)
 
                 # Use the key to cache the outputs.
-                cache_directory(task_context().output, cache_key)
-
-            else:
-                # In case the key is already present in cache.
-                return_value = task_context().output
+                self._cache_outputs(outputs, cache_key, return_value, lease)
             return return_value
 
         print("Cache has been added to {}()".format(func.__name__))
         return run_func_with_cache
 
+    def _cache_key(self, args, kwargs) -> str:
+        if task_context().cache_key is not None:
+            # Computed by the backend already, e.g. by the cache check of an Argo node.
+            return task_context().cache_key
+        if self._config.get("cache_key_file") is not None:
+            try:
+                key_file = kwargs[self._config["cache_key_file"]]
+            except KeyError:
+                raise ValueError("Specified parameter for `cache_key_file` doesn't exist.")
+
+            # Generate cache key from the key file.
+            return generate_cache_key(key_file)
+
+        # Generate cache key from all inputs, the config and the code of the task.
+        sig = inspect.signature(self.func)
+        inputs = {}
+        for name, value in sig.bind(*args, **kwargs).arguments.items():
+            recurse_hint(
+                lambda n, h, v: inputs.__setitem__(n, v),
+                name,
+                sig.parameters[name].annotation,
+                value,
+            )
+        return generate_inputs_cache_key(inputs, self.cache_digest(task_context().config))
+
+    def cache_digest(self, config: Dict[str, Any]) -> str:
+        """
+        Hash of the code of the task and of the config of a node, which is the part of
+        its cache keys which doesn't depend on the inputs, see
+        :func:`pirlib.cache.task_digest`.
+        """
+        config = {k: v for k, v in config.items() if k not in _UNCACHED_CONFIG}
+        return task_digest(config, _source_code(self.func))
+
+    def _cached_outputs(self) -> Dict[str, Tuple[str, Any]]:
+        # Map the name of each output to its iotype and allocated location.
+        outputs = {}
+
+        def add_output(name, hint, value):
+            iotype = pytype_to_iotype(hint)
+            if iotype not in _CACHE_FUNCTIONS:
+                raise ValueError(
+                    f"caching is not supported for output '{name}' of task '{self.name}' "
+                    f"with iotype {iotype}"
+                )
+            outputs[name] = (iotype, value)
+
+        sig = inspect.signature(self.func)
+        recurse_hint(add_output, "return", sig.return_annotation, task_context().output)
+        return outputs
+
+    def _cache_outputs(
+        self,
+        outputs: Dict[str, Tuple[str, Any]],
+        cache_key: str,
+        return_value: Any,
+        lease: CacheLease,
+    ) -> None:
+        writes = []
+        recurse_hint(
+            lambda name, hint, value: writes.append((name, value)),
+            "return",
+            inspect.signature(self.func).return_annotation,
+            return_value,
+        )
+
+        stores = []
+        for name, value in writes:
+            iotype, _ = outputs[name]
+            key = output_cache_key(cache_key, name)
+            if iotype == "DATAFRAME" and cache_writer().write_behind:
+                # Serialize right away, since downstream nodes get the same object and
+                # may modify it before the background write.
+                try:
+                    stores.append((name, snapshot_dataframe(value, key)))
+                except Exception as exc:
+                    _warn_store_failed(self.name, name, exc)
+            elif iotype in ("FILE", "DIRECTORY") and cache_writer().write_behind:
+                # Likewise, stage the files since downstream nodes may modify or remove
+                # them, and backends may release them, before the background write.
+                try:
+                    stores.append((name, snapshot_path(value, key, _CACHE_FUNCTIONS[iotype])))
+                except Exception as exc:
+                    _warn_store_failed(self.name, name, exc)
+            else:
+                stores.append((name, functools.partial(_CACHE_FUNCTIONS[iotype], value, key)))
+
+        def write():
+            try:
+                for name, store in stores:
+                    # A failed store only means a miss later on, it never fails the task.
+                    try:
+                        store()
+                    except Exception as exc:
+                        _warn_store_failed(self.name, name, exc)
+            finally:
+                # Other workers waiting for the lease can fetch the outputs now.
+                lease.release()
+
+        # The lease is released once the outputs are written, which may happen in the
+        # background after the task has returned.
+        lease.detach()
+        cache_writer().submit(write)
+
+    def _return_value(self, values: Dict[str, Any]) -> Any:
+        sig = inspect.signature(self.func)
+        return recurse_hint(lambda name, hint: values[name], "return", sig.return_annotation)
+
     def timer_wrapper(self, func):
         """
         Wrape this function by timer.
         """
         print("Add timer to func: {}()".format(func.__name__))
 
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def run_coro_with_timer(*args, **kwargs):
+                with PerformanceTimer(self.func.__name__):
+                    return_value = await func(*args, **kwargs)
+                return return_value
+
+            print("Timer has been added to {}()".format(func.__name__))
+            return run_coro_with_timer
+
         @functools.wraps(func)
         def run_func_with_timer(*args, **kwargs):
             with PerformanceTimer(self.func.__name__):
@@ -180,14 +375,63 @@ class TaskDefinition(HandlerV1):
         print("Timer has been added to {}()".format(func.__name__))
         return run_func_with_timer
 
+    def is_async(self) -> bool:
+        return inspect.iscoroutinefunction(self.func)
+
     def run_handler(
         self,
         event: HandlerV1Event,
         context: HandlerV1Context,
     ) -> None:
+        if self.is_async():
+            # Coroutine tasks executed by a synchronous backend get their own event loop.
+            return asyncio.run(self.run_handler_async(event, context))
+        func, args, kwargs, task_context = self._prepare_call(event, context)
+        token = _TASK_CONTEXT.set(task_context)
+        try:
+            return_value = func(*args, **kwargs)
+        finally:
+            _TASK_CONTEXT.reset(token)
+        self._set_outputs(event, return_value)
+
+    async def run_handler_async(
+        self,
+        event: HandlerV1Event,
+        context: HandlerV1Context,
+    ) -> None:
+        if not self.is_async():
+            return await super().run_handler_async(event, context)
+        func, args, kwargs, task_context = self._prepare_call(event, context)
+        token = _TASK_CONTEXT.set(task_context)
+        try:
+            return_value = await func(*args, **kwargs)
+        finally:
+            _TASK_CONTEXT.reset(token)
+        self._set_outputs(event, return_value)
+
+    def fetch_cached(
+        self,
+        event: HandlerV1Event,
+        context: HandlerV1Context,
+    ) -> bool:
+        if not self._config.get("cache"):
+            return False
+        _, args, kwargs, task_context = self._prepare_call(event, context, wrap=False)
+        token = _TASK_CONTEXT.set(task_context)
+        try:
+            outputs = self._cached_outputs()
+            values = fetch_outputs(outputs, self._cache_key(args, kwargs))
+        finally:
+            _TASK_CONTEXT.reset(token)
+        if values is None:
+            return False
+        self._set_outputs(event, self._return_value(values))
+        return True
+
+    def _prepare_call(self, event: HandlerV1Event, context: HandlerV1Context, wrap: bool = True):
         inputs, outputs = event.inputs, event.outputs
         sig = inspect.signature(self.func)
-        task_context = TaskContext(context.node.config, None)
+        task_context = TaskContext(context.node.config, None, context.cache_key)
         task_context.output = recurse_hint(
             lambda name, hint: outputs[name], "return", sig.return_annotation
         )
@@ -198,28 +442,45 @@ class TaskDefinition(HandlerV1):
                 kwargs[param.name] = value
             else:
                 args.append(value)
-        token = _TASK_CONTEXT.set(task_context)
 
         # Wrap the function with PIRlib features if they are enabled.
-        try:
-            func = self.func
-            if self._config != None:
-                if self._config.get("cache"):
-                    func = self.cache_wrapper(func)
-                if self._config.get("timer"):
-                    func = self.timer_wrapper(func)
-            return_value = func(*args, **kwargs)
-        finally:
-            _TASK_CONTEXT.reset(token)
-
+        func = self.func
+        if wrap and self._config != None:
+            if self._config.get("cache"):
+                func = self.cache_wrapper(func)
+            if self._config.get("timer"):
+                func = self.timer_wrapper(func)
+        return func, args, kwargs, task_context
+
+    def _set_outputs(self, event: HandlerV1Event, return_value: Any) -> None:
+        sig = inspect.signature(self.func)
         recurse_hint(
-            lambda n, h, v: outputs.__setitem__(n, v),
+            lambda n, h, v: event.outputs.__setitem__(n, v),
             "return",
             sig.return_annotation,
             return_value,
         )
 
 
+# Functions which cache the outputs of each iotype.
+_CACHE_FUNCTIONS = {
+    "DIRECTORY": cache_directory,
+    "FILE": cache_file,
+    "DATAFRAME": cache_dataframe,
+}
+
+# Config entries which don't affect the outputs of a task.
+_UNCACHED_CONFIG = ("timer",)
+
+
+def _source_code(func: Callable) -> str:
+    func = inspect.unwrap(func)
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        return func.__code__.co_code.hex()
+
+
 def task(
     func: Optional[Callable] = None,
     *,  # Keyword-only arguments below.
@@ -229,6 +490,9 @@ def task(
     framework: Optional[pirlib.pir.Framework] = None,
     cache: Optional[bool] = False,
     cache_key_file: Optional[str] = "",
+    memo: Optional[bool] = False,
+    memo_max_entries: Optional[int] = 128,
+    memo_max_bytes: Optional[int] = None,
 ) -> TaskDefinition:
     # Create config if not provided
     config = config if config else {}
@@ -242,18 +506,22 @@ def task(
             config[f"{f_name}/{k}"] = v
     config = config if config else {}
     config["timer"] = timer
-    # Modify config if caching is enabled.
+    # Modify config if caching is enabled. Without a `cache_key_file`, the cache key
+    # is computed from all inputs, the config and the code of the task.
     if cache:
+        config["cache"] = True
         if cache_key_file:
-            config["cache"] = True
             config["cache_key_file"] = cache_key_file
-        else:
-            raise ValueError("Cache is enabled but `cache_key_file` is not set.")
+    # Direct calls to the task with the same inputs and config can reuse the return
+    # value of an earlier call in the same process.
+    if memo:
+        memo = MemoCache(max_entries=memo_max_entries, max_bytes=memo_max_bytes)
     wrapper = TaskDefinition(
         func=func,
         name=name,
         config=config,
         framework=framework,
+        memo=memo or None,
     )
     functools.update_wrapper(wrapper, func)
     return wrapper
@@ -1,3 +1,6 @@
+import collections
+
+import pandas
 import pytest
 from pirlib.task import task
 from pirlib.frameworks.adaptdl import AdaptDL
@@ -24,6 +27,15 @@ def broken_task(inp: FilePath) -> DirectoryPath:
     return inp
 
 
+_calls = collections.Counter()
+
+
+@task(memo=True, memo_max_entries=2)
+def memo_task(inp: FilePath) -> pandas.DataFrame:
+    _calls["memo_task"] += 1
+    return pandas.DataFrame({"text": [inp.read_text()]})
+
+
 test_dir_path = DirectoryPath("test")
 test_file_path = FilePath("test/file.txt")
 
@@ -59,3 +71,45 @@ def test_wrong_input_type():
 def test_wrong_output_type():
     with pytest.raises(TypeError):
         broken_task(test_file_path)
+
+
+def test_memo(tmp_path):
+    _calls.clear()
+    memo_task.memo.clear()
+    inp = FilePath(tmp_path / "inp.txt")
+    inp.write_text("a")
+    first = memo_task(inp)
+    # Callers get copies, which they may modify.
+    first["text"] = "modified"
+    second = memo_task(inp)
+    assert second["text"][0] == "a" and second is not first
+    assert memo_task.instance("other")(inp)["text"][0] == "a"
+    assert _calls["memo_task"] == 1
+    # Keyed on the contents of the inputs, not their paths.
+    inp.write_text("b")
+    assert memo_task(inp)["text"][0] == "b"
+    assert _calls["memo_task"] == 2
+    stats = memo_task.memo.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 2, 2)
+    assert dummy_task.memo is None
+
+
+@task(memo=True)
+def memo_path_task(inp: FilePath) -> FilePath:
+    _calls["memo_path_task"] += 1
+    out = task.context().output
+    out.write_text(inp.read_text())
+    return out
+
+
+def test_memo_removed_path(tmp_path):
+    _calls.clear()
+    inp = FilePath(tmp_path / "inp.txt")
+    inp.write_text("a")
+    out = memo_path_task(inp)
+    assert memo_path_task(inp) == out
+    assert _calls["memo_path_task"] == 1
+    # A memoized path which was removed is a miss.
+    out.unlink()
+    assert memo_path_task(inp).read_text() == "a"
+    assert _calls["memo_path_task"] == 2
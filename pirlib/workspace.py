@@ -0,0 +1,154 @@
+import errno
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+from pirlib.cache import resolve_cache_links
+from pirlib.iotypes import DirectoryPath, FilePath
+
+WORKSPACE_DIR = os.getenv("PIRLIB_WORKSPACE_DIR")
+
+
+class Workspace(object):
+    """
+    Scratch space for the node outputs of a single run. Each run gets its own root
+    directory, and the output ``<output id>`` of node ``<node id>`` is laid out as
+    ``<run dir>/nodes/<node id>/<output id>``. Graph outputs are moved out of the way
+    into ``<run dir>/outputs`` (or a caller-provided location) with an atomic rename,
+    and everything else is removed when the run ends.
+
+    The workspace root can be put on a tmpfs such as ``/dev/shm`` for small outputs
+    which are read right away, or on a local SSD for large outputs.
+
+    A workspace created for an explicit run ID lives at ``<root>/pirlib-run-<run id>``
+    and is kept if the run fails, so that the run can be resumed later.
+    """
+
+    def __init__(self, root: Optional[str] = None, run_id: Optional[str] = None):
+        """
+        :param root: Directory in which the run directory is created. Defaults to
+                ``$PIRLIB_WORKSPACE_DIR``, or the system temporary directory.
+        :param run_id: Optional ID of the run, which makes the run directory location
+                predictable and keeps it around if the run fails.
+        """
+        root = root or WORKSPACE_DIR or tempfile.gettempdir()
+        os.makedirs(root, exist_ok=True)
+        if run_id is None:
+            self._path = tempfile.mkdtemp(prefix="pirlib-run-", dir=root)
+        else:
+            self._path = os.path.join(root, f"pirlib-run-{run_id}")
+            os.makedirs(self._path, exist_ok=True)
+        self._run_id = run_id
+        self._nodes_dir = os.path.join(self._path, "nodes")
+        self._outputs_dir = os.path.join(self._path, "outputs")
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def run_id(self) -> Optional[str]:
+        return self._run_id
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None or self._run_id is None:
+            self.cleanup()
+
+    def allocate(self, node_id: str, output_id: str, iotype: str):
+        """
+        Create the location for a node output.
+
+        :param node_id: ID of the node producing the output.
+        :param output_id: ID of the output.
+        :param iotype: iotype of the output.
+        :return: A new empty :obj:`DirectoryPath` or :obj:`FilePath`, or ``None`` if
+                the iotype isn't stored on the filesystem.
+        """
+        node_dir = os.path.join(self._nodes_dir, node_id.replace(os.sep, "_"))
+        path = os.path.join(node_dir, output_id.replace(os.sep, "_"))
+        # Discard any partial output left behind by an earlier attempt of the run.
+        self.release(path)
+        if iotype == "DIRECTORY":
+            os.makedirs(path)
+            return DirectoryPath(path)
+        elif iotype == "FILE":
+            os.makedirs(node_dir, exist_ok=True)
+            open(path, "x").close()
+            return FilePath(path)
+        return None
+
+    def contains(self, path: os.PathLike) -> bool:
+        """
+        Whether the given path lies inside the node outputs of this workspace.
+        """
+        path = os.path.abspath(path)
+        return path.startswith(os.path.join(os.path.abspath(self._nodes_dir), ""))
+
+    def publish(
+        self,
+        path: os.PathLike,
+        name: str,
+        dest: Optional[os.PathLike] = None,
+        move: bool = True,
+    ):
+        """
+        Move a node output out of the workspace so that it outlives the run. The move
+        is an atomic rename unless ``dest`` is on a different filesystem. Symbolic
+        links into the cache directory are replaced with copies of their targets, so
+        that the output doesn't depend on the cache entry it was fetched from.
+
+        :param path: Path of the node output inside this workspace.
+        :param name: Name of the published output, used when ``dest`` is not given.
+        :param dest: Destination of the output. Defaults to ``<run dir>/outputs/<name>``.
+        :param move: Copy the output instead of moving it if ``False``, e.g. because it
+                is part of another output which is published as well.
+        :return: The new location of the output, with the same type as ``path``.
+        """
+        if dest is None:
+            os.makedirs(self._outputs_dir, exist_ok=True)
+            dest = os.path.join(self._outputs_dir, name.replace(os.sep, "_"))
+        if not move:
+            if os.path.isdir(path):
+                shutil.copytree(path, dest, dirs_exist_ok=True)
+            else:
+                shutil.copy2(path, dest)
+            return type(path)(dest)
+        try:
+            os.replace(path, dest)
+        except OSError as err:
+            if err.errno not in (errno.EXDEV, errno.ENOTEMPTY, errno.EEXIST):
+                raise
+            # Fall back to copying across filesystems or into a non-empty directory.
+            if os.path.isdir(path):
+                shutil.copytree(path, dest, dirs_exist_ok=True)
+                shutil.rmtree(path)
+            else:
+                shutil.move(path, dest)
+        resolve_cache_links(dest)
+        return type(path)(dest)
+
+    def release(self, path: os.PathLike) -> None:
+        """
+        Delete a node output which is no longer needed.
+        """
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def cleanup(self) -> None:
+        """
+        Remove everything but the published outputs. The run directory itself is only
+        kept if outputs were published into it.
+        """
+        if not os.path.exists(self._outputs_dir):
+            shutil.rmtree(self._path, ignore_errors=True)
+            return
+        for name in os.listdir(self._path):
+            path = os.path.join(self._path, name)
+            if path != self._outputs_dir:
+                self.release(path)